@@ -63,8 +63,13 @@ if __name__ == '__main__':
             'Intended Audience :: Science/Research',
             'License :: OSI Approved :: Apache Software License',
             'Programming Language :: Python',
+            'Programming Language :: Python :: 3',
+            'Programming Language :: Python :: 3 :: Only',
+            'Programming Language :: Python :: 3.7',
+            'Programming Language :: Python :: 3.8',
             'Topic :: Scientific/Engineering :: Bio-Informatics',
         ],
+        python_requires='>=3.7',
         install_requires=[
             'numpy>=1.7, <2.0',
             'pandas>=0.15',
@@ -75,8 +80,15 @@ if __name__ == '__main__':
             'serializable>=0.0.8',
             'sercol>=0.0.2',
         ],
+        extras_require={
+            'parquet': ['pyarrow>=1.0'],
+        },
         entry_points={
             'console_scripts': [
-                'varcode-variants = varcode.cli.variants_script:main'
+                'varcode-variants = varcode.cli.variants_script:main',
+                'varcode-index = varcode.cli.index_script:main',
+                'varcode-serve = varcode.cli.serve_script:main',
+                'varcode-effects = varcode.cli.effects_script:main',
+                'varcode-annotate-vcf = varcode.cli.annotate_vcf_script:main',
             ]
         })
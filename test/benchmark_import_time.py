@@ -0,0 +1,46 @@
+"""
+Time how long it takes to import varcode (and optionally the
+varcode-variants command line script) in a fresh interpreter.
+
+Run as:
+    python %(prog)s --runs 10
+
+Use `python -X importtime -c "import varcode"` to see which modules
+take the longest to import.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__)
+
+parser.add_argument(
+    "--runs",
+    type=int,
+    default=5,
+    help="Number of fresh interpreters to time.")
+
+parser.add_argument(
+    "--module",
+    default="varcode",
+    help="Module to import, e.g. varcode.cli.variants_script")
+
+def time_import(module):
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c", "import %s" % module])
+    return time.time() - start
+
+def run():
+    args = parser.parse_args()
+    # time the interpreter by itself to subtract its startup
+    baseline = min(time_import("sys") for _ in range(args.runs))
+    timings = [time_import(args.module) for _ in range(args.runs)]
+    print("import %s: best %0.3f sec, mean %0.3f sec over %d runs" % (
+        args.module,
+        min(timings) - baseline,
+        sum(timings) / len(timings) - baseline,
+        args.runs))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,88 @@
+"""
+Time predicting the effects of variants serially and with thread pools of
+different sizes, e.g.:
+
+    python %(prog)s --vcf somatic.vcf --genome GRCh37 --threads 1 2 4 8
+
+Without a VCF or MAF, random substitutions in the small synthetic genome
+of the test data are annotated.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+import varcode
+
+from data import synthetic_genome, synthetic_reference_sequence
+
+parser = argparse.ArgumentParser(description=__doc__)
+
+parser.add_argument("--vcf", help="Path to VCF")
+
+parser.add_argument("--maf", help="Path to MAF")
+
+parser.add_argument(
+    "--genome",
+    help="Reference genome of the VCF, e.g. GRCh37")
+
+parser.add_argument(
+    "--n-variants",
+    type=int,
+    default=5000,
+    help="Number of random variants in the synthetic genome.")
+
+parser.add_argument(
+    "--threads",
+    type=int,
+    nargs="+",
+    default=[1, 2, 4, 8],
+    help="Thread pool sizes to time.")
+
+def synthetic_variants(genome, n):
+    sequence = synthetic_reference_sequence()
+    random.seed(0)
+    variants = []
+    for _ in range(n):
+        position = random.randint(1, len(sequence))
+        ref = sequence[position - 1]
+        alt = random.choice([b for b in "ACGT" if b != ref])
+        variants.append(varcode.Variant("1", position, ref, alt, genome))
+    return varcode.VariantCollection(variants, distinct=False)
+
+def run():
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        if args.vcf:
+            def load():
+                return varcode.load_vcf(args.vcf, genome=args.genome)
+        elif args.maf:
+            def load():
+                return varcode.load_maf(args.maf)
+        else:
+            genome = synthetic_genome(directory)
+            def load():
+                return synthetic_variants(genome, args.n_variants)
+        # annotate once so that the database and FASTA files are cached
+        load().effects()
+
+        # fresh Variant objects for each run, since they memoize effects
+        variants = load()
+        start = time.time()
+        variants.effects()
+        serial = time.time() - start
+        print("serial: %0.3f sec for %d variants" % (serial, len(variants)))
+        for n_threads in args.threads:
+            variants = load()
+            start = time.time()
+            variants.effects(executor="thread", n_threads=n_threads)
+            elapsed = time.time() - start
+            print("%d threads: %0.3f sec (%0.2fx serial)" % (
+                n_threads, elapsed, serial / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    run()
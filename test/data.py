@@ -17,6 +17,7 @@ Helper functions and shared datasets for tests
 """
 
 import os
+from pyensembl import Genome
 from varcode import Variant, VariantCollection, load_maf
 import pandas as pd
 
@@ -52,3 +53,44 @@ db_snp_variants = VariantCollection([
     snp_rs1537415,
     snp_rs3892097,
 ])
+
+def synthetic_genome(cache_directory_path):
+    """
+    Small genome with three genes on contig "1" (two protein coding, one on
+    each strand, and a lincRNA), indexed by pyensembl in the given directory.
+    """
+    genome = Genome(
+        reference_name="GRCh38",
+        annotation_name="varcode_synthetic",
+        annotation_version=1,
+        gtf_path_or_url=data_path("synthetic_annotation.gtf"),
+        transcript_fasta_paths_or_urls=[data_path("synthetic_cdna.fa")],
+        protein_fasta_paths_or_urls=[data_path("synthetic_pep.fa")],
+        cache_directory_path=cache_directory_path)
+    genome.index()
+    return genome
+
+def synthetic_reference_sequence():
+    """
+    Sequence of contig "1" of the synthetic genome, from which its
+    transcript sequences were taken.
+    """
+    with open(data_path("synthetic_genome.fa")) as f:
+        return "".join(line.strip() for line in f if line[0] != ">")
+
+def synthetic_variants(genome):
+    """
+    Variants in the UTRs, coding sequence, introns and splice sites of the
+    synthetic genome's transcripts, as well as in its lincRNA and
+    between genes.
+    """
+    sequence = synthetic_reference_sequence()
+    variants = []
+    for position in [101, 140, 160, 252, 300, 420, 850, 1300, 1700, 2400, 2800]:
+        ref = sequence[position - 1]
+        alt = "C" if ref == "A" else "A"
+        variants.append(Variant("1", position, ref, alt, ensembl=genome))
+    # frameshifts on both strands
+    variants.append(Variant("1", 160, sequence[159], "", ensembl=genome))
+    variants.append(Variant("1", 1700, "", "GG", ensembl=genome))
+    return VariantCollection(variants)
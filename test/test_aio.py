@@ -0,0 +1,129 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test loading and annotating variants with the asyncio coroutines of
+varcode.aio
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_, assert_raises
+from varcode import load_vcf
+from varcode.aio import (
+    _deadline,
+    _run_chunk,
+    _semaphore,
+    aiter_effects,
+    async_effects,
+    async_load_vcf,
+    set_max_concurrent_chunks,
+)
+
+from .data import synthetic_genome, synthetic_variants
+
+def _write_vcf(path, variants):
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.1\n")
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for variant in variants:
+            f.write("%s\t%d\t.\t%s\t%s\t.\tPASS\t.\n" % (
+                variant.contig,
+                variant.original_start,
+                variant.original_ref,
+                variant.original_alt))
+
+def test_async_load_vcf_and_effects():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        # only substitutions, since VCF indels need a reference base
+        variants = [v for v in synthetic_variants(genome) if v.is_snv]
+        path = os.path.join(directory, "variants.vcf")
+        _write_vcf(path, variants)
+        expected = load_vcf(path, genome=genome)
+
+        async def main():
+            loaded = await async_load_vcf(path, genome=genome, chunk_size=3)
+            effects = await async_effects(loaded, chunk_size=4)
+            streamed = [
+                effect async for effect in aiter_effects(loaded, chunk_size=2)]
+            return loaded, effects, streamed
+
+        loaded, effects, streamed = asyncio.run(main())
+        eq_(list(loaded), list(expected))
+        eq_(list(effects), list(expected.effects()))
+        eq_(streamed, list(expected.effects()))
+    finally:
+        shutil.rmtree(directory)
+
+def test_aiter_effects_concurrency_and_timeout():
+    directory = tempfile.mkdtemp()
+    try:
+        variants = synthetic_variants(synthetic_genome(directory))
+
+        async def main():
+            # many requests at once only run one chunk at a time, while the
+            # event loop keeps running other coroutines
+            ticks = []
+            async def ticker():
+                while True:
+                    ticks.append(None)
+                    await asyncio.sleep(0)
+            ticker_task = asyncio.ensure_future(ticker())
+            results = await asyncio.gather(*[
+                async_effects(variants, chunk_size=1) for _ in range(4)])
+            ticker_task.cancel()
+            assert len(ticks) > 1
+            with assert_raises(asyncio.TimeoutError):
+                await async_effects(variants, chunk_size=1, timeout=0)
+            return results
+
+        set_max_concurrent_chunks(1)
+        try:
+            results = asyncio.run(main())
+        finally:
+            set_max_concurrent_chunks(4)
+        for effects in results:
+            eq_(list(effects), list(variants.effects()))
+    finally:
+        shutil.rmtree(directory)
+
+def test_timed_out_chunk_holds_slot_until_it_finishes():
+    finish = threading.Event()
+
+    async def main():
+        with assert_raises(asyncio.TimeoutError):
+            await _run_chunk(None, _deadline(0.05), finish.wait)
+        # the function is still running in the executor
+        assert _semaphore().locked()
+        finish.set()
+        for _ in range(100):
+            if not _semaphore().locked():
+                break
+            await asyncio.sleep(0.01)
+        assert not _semaphore().locked()
+
+    set_max_concurrent_chunks(1)
+    try:
+        asyncio.run(main())
+    finally:
+        finish.set()
+        set_max_concurrent_chunks(4)
@@ -0,0 +1,72 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test annotation of multiple samples with shared variants
+"""
+
+from nose.tools import eq_
+from varcode import annotate_cohort, use_gtf_annotation
+from varcode.transcript_index import stop_using_transcript_index
+
+from .data import (
+    data_path,
+    ov_wustle_variants,
+    synthetic_variants,
+    tcga_ov_variants,
+)
+
+def test_annotate_cohort_shared_variants():
+    collections = [ov_wustle_variants, tcga_ov_variants, ov_wustle_variants]
+    effect_collections, report = annotate_cohort(collections)
+    eq_(len(effect_collections), 3)
+    eq_(report.n_variants, 2 * len(ov_wustle_variants) + len(tcga_ov_variants))
+    eq_(report.n_distinct_variants,
+        len(ov_wustle_variants) + len(tcga_ov_variants))
+    eq_(report.n_annotations_saved, len(ov_wustle_variants))
+    eq_(effect_collections[0], ov_wustle_variants.effects())
+    eq_(effect_collections[1], tcga_ov_variants.effects())
+    eq_(effect_collections[0].sources, ov_wustle_variants.sources)
+    # the same effect objects are shared between samples
+    assert all(
+        x is y for (x, y) in zip(effect_collections[0], effect_collections[2]))
+
+def test_annotate_cohort_parallel():
+    collections = [ov_wustle_variants, tcga_ov_variants]
+    serial_effects, _ = annotate_cohort(collections)
+    parallel_effects, _ = annotate_cohort(collections, n_jobs=2, chunk_size=2)
+    eq_(serial_effects, parallel_effects)
+
+def test_annotate_cohort_parallel_gtf_annotation():
+    # effects are sent back from the worker processes encoded, and decoded
+    # from the annotation of this process since the genome has no database
+    index = use_gtf_annotation(
+        data_path("synthetic_annotation.gtf"),
+        transcript_fasta_paths=data_path("synthetic_cdna.fa"),
+        protein_fasta_paths=data_path("synthetic_pep.fa"),
+        reference_name="GRCh38",
+        annotation_name="varcode_synthetic_gtf")
+    try:
+        variants = synthetic_variants(index.genome)
+        collections = [
+            variants, variants.clone_with_new_elements(list(variants)[:5])]
+        serial_effects, _ = annotate_cohort(collections)
+        parallel_effects, _ = annotate_cohort(
+            collections, n_jobs=2, chunk_size=2)
+        eq_(serial_effects, parallel_effects)
+        eq_(
+            [e.short_description for e in parallel_effects[0]],
+            [e.short_description for e in variants.effects()])
+    finally:
+        stop_using_transcript_index(index.genome)
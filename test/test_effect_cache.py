@@ -0,0 +1,80 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test persistent caching of predicted effects
+"""
+
+from __future__ import print_function, division, absolute_import
+import os
+import pickle
+import shutil
+import tempfile
+
+from nose.tools import eq_
+from varcode import Variant, EffectCache, load_maf
+from varcode.effects import Intergenic
+
+from .data import data_path
+
+def _make_cache(**kwargs):
+    directory = tempfile.mkdtemp()
+    return directory, EffectCache(os.path.join(directory, "effects.db"), **kwargs)
+
+def test_effect_cache_put_get():
+    directory, cache = _make_cache()
+    try:
+        variant = Variant("1", 10, "A", "G", ensembl=75)
+        eq_(cache.get(variant), None)
+        cache.put(variant, [Intergenic(variant)])
+        eq_(cache.get(variant), [Intergenic(variant)])
+        # a different Ensembl release isn't a cache hit
+        eq_(cache.get(Variant("1", 10, "A", "G", ensembl=77)), None)
+        eq_(cache.hits, 1)
+        eq_(cache.misses, 2)
+        # another process (or a reconstructed cache) sees the same entries
+        eq_(pickle.loads(pickle.dumps(cache)).get(variant), [Intergenic(variant)])
+    finally:
+        cache.close()
+        shutil.rmtree(directory)
+
+def test_effect_cache_eviction():
+    directory, cache = _make_cache(max_size_bytes=10 ** 6)
+    try:
+        variants = [Variant("1", i, "A", "G", ensembl=75) for i in range(1, 21)]
+        for variant in variants:
+            cache.put(variant, [Intergenic(variant)])
+        eq_(len(cache), 20)
+        cache.evict(max_size_bytes=cache.size_bytes() // 2)
+        assert len(cache) < 10
+        # the most recently added entries are kept
+        assert cache.get(variants[-1]) is not None
+    finally:
+        cache.close()
+        shutil.rmtree(directory)
+
+def test_effect_cache_variant_collection_effects():
+    directory, cache = _make_cache()
+    try:
+        # load the variants separately each time since effects are also
+        # memoized on Variant objects
+        first = load_maf(data_path("ov.wustle.subset5.maf")).effects(
+            cache=cache, memoize=False)
+        eq_(cache.hit_rate, 0.0)
+        variants = load_maf(data_path("ov.wustle.subset5.maf"))
+        eq_(variants.effects(cache=cache, memoize=False), first)
+        eq_(cache.hits, len(variants))
+    finally:
+        cache.close()
+        shutil.rmtree(directory)
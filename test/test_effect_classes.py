@@ -18,8 +18,14 @@ unit test but the goal of this test module is to make sure that there is
 at least one test for each effect class
 """
 
+import pickle
+
+from nose.tools import assert_raises, eq_
 from varcode import Variant
+from varcode.effects import effect_classes as effect_classes_module
 from varcode.effects import (
+    MutationEffect,
+    Intergenic,
     IncompleteTranscript,
     NoncodingTranscript,
     FivePrimeUTR,
@@ -37,6 +43,7 @@ from varcode.effects import (
     ExonLoss,
     ExonicSpliceSite,
     FrameShiftTruncation,
+    effect_priority,
     # TODO: SpliceDonor, SpliceReceptor
 )
 from pyensembl import ensembl_grch37, cached_release
@@ -600,3 +607,25 @@ def test_insertion_nonfinal_stop_gain():
         effect_class=PrematureStop,
         modifies_coding_sequence=True,
         modifies_protein_sequence=True)
+
+def test_effect_classes_use_slots():
+    variant = Variant("1", 10, "A", "G", ensembl_grch37)
+    effect = Intergenic(variant)
+    # fields are kept in slots, and effects don't have an instance dictionary
+    assert not hasattr(effect, "__dict__")
+    for effect_class in effect_classes_module.__dict__.values():
+        if isinstance(effect_class, type) and \
+                issubclass(effect_class, MutationEffect):
+            eq_(effect_class.__dictoffset__, 0, effect_class.__name__)
+    eq_(effect.sort_key, (effect.priority, 0, 0))
+    eq_(pickle.loads(pickle.dumps(effect)), effect)
+
+def test_effect_subclass_priority_not_inherited():
+    class CustomIntergenic(Intergenic):
+        __slots__ = ()
+
+    effect = CustomIntergenic(Variant("1", 10, "A", "G", ensembl_grch37))
+    with assert_raises(KeyError):
+        effect_priority(effect)
+    with assert_raises(KeyError):
+        effect.sort_key
@@ -70,3 +70,47 @@ def test_effect_collection_filter_by_effect_priority():
 def test_effect_collection_drop_silent_and_noncoding():
     # some of the predicted effects are non-coding so should get dropped
     assert len(tcga_ov_effects) > len(tcga_ov_effects.drop_silent_and_noncoding())
+
+def test_effect_collection_top_priority_effect_per_group():
+    # single pass over the effects should agree with grouping them first
+    for (group_effects, top_effects) in [
+            (ov_wustle_effects.groupby_variant(),
+             ov_wustle_effects.top_priority_effect_per_variant()),
+            (ov_wustle_effects.groupby_gene_id(),
+             ov_wustle_effects.top_priority_effect_per_gene_id()),
+            (ov_wustle_effects.groupby_transcript_id(),
+             ov_wustle_effects.top_priority_effect_per_transcript_id())]:
+        eq_(list(group_effects.keys()), list(top_effects.keys()))
+        for (key, effects) in group_effects.items():
+            eq_(top_effects[key], effects.top_priority_effect())
+
+def test_effect_collection_columnar_groupby_matches_groupby():
+    # grouping by the columnar index should give the same groups, in the
+    # same order, as grouping the effect objects one at a time
+    for (field, grouped) in [
+            ("variant", ov_wustle_effects.groupby_variant()),
+            ("transcript_id", ov_wustle_effects.groupby_transcript_id()),
+            ("gene_name", ov_wustle_effects.groupby_gene_name())]:
+        expected = ov_wustle_effects.groupby(
+            key_fn=lambda effect: getattr(effect, field))
+        eq_(list(grouped.keys()), list(expected.keys()))
+        for (key, effects) in grouped.items():
+            eq_(list(effects), list(expected[key]))
+
+def test_effect_collection_filter_by_transcript_expression():
+    transcript_ids = sorted(set(
+        effect.transcript_id
+        for effect in ov_wustle_effects
+        if effect.transcript_id))
+    expression = {
+        transcript_id: float(i)
+        for (i, transcript_id) in enumerate(transcript_ids)
+    }
+    filtered = ov_wustle_effects.filter_by_transcript_expression(
+        expression, min_expression_value=2.0)
+    eq_(
+        list(filtered),
+        [
+            effect for effect in ov_wustle_effects
+            if expression.get(effect.transcript_id, 0.0) > 2.0
+        ])
@@ -0,0 +1,108 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test streaming effect predictions with the varcode-effects script
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+import pandas as pd
+from varcode import EffectCollection, VariantCollection, register_genome
+from varcode.cli.effects_script import main as run_script
+
+from .data import synthetic_genome, synthetic_variants
+
+GENOME_KEY = "varcode_synthetic_effects_script"
+
+def _run(directory, output_name, *args):
+    output_path = os.path.join(directory, output_name)
+    run_script([
+        "--json-variants", os.path.join(directory, "variants.ndjson"),
+        "--output", output_path,
+        "--chunk-size", "4",
+        "--progress-interval", "0",
+    ] + list(args))
+    return output_path
+
+def test_effects_script_outputs():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        register_genome(genome, GENOME_KEY)
+        variants = synthetic_variants(genome)
+        variants.to_ndjson(os.path.join(directory, "variants.ndjson"))
+        expected = variants.effects(raise_on_error=False)
+        expected_df = expected.to_dataframe()
+
+        # chunks are annotated and written in order of the input
+        tsv_df = pd.read_csv(
+            _run(directory, "effects.tsv.gz"), sep="\t", keep_default_na=False)
+        eq_(list(tsv_df.columns), list(expected_df.columns))
+        eq_(list(tsv_df.effect), list(expected_df.effect))
+        eq_(list(tsv_df.start), list(expected_df.start))
+
+        eq_(
+            list(EffectCollection.from_ndjson(
+                _run(directory, "effects.ndjson", "--jobs", "2"))),
+            list(expected))
+
+        top_df = pd.read_csv(
+            _run(directory, "top.csv", "--top-effect-only"),
+            keep_default_na=False)
+        eq_(
+            list(top_df.effect),
+            [str(effect) for effect in variants.top_effects()])
+
+        parquet_df = pd.read_parquet(_run(
+            directory,
+            "canonical.parquet",
+            "--transcript-filter", "canonical"))
+        eq_(
+            list(parquet_df.effect),
+            [
+                str(effect)
+                for effect in variants.effects(
+                    raise_on_error=False, transcript_filter="canonical")
+            ])
+    finally:
+        shutil.rmtree(directory)
+
+def test_effects_script_variant_args():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        register_genome(genome, GENOME_KEY)
+        variant = synthetic_variants(genome)[0]
+        VariantCollection([]).to_ndjson(
+            os.path.join(directory, "variants.ndjson"))
+        output_path = _run(
+            directory,
+            "effects.txt",
+            "--genome", GENOME_KEY,
+            "--variant", variant.contig, str(variant.start), variant.ref,
+            variant.alt)
+        df = pd.read_csv(output_path, sep="\t", keep_default_na=False)
+        eq_(list(df.effect), [str(effect) for effect in variant.effects()])
+
+        # an empty output still has a header
+        output_path = _run(directory, "empty.tsv")
+        eq_(len(pd.read_csv(output_path, sep="\t")), 0)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,148 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test annotating variants with a TranscriptIndex built directly from a GTF
+file and FASTA files, without a pyensembl database
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import pickle
+import shutil
+import tempfile
+
+from nose.tools import eq_, assert_raises
+from varcode import EffectCollection, TranscriptIndex, use_gtf_annotation
+from varcode.effects.transcript_filter import canonical_transcript_id
+from varcode.transcript_index import stop_using_transcript_index
+
+from .data import data_path, synthetic_genome, synthetic_variants
+from .test_transcript_index import TRANSCRIPT_ATTRIBUTES, _attribute_or_error
+
+def _gtf_index(**kwargs):
+    return TranscriptIndex.from_gtf(
+        data_path("synthetic_annotation.gtf"),
+        transcript_fasta_paths=data_path("synthetic_cdna.fa"),
+        protein_fasta_paths=data_path("synthetic_pep.fa"),
+        reference_name="GRCh38",
+        annotation_name="varcode_synthetic_gtf",
+        **kwargs)
+
+def test_gtf_index_matches_genome():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        index = _gtf_index()
+        eq_(index.transcript_ids(), genome.transcript_ids())
+        eq_(index.gene_ids(), genome.gene_ids())
+        for transcript in genome.transcripts():
+            indexed = index.transcript_by_id(transcript.id)
+            eq_(indexed.exons, transcript.exons)
+            for attribute in TRANSCRIPT_ATTRIBUTES + ["start", "end"]:
+                eq_(
+                    _attribute_or_error(indexed, attribute),
+                    _attribute_or_error(transcript, attribute),
+                    "%s of %s" % (attribute, transcript.id))
+        for gene in genome.genes():
+            indexed = index.gene_by_id(gene.id)
+            eq_(
+                (indexed.name, indexed.biotype, indexed.start, indexed.end),
+                (gene.name, gene.biotype, gene.start, gene.end))
+            eq_(
+                index.canonical_transcript_id(gene.id),
+                canonical_transcript_id(genome, gene.id))
+        eq_(
+            index.exon_by_id("ENSE90000000002"),
+            genome.exon_by_id("ENSE90000000002"))
+        # nothing is looked up in a database
+        with assert_raises(ValueError):
+            index.transcript_by_id("ENST00000000000")
+        eq_(index.transcript_ids_at_locus("2", 1, 1000), [])
+    finally:
+        shutil.rmtree(directory)
+
+def test_effects_with_gtf_annotation():
+    directory = tempfile.mkdtemp()
+    try:
+        expected = [
+            [effect.short_description for effect in variant.effects()]
+            for variant in synthetic_variants(synthetic_genome(directory))
+        ]
+        index = use_gtf_annotation(
+            data_path("synthetic_annotation.gtf"),
+            transcript_fasta_paths=data_path("synthetic_cdna.fa"),
+            protein_fasta_paths=data_path("synthetic_pep.fa"),
+            reference_name="GRCh38",
+            annotation_name="varcode_synthetic_gtf")
+        try:
+            eq_(
+                [
+                    [effect.short_description for effect in variant.effects()]
+                    for variant in synthetic_variants(index.genome)
+                ],
+                expected)
+            assert not os.path.exists(
+                index.genome.download_cache.cache_directory_path)
+        finally:
+            stop_using_transcript_index(index.genome)
+        # the genome of the GTF gets recreated when the index is loaded
+        path = index.save(os.path.join(directory, "gtf.index"))
+        loaded = TranscriptIndex.load(path)
+        eq_(loaded.genome, index.genome)
+        eq_(loaded.transcript_ids(), index.transcript_ids())
+    finally:
+        shutil.rmtree(directory)
+
+def test_gtf_index_contig_subset():
+    index = _gtf_index(contigs=["2"])
+    eq_(len(index), 0)
+    eq_(index.transcript_ids_at_locus("1", 1, 3000), [])
+
+def test_gtf_effects_round_trip():
+    directory = tempfile.mkdtemp()
+    index = use_gtf_annotation(
+        data_path("synthetic_annotation.gtf"),
+        transcript_fasta_paths=data_path("synthetic_cdna.fa"),
+        protein_fasta_paths=data_path("synthetic_pep.fa"),
+        reference_name="GRCh38",
+        annotation_name="varcode_synthetic_gtf")
+    try:
+        effects = synthetic_variants(index.genome).effects()
+        path = os.path.join(directory, "effects.parquet")
+        effects.to_parquet(path)
+        for loaded in [
+                pickle.loads(pickle.dumps(effects)),
+                EffectCollection.from_parquet(path, genome=index.genome)]:
+            eq_(list(loaded), list(effects))
+            # transcripts are looked up in the index again, since the genome
+            # has no database
+            eq_(
+                [
+                    (effect.transcript.gene, effect.transcript.exons)
+                    for effect in loaded
+                    if effect.transcript is not None
+                ],
+                [
+                    (effect.transcript.gene, effect.transcript.exons)
+                    for effect in effects
+                    if effect.transcript is not None
+                ])
+            eq_(
+                [effect.short_description for effect in loaded],
+                [effect.short_description for effect in effects])
+    finally:
+        stop_using_transcript_index(index.genome)
+        shutil.rmtree(directory)
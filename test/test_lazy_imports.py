@@ -0,0 +1,57 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test that importing varcode doesn't import its heavy dependencies until
+they're needed
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import subprocess
+import sys
+
+from nose.tools import eq_
+import varcode
+
+def _imported_modules(code, modules):
+    """
+    Run code in a fresh interpreter and return which of the given modules
+    it imported.
+    """
+    script = "%s\nimport sys\nprint(','.join(m for m in %r if m in sys.modules))" % (
+        code, modules)
+    output = subprocess.check_output([sys.executable, "-c", script])
+    return [m for m in output.decode("utf-8").strip().split(",") if m]
+
+def test_import_varcode_skips_pandas_pyvcf_biopython():
+    eq_(
+        _imported_modules(
+            "import varcode\nvarcode.Variant('1', 5, 'A', 'G', ensembl=75)",
+            ["pandas", "vcf", "Bio", "sercol"]),
+        [])
+
+def test_import_variants_script_skips_pkg_resources():
+    eq_(
+        _imported_modules(
+            "import varcode.cli.variants_script",
+            ["pandas", "vcf", "pkg_resources"]),
+        [])
+
+def test_lazy_attributes():
+    eq_(varcode.EffectCollection.__name__, "EffectCollection")
+    eq_(varcode.effects.Substitution.__name__, "Substitution")
+    assert "load_vcf" in dir(varcode)
+    for name in varcode.__all__:
+        assert hasattr(varcode, name), name
@@ -16,6 +16,7 @@ from __future__ import absolute_import
 from nose.tools import eq_
 from pyensembl import ensembl_grch37 as ensembl
 from varcode import Variant
+from varcode.maf import iter_maf_chunks
 import pandas as pd
 
 from .data import tcga_ov_variants, ov_wustle_variants
@@ -72,3 +73,15 @@ def test_maf_aa_changes():
         key = (variant.contig, variant.start)
         expected = expected_changes[key]
         yield (check_same_aa_change, variant, expected)
+
+def test_iter_maf_chunks():
+    chunks = list(iter_maf_chunks(ov_wustle_variants.path, chunk_size=2))
+    eq_([len(chunk) for chunk in chunks], [2, 2, 1])
+    eq_(
+        sorted(variant for chunk in chunks for variant in chunk),
+        list(ov_wustle_variants))
+    for chunk in chunks:
+        for variant in chunk:
+            eq_(
+                chunk.metadata[variant]["Tumor_Sample_Barcode"],
+                ov_wustle_variants.metadata[variant]["Tumor_Sample_Barcode"])
@@ -0,0 +1,96 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test writing and reading variants and effects as newline delimited JSON
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+from varcode import (
+    EffectCollection,
+    Variant,
+    VariantCollection,
+    load_maf,
+    load_vcf,
+)
+from varcode.cli.variant_args import (
+    make_variants_parser,
+    variant_collection_from_args,
+)
+from varcode.ndjson import iter_variants_ndjson
+
+from .data import data_path
+
+def _load_somatic_vcf():
+    return load_vcf(data_path("somatic_hg19_14muts.vcf"), genome="GRCh37")
+
+def test_vcf_ndjson_round_trip():
+    variants = _load_somatic_vcf()
+    variants.metadata[variants[0]]["source"] = "caller"
+    directory = tempfile.mkdtemp()
+    try:
+        for name in ["variants.ndjson", "variants.ndjson.gz"]:
+            path = os.path.join(directory, name)
+            variants.to_ndjson(path)
+            loaded = VariantCollection.from_ndjson(path)
+            eq_(list(loaded), list(variants))
+            eq_(loaded.sources, variants.sources)
+            for variant in variants:
+                eq_(
+                    dict(loaded.metadata[variant]),
+                    dict(variants.metadata[variant]))
+            eq_(list(iter_variants_ndjson(path)), list(variants))
+    finally:
+        shutil.rmtree(directory)
+
+def test_ndjson_keeps_original_alleles():
+    variant = Variant("chr1", 10, "CTT", "T", ensembl=75)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "variants.ndjson")
+        VariantCollection([variant]).to_ndjson(path)
+        loaded = list(iter_variants_ndjson(path))[0]
+        eq_(loaded, variant)
+        eq_(loaded.original_start, 10)
+        eq_(loaded.original_ref, "CTT")
+        eq_(loaded.original_alt, "T")
+    finally:
+        shutil.rmtree(directory)
+
+def test_cli_json_variants_ndjson():
+    variants = _load_somatic_vcf()
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "variants.ndjson")
+        variants.to_ndjson(path)
+        args = make_variants_parser().parse_args(["--json-variants", path])
+        eq_(list(variant_collection_from_args(args)), list(variants))
+    finally:
+        shutil.rmtree(directory)
+
+def test_effects_ndjson_round_trip():
+    effects = load_maf(data_path("tcga_ov.head.maf")).effects()
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "effects.ndjson")
+        effects.to_ndjson(path)
+        eq_(list(EffectCollection.from_ndjson(path)), list(effects))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,93 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test saving VariantCollection and EffectCollection objects as Parquet files
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+from varcode import EffectCollection, VariantCollection, load_maf, load_vcf
+
+from .data import data_path
+
+def _load_somatic_vcf():
+    return load_vcf(data_path("somatic_hg19_14muts.vcf"), genome="GRCh37")
+
+def test_vcf_parquet_round_trip():
+    directory = tempfile.mkdtemp()
+    try:
+        variants = _load_somatic_vcf()
+        variants.metadata[variants[0]]["source"] = "caller"
+        path = os.path.join(directory, "variants.parquet")
+        variants.to_parquet(path)
+        loaded = VariantCollection.from_parquet(path)
+        eq_(list(loaded), list(variants))
+        eq_(loaded.metadata[variants[0]]["source"], "caller")
+        eq_(loaded.sources, variants.sources)
+        for variant in variants:
+            eq_(
+                dict(loaded.metadata[variant]),
+                dict(variants.metadata[variant]))
+    finally:
+        shutil.rmtree(directory)
+
+def test_parquet_contig_filter():
+    directory = tempfile.mkdtemp()
+    try:
+        variants = _load_somatic_vcf()
+        path = os.path.join(directory, "variants.parquet")
+        variants.to_parquet(path)
+        # contigs can be given with or without a 'chr' prefix
+        for contig in ["10", "chr10"]:
+            loaded = VariantCollection.from_parquet(path, contigs=[contig])
+            eq_(
+                list(loaded),
+                [v for v in variants if v.contig in ("10", "chr10")])
+    finally:
+        shutil.rmtree(directory)
+
+def test_maf_parquet_round_trip():
+    directory = tempfile.mkdtemp()
+    try:
+        variants = load_maf(data_path("tcga_ov.head.maf"))
+        path = os.path.join(directory, "variants.parquet")
+        variants.to_parquet(path)
+        loaded = VariantCollection.from_parquet(path)
+        eq_(list(loaded), list(variants))
+        for variant in variants:
+            eq_(
+                loaded.metadata[variant]["Tumor_Sample_Barcode"],
+                variants.metadata[variant]["Tumor_Sample_Barcode"])
+    finally:
+        shutil.rmtree(directory)
+
+def test_effects_parquet_round_trip():
+    directory = tempfile.mkdtemp()
+    try:
+        effects = load_maf(data_path("tcga_ov.head.maf")).effects()
+        path = os.path.join(directory, "effects.parquet")
+        effects.to_parquet(path)
+        loaded = EffectCollection.from_parquet(path)
+        eq_(list(loaded), list(effects))
+        eq_(
+            loaded.to_dataframe().to_dict(),
+            effects.to_dataframe().to_dict())
+    finally:
+        shutil.rmtree(directory)
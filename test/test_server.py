@@ -0,0 +1,187 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test predicting effects with a long-running AnnotationServer
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import assert_raises, eq_
+from varcode import (
+    AnnotationServer,
+    register_genome,
+    request_effects,
+    use_gtf_annotation,
+)
+from varcode.server import _request, server_metrics
+from varcode.transcript_index import stop_using_transcript_index
+
+from .data import data_path, synthetic_genome, synthetic_variants
+
+def _descriptions(effects):
+    return [effect.short_description for effect in effects]
+
+def test_server_effects():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        register_genome(genome, "varcode_synthetic_server")
+        variants = synthetic_variants(genome)
+        expected = variants.effects()
+        server = AnnotationServer([genome], port=0).start()
+        try:
+            effects = request_effects(variants, server.address)
+            eq_(effects, list(expected))
+            eq_(_descriptions(effects), _descriptions(expected))
+            eq_(
+                request_effects(variants, server.address, top=True),
+                [variant.top_effect() for variant in variants])
+
+            # variants can also be sent as JSON objects in the default genome
+            body = json.dumps([
+                {"contig": v.contig, "start": v.start, "ref": v.ref,
+                 "alt": v.alt}
+                for v in variants
+            ])
+            lines = _request(
+                server.address, "POST", "/effects",
+                body=body.encode("utf-8")).splitlines()
+            eq_(len(lines), len(expected) + 1)
+
+            # concurrent requests get annotated in shared batches
+            results = {}
+            def worker(i):
+                results[i] = request_effects(variants, server.address)
+            threads = [
+                threading.Thread(target=worker, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for i in range(4):
+                eq_(results[i], list(expected))
+
+            metrics = server_metrics(server.address)
+            eq_(metrics["requests"], 7)
+            eq_(metrics["variants"], 7 * len(variants))
+            eq_(metrics["request_errors"], 0)
+            assert metrics["batches"] <= 7
+        finally:
+            server.shutdown()
+            stop_using_transcript_index(genome)
+    finally:
+        shutil.rmtree(directory)
+
+def test_server_unix_socket_with_workers():
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        register_genome(genome, "varcode_synthetic_server")
+        variants = synthetic_variants(genome)
+        expected = _descriptions(variants.effects())
+        server = AnnotationServer(
+            [genome],
+            socket_path=os.path.join(directory, "varcode.sock"),
+            n_workers=2).start()
+        try:
+            eq_(
+                _descriptions(request_effects(variants, server.address)),
+                expected)
+            eq_(server_metrics(server.address)["workers"], 2)
+        finally:
+            server.shutdown()
+            stop_using_transcript_index(genome)
+        assert not os.path.exists(os.path.join(directory, "varcode.sock"))
+    finally:
+        shutil.rmtree(directory)
+
+def test_server_workers_with_gtf_annotation():
+    # workers send back encoded effects, which the server decodes from the
+    # index since the genome has no database
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return
+    directory = tempfile.mkdtemp()
+    index = use_gtf_annotation(
+        data_path("synthetic_annotation.gtf"),
+        transcript_fasta_paths=data_path("synthetic_cdna.fa"),
+        protein_fasta_paths=data_path("synthetic_pep.fa"),
+        reference_name="GRCh38",
+        annotation_name="varcode_synthetic_gtf")
+    try:
+        variants = synthetic_variants(index.genome)
+        expected = _descriptions(variants.effects())
+        server = AnnotationServer(
+            [index.genome],
+            socket_path=os.path.join(directory, "varcode.sock"),
+            n_workers=2).start()
+        try:
+            eq_(
+                _descriptions(request_effects(variants, server.address)),
+                expected)
+        finally:
+            server.shutdown()
+    finally:
+        stop_using_transcript_index(index.genome)
+        shutil.rmtree(directory)
+
+def test_server_rejects_unserved_genomes_and_large_bodies():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        register_genome(genome, "varcode_synthetic_server")
+        server = AnnotationServer([genome], port=0, max_body_size=200).start()
+        try:
+            # genomes which weren't warmed up would get installed
+            body = json.dumps(
+                [{"contig": "1", "start": 1001, "ref": "A", "alt": "G"}])
+            assert_raises(
+                ValueError,
+                _request,
+                server.address, "POST", "/effects?genome=GRCh37",
+                body.encode("utf-8"))
+            body = json.dumps([{
+                "contig": "1", "start": 1001, "ref": "A", "alt": "G",
+                "genome": "GRCh37"}])
+            assert_raises(
+                ValueError,
+                _request,
+                server.address, "POST", "/effects",
+                body.encode("utf-8"))
+
+            body = json.dumps([
+                {"contig": "1", "start": 1001 + i, "ref": "A", "alt": "G"}
+                for i in range(10)
+            ])
+            try:
+                _request(
+                    server.address, "POST", "/effects", body.encode("utf-8"))
+                assert False, "Expected a 413 response"
+            except ValueError as e:
+                assert "413" in str(e), e
+            eq_(server_metrics(server.address)["request_errors"], 2)
+        finally:
+            server.shutdown()
+            stop_using_transcript_index(genome)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,47 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coding effects are computed once for transcripts which share the same coding
+sequence, make sure each transcript still gets the same effect it would
+have gotten on its own.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+from nose.tools import eq_
+from pyensembl import ensembl_grch37
+from varcode import Variant
+from varcode.effects import predict_variant_effects
+from varcode.effects.effect_prediction import predict_variant_effect_on_transcript
+
+def _check_shared_coding_effects(variant):
+    effects = predict_variant_effects(variant, raise_on_error=True)
+    eq_(len(effects), len(variant.transcripts))
+    for effect in effects:
+        if effect.transcript is None:
+            continue
+        eq_(effect.gene, effect.transcript.gene)
+        eq_(effect, predict_variant_effect_on_transcript(
+            variant=variant,
+            transcript=effect.transcript))
+
+def test_tp53_r273h_shared_coding_effects():
+    # TP53 has many isoforms with the same coding sequence
+    _check_shared_coding_effects(
+        Variant("17", 7577120, "C", "T", ensembl=ensembl_grch37))
+
+def test_tp53_frameshift_shared_coding_effects():
+    _check_shared_coding_effects(
+        Variant("17", 7577120, "C", "", ensembl=ensembl_grch37))
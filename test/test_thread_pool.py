@@ -0,0 +1,126 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test predicting the effects of a VariantCollection with a pool of threads
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_, assert_raises
+from varcode import EffectCache
+from varcode.effects.thread_pool import use_thread_local_connections
+
+from .data import synthetic_genome, synthetic_variants
+
+def test_thread_pool_effects_match_serial():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        expected = synthetic_variants(genome).effects()
+        for n_threads in [1, 4]:
+            effects = synthetic_variants(genome).effects(
+                executor="thread", n_threads=n_threads)
+            eq_(list(effects), list(expected))
+            eq_(
+                [e.short_description for e in effects],
+                [e.short_description for e in expected])
+            # the connections of the pool's threads are closed with it
+            eq_(len(use_thread_local_connections(genome)), 0)
+        with assert_raises(ValueError):
+            synthetic_variants(genome).effects(executor="fork")
+    finally:
+        shutil.rmtree(directory)
+
+def test_thread_local_connections():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        connections = use_thread_local_connections(genome)
+        eq_(use_thread_local_connections(genome), connections)
+        main_connection = genome.db.connection
+        thread_connections = []
+        def worker():
+            thread_connections.append(genome.db.connection)
+            genome.transcript_ids_at_locus("1", 1, 3000)
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(len(set(map(id, thread_connections + [main_connection]))), 4)
+        eq_(len(connections), 3)
+        connections.close()
+        eq_(len(connections), 0)
+    finally:
+        shutil.rmtree(directory)
+
+def test_effect_cache_shared_by_threads():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        cache = EffectCache(os.path.join(directory, "effects.db"))
+        expected = synthetic_variants(genome).effects(
+            executor="thread", n_threads=4, cache=cache)
+        eq_(cache.misses, len(synthetic_variants(genome)))
+        effects = synthetic_variants(genome).effects(
+            executor="thread", n_threads=4, cache=cache)
+        eq_(list(effects), list(expected))
+        eq_(cache.hits, len(synthetic_variants(genome)))
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_thread_local_connections_quote_database_path():
+    directory = tempfile.mkdtemp(suffix=" #?%")
+    try:
+        genome = synthetic_genome(directory)
+        expected = synthetic_variants(genome).effects()
+        effects = synthetic_variants(genome).effects(
+            executor="thread", n_threads=4)
+        eq_(list(effects), list(expected))
+    finally:
+        shutil.rmtree(directory)
+
+class DatabaseWithoutGetConnection(object):
+    """
+    Database of a pyensembl release which doesn't look up its connection
+    with _get_connection.
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        if name == "_get_connection":
+            raise AttributeError(name)
+        return getattr(self.db, name)
+
+def test_thread_pool_without_get_connection():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        expected = synthetic_variants(genome).effects()
+        genome._db = DatabaseWithoutGetConnection(genome.db)
+        eq_(use_thread_local_connections(genome), None)
+        # the variants are annotated with the default connection
+        effects = synthetic_variants(genome).effects(
+            executor="thread", n_threads=4)
+        eq_(list(effects), list(expected))
+    finally:
+        shutil.rmtree(directory)
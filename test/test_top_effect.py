@@ -0,0 +1,54 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Make sure that predicting only the top priority effect of a variant gives the
+same result as predicting all of its effects.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+from nose.tools import eq_
+from pyensembl import ensembl_grch37
+from varcode import Variant, load_maf, load_vcf
+
+from .data import data_path
+
+def _check_top_effect(variant):
+    expected = variant.effects(memoize=False).top_priority_effect()
+    eq_(variant.top_effect(), expected)
+
+def test_top_effect_snv():
+    # TP53 R273H
+    _check_top_effect(Variant("17", 7577120, "C", "T", ensembl=ensembl_grch37))
+
+def test_top_effect_frameshift():
+    _check_top_effect(Variant("17", 7577120, "C", "", ensembl=ensembl_grch37))
+
+def test_top_effect_intergenic():
+    _check_top_effect(Variant(
+        "1", 1, "N", "A",
+        ensembl=ensembl_grch37,
+        allow_extended_nucleotides=True))
+
+def test_top_effects_maf():
+    variants = load_maf(data_path("tcga_ov.head.maf"))
+    eq_(
+        list(variants.top_effects()),
+        list(variants.effects(memoize=False).top_priority_effect_per_variant().values()))
+
+def test_top_effects_vcf():
+    variants = load_vcf(data_path("somatic_hg19_14muts.vcf"), genome="GRCh37")
+    for variant in variants:
+        _check_top_effect(variant)
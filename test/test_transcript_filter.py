@@ -0,0 +1,154 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test restricting effect prediction to canonical, coding or allowed transcripts
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, assert_raises
+from pyensembl import Database, Genome, ensembl_grch37
+from varcode import TranscriptIndex, Variant, VariantCollection, load_maf
+from varcode.effects import (
+    Intragenic,
+    IncompleteTranscript,
+    NoncodingTranscript,
+    canonical_transcript_id,
+)
+
+from .data import data_path, synthetic_genome, synthetic_reference_sequence
+
+# TP53 R273H
+variant = Variant("17", 7577120, "C", "T", ensembl=ensembl_grch37)
+
+def test_coding_transcript_filter():
+    all_effects = variant.effects()
+    coding_effects = variant.effects(transcript_filter="coding")
+    assert len(coding_effects) < len(all_effects)
+    for effect in coding_effects:
+        assert effect.transcript.is_protein_coding
+        assert effect.transcript.complete
+        assert not isinstance(effect, (IncompleteTranscript, NoncodingTranscript))
+    eq_(
+        set(e.transcript_id for e in coding_effects),
+        set(
+            e.transcript_id for e in all_effects
+            if e.transcript.is_protein_coding and e.transcript.complete))
+
+def test_canonical_transcript_filter():
+    effects = variant.effects(transcript_filter="canonical")
+    eq_(len(effects), 1)
+    transcript = effects[0].transcript
+    eq_(transcript.id, canonical_transcript_id(ensembl_grch37, transcript.gene_id))
+    # canonical transcript has the longest coding sequence of TP53
+    eq_(
+        len(transcript.coding_sequence),
+        max(
+            len(t.coding_sequence)
+            for t in transcript.gene.transcripts
+            if t.coding_sequence is not None))
+
+def test_transcript_id_allow_list():
+    transcript_ids = variant.transcript_ids[:2]
+    effects = variant.effects(transcript_filter=transcript_ids)
+    eq_(sorted(e.transcript_id for e in effects), sorted(transcript_ids))
+
+def test_unknown_transcript_filter():
+    with assert_raises(ValueError):
+        variant.effects(transcript_filter="everything")
+
+def test_variant_collection_transcript_filter():
+    variants = load_maf(data_path("ov.wustle.subset5.maf"))
+    effects = variants.effects(transcript_filter="coding")
+    for effect in effects:
+        if effect.transcript is not None:
+            assert effect.transcript.is_protein_coding
+            assert effect.transcript.complete
+    # every variant still has at least one effect
+    eq_(set(e.variant for e in effects), set(variants))
+
+def test_filtered_out_genes_have_no_effects():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        sequence = synthetic_reference_sequence()
+        # in the lincRNA SYNC, which has no coding transcripts
+        lincrna_variant = Variant(
+            "1", 2400, sequence[2399], "A", ensembl=genome)
+        assert isinstance(
+            lincrna_variant.effects().top_priority_effect(),
+            NoncodingTranscript)
+        eq_(len(lincrna_variant.effects(transcript_filter="coding")), 0)
+        eq_(lincrna_variant.top_effect(transcript_filter="coding"), None)
+        # in the coding sequence of SYNA-001 and the retained intron of
+        # SYNA-002
+        coding_variant = Variant(
+            "1", 420, sequence[419], "A", ensembl=genome)
+        effects = coding_variant.effects(
+            transcript_filter=["ENST90000000002"])
+        eq_([e.transcript_id for e in effects], ["ENST90000000002"])
+        effects = coding_variant.effects(transcript_filter=["ENST00000000000"])
+        eq_(len(effects), 0)
+        assert not any(isinstance(e, Intragenic) for e in effects)
+        variants = VariantCollection([lincrna_variant, coding_variant])
+        eq_(
+            [e.variant for e in variants.top_effects(transcript_filter="coding")],
+            [coding_variant])
+    finally:
+        shutil.rmtree(directory)
+
+def test_canonical_transcript_tag():
+    directory = tempfile.mkdtemp()
+    try:
+        gtf_path = os.path.join(directory, "tagged.gtf")
+        with open(data_path("synthetic_annotation.gtf")) as f_in:
+            with open(gtf_path, "w") as f_out:
+                for line in f_in:
+                    if "\ttranscript\t" in line and "ENST90000000002" in line:
+                        line = line.rstrip("\n") + (
+                            ' tag "basic"; tag "Ensembl_canonical";\n')
+                    f_out.write(line)
+        genome = Genome(
+            reference_name="GRCh38",
+            annotation_name="varcode_synthetic_tagged",
+            annotation_version=1,
+            gtf_path_or_url=gtf_path,
+            cache_directory_path=directory)
+        # pyensembl.Genome drops the tags, unlike a database of all columns
+        genome._db = Database(
+            gtf_path=gtf_path,
+            cache_directory_path=os.path.join(directory, "all_columns"))
+        genome.db.connect_or_create()
+        # SYNA-001 has the longest coding sequence, but SYNA-002 is tagged
+        eq_(
+            canonical_transcript_id(genome, "ENSG90000000001"),
+            "ENST90000000002")
+        eq_(
+            canonical_transcript_id(genome, "ENSG90000000002"),
+            "ENST90000000003")
+        index = TranscriptIndex.from_gtf(
+            gtf_path,
+            transcript_fasta_paths=data_path("synthetic_cdna.fa"),
+            protein_fasta_paths=data_path("synthetic_pep.fa"),
+            reference_name="GRCh38",
+            annotation_name="varcode_synthetic_tagged_gtf")
+        eq_(index.canonical_transcript_id("ENSG90000000001"), "ENST90000000002")
+        eq_(index.canonical_transcript_id("ENSG90000000002"), "ENST90000000003")
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,206 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test predicting effects with transcripts read from a memory-mapped
+TranscriptIndex instead of the pyensembl database
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+
+from nose.tools import eq_
+from varcode import (
+    TranscriptIndex,
+    build_transcript_index,
+    preload,
+    use_transcript_index,
+)
+from varcode.transcript_index import (
+    IndexedTranscript,
+    _pack_bases,
+    _unpack_bases,
+    stop_using_transcript_index,
+)
+
+from .data import synthetic_genome, synthetic_variants
+
+TRANSCRIPT_ATTRIBUTES = [
+    "name",
+    "biotype",
+    "strand",
+    "gene_name",
+    "exon_intervals",
+    "complete",
+    "sequence",
+    "coding_sequence",
+    "five_prime_utr_sequence",
+    "three_prime_utr_sequence",
+    "start_codon_spliced_offsets",
+    "stop_codon_spliced_offsets",
+    "protein_id",
+    "protein_sequence",
+]
+
+def _attribute_or_error(transcript, attribute):
+    try:
+        return getattr(transcript, attribute)
+    except ValueError:
+        # e.g. codon offsets of noncoding transcripts
+        return ValueError
+
+def test_pack_bases():
+    sequence = b"ACGTNNACGTRYacgtA"
+    packed = _pack_bases(sequence)
+    for start in range(len(sequence)):
+        for end in range(start, len(sequence) + 1):
+            eq_(
+                _unpack_bases(*(packed + (start, end))),
+                sequence[start:end].decode("ascii"))
+
+def test_indexed_transcripts_match_genome():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        path = build_transcript_index(
+            genome, path=os.path.join(directory, "index.bin"))
+        index = TranscriptIndex.load(path, genome=genome)
+        eq_(len(index), 4)
+        for transcript in genome.transcripts():
+            indexed = index.transcript_by_id(transcript.id)
+            assert isinstance(indexed, IndexedTranscript)
+            eq_(indexed, transcript)
+            eq_(transcript, indexed)
+            eq_(indexed.exons, transcript.exons)
+            for attribute in TRANSCRIPT_ATTRIBUTES:
+                eq_(
+                    _attribute_or_error(indexed, attribute),
+                    _attribute_or_error(transcript, attribute),
+                    "%s of %s" % (attribute, transcript.id))
+        for (contig, start, end) in [
+                ("1", 1, 3000),
+                ("chr1", 250, 260),
+                ("1", 1200, 1200),
+                ("1", 2700, 2900),
+                ("2", 1, 100)]:
+            eq_(
+                index.transcript_ids_at_locus(contig, start, end),
+                genome.transcript_ids_at_locus(contig, start, end))
+            eq_(
+                index.gene_ids_at_locus(contig, start, end),
+                genome.gene_ids_at_locus(contig, start, end))
+            eq_(
+                index.gene_names_at_locus(contig, start, end),
+                genome.gene_names_at_locus(contig, start, end))
+    finally:
+        shutil.rmtree(directory)
+
+def test_effects_with_transcript_index():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        expected = [
+            variant.effects() for variant in synthetic_variants(genome)]
+        path = build_transcript_index(
+            genome, path=os.path.join(directory, "index.bin"))
+        use_transcript_index(path, genome=genome)
+        try:
+            # effect prediction shouldn't query the database at all
+            def fail(*args, **kwargs):
+                raise AssertionError("Unexpected database query")
+            genome.db.query = genome.db.run_sql_query = fail
+            genome.db.column_values_at_locus = fail
+            effects = [
+                variant.effects() for variant in synthetic_variants(genome)]
+            for (indexed_effects, database_effects) in zip(effects, expected):
+                eq_(list(indexed_effects), list(database_effects))
+                eq_(
+                    [e.short_description for e in indexed_effects],
+                    [e.short_description for e in database_effects])
+            for variant in synthetic_variants(genome):
+                eq_(
+                    variant.top_effect(),
+                    variant.effects().top_priority_effect())
+                variant.effects(transcript_filter="canonical")
+                variant.effects(transcript_filter="coding")
+            # pickled transcripts are looked up in the index again
+            effect = effects[1][0]
+            assert isinstance(effect.transcript, IndexedTranscript)
+            pickled = pickle.dumps(effect)
+            eq_(
+                type(pickle.loads(pickled).transcript).__name__,
+                "IndexedTranscript")
+        finally:
+            stop_using_transcript_index(genome)
+        # and become regular Transcript objects without it
+        eq_(type(pickle.loads(pickled).transcript).__name__, "Transcript")
+    finally:
+        shutil.rmtree(directory)
+
+def test_transcript_index_contig_subset():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        index = TranscriptIndex.from_genome(genome, contigs=["2"])
+        eq_(len(index), 0)
+        # contigs which weren't indexed are looked up in the genome
+        eq_(
+            index.transcript_ids_at_locus("1", 1, 3000),
+            genome.transcript_ids_at_locus("1", 1, 3000))
+        eq_(
+            index.transcript_by_id("ENST90000000001"),
+            genome.transcript_by_id("ENST90000000001"))
+    finally:
+        shutil.rmtree(directory)
+
+def _top_effect_descriptions(variants):
+    return [variant.top_effect().short_description for variant in variants]
+
+def test_preload_shared_memory():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        variants = synthetic_variants(genome)
+        expected = _top_effect_descriptions(variants)
+        index = preload(genome)
+        try:
+            assert index.path is None
+            assert index._shared_memory is not None
+            # pickled indices attach to the same shared memory
+            attached = pickle.loads(pickle.dumps(index))
+            eq_(attached._shared_memory.name, index._shared_memory.name)
+            eq_(attached.transcript_ids(), index.transcript_ids())
+            eq_(
+                _top_effect_descriptions(synthetic_variants(genome)),
+                expected)
+            if "fork" in multiprocessing.get_all_start_methods():
+                pool = multiprocessing.get_context("fork").Pool(2)
+                try:
+                    eq_(
+                        pool.map(
+                            _top_effect_descriptions,
+                            [list(variants)[:5], list(variants)[5:]]),
+                        [expected[:5], expected[5:]])
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            stop_using_transcript_index(genome)
+    finally:
+        shutil.rmtree(directory)
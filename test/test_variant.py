@@ -19,9 +19,9 @@ of shared prefix/suffix strings from ref/alt fields.
 
 from six.moves import cPickle as pickle
 
-from pyensembl import ensembl_grch38
+from pyensembl import Genome, ensembl_grch38
 
-from varcode import Variant
+from varcode import Variant, register_genome
 from nose.tools import eq_
 
 def test_insertion_shared_prefix():
@@ -151,6 +151,32 @@ def test_serialization():
         reconstituted = Variant.from_json(serialized)
         eq_(original, reconstituted)
 
+def test_compact_serialization():
+    variant = Variant("chr1", start=10, ref="CTT", alt="T", ensembl=75)
+    # the genome is referred to by its registry key rather than embedded
+    eq_(variant.to_dict()["ensembl"], "ensembl:75:homo_sapiens")
+    eq_(Variant.from_dict(variant.to_dict()), variant)
+    reconstituted = pickle.loads(pickle.dumps(variant))
+    assert reconstituted.ensembl is variant.ensembl
+    for field in ["contig", "start", "end", "ref", "alt", "original_contig",
+                  "original_start", "original_ref", "original_alt"]:
+        eq_(getattr(reconstituted, field), getattr(variant, field))
+    # pickling many variants with the same genome only stores its key once
+    assert len(pickle.dumps([variant] * 2 + [Variant("1", 5, "A", "G")])) < (
+        3 * len(pickle.dumps(variant)))
+
+def test_registered_genome_serialization():
+    genome = Genome(
+        reference_name="GRCh38",
+        annotation_name="test_annotation",
+        annotation_version=1,
+        gtf_path_or_url="test_annotation.gtf")
+    variant = Variant("1", start=10, ref="A", alt="G", ensembl=genome)
+    eq_(register_genome(genome), "test_annotation:1:GRCh38")
+    eq_(variant.to_dict()["ensembl"], "test_annotation:1:GRCh38")
+    assert pickle.loads(pickle.dumps(variant)).ensembl is genome
+    assert Variant.from_json(variant.to_json()).ensembl is genome
+
 def test_chromosome_normalization():
     # trimmin of mithochondrial name
     eq_(Variant("M", 1, "A", "G").contig, "MT")
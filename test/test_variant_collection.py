@@ -22,9 +22,9 @@ try:
 except ImportError:
     import pickle
 
-from .data import ov_wustle_variants, tcga_ov_variants
+from .data import ov_wustle_variants, tcga_ov_variants, data_path
 
-from varcode import VariantCollection, Variant
+from varcode import VariantCollection, Variant, load_maf
 
 def test_variant_collection_union():
     combined = ov_wustle_variants.union(tcga_ov_variants)
@@ -36,6 +36,70 @@ def test_variant_collection_intersection():
     eq_(set(combined.sources), {ov_wustle_variants.source, tcga_ov_variants.source})
     eq_(len(combined), 0)
 
+def test_variant_collection_union_intersection_difference_shared_variants():
+    shared = Variant("1", 10, "A", "T")
+    only_in_first = [Variant("1", 10, "A", "G"), Variant("2", 5, "C", "G")]
+    only_in_second = [Variant("10", 3, "C", "G")]
+    first = VariantCollection(
+        only_in_first + [shared],
+        source_to_metadata_dict={
+            "first": {v: {"qual": 1} for v in only_in_first + [shared]}})
+    second = VariantCollection(
+        only_in_second + [shared],
+        source_to_metadata_dict={
+            "second": {v: {"qual": 2} for v in only_in_second + [shared]}})
+
+    union = first.union(second)
+    eq_(len(union), 4)
+    eq_(union.sources, {"first", "second"})
+    eq_(union.source_to_metadata_dict["second"][shared], {"qual": 2})
+
+    eq_(list(first.intersection(second)), [shared])
+
+    difference = first.difference(second)
+    eq_(set(difference), set(only_in_first))
+    eq_(difference.sources, {"first"})
+    eq_(len(second.difference(first, second)), 0)
+
+def test_variant_collection_presence_matrix():
+    v1 = Variant("1", 10, "A", "T")
+    v2 = Variant("X", 20, "C", "G")
+    first = VariantCollection([v1, v2], sources={"first"})
+    second = VariantCollection([v2], sources={"second"})
+    union, presence = first.union(second, presence_matrix=True)
+    eq_(list(presence.columns), ["first", "second"])
+    eq_(list(presence.index), list(union))
+    eq_(list(presence["first"]), [True, True])
+    eq_(list(presence["second"]), [False, True])
+
+def test_variant_collection_natural_chromosome_order():
+    variants = [
+        Variant("X", 1, "A", "G"),
+        Variant("10", 5, "A", "G"),
+        Variant("MT", 1, "A", "G"),
+        Variant("2", 7, "A", "G"),
+        Variant("2", 3, "A", "G"),
+    ]
+    collection = VariantCollection(variants)
+    eq_([(v.contig, v.start) for v in collection],
+        [("2", 3), ("2", 7), ("10", 5), ("X", 1), ("MT", 1)])
+    eq_(sorted(variants), list(collection))
+
+def test_variant_collection_drops_duplicates_at_same_position():
+    v1 = Variant("1", 10, "A", "G")
+    v2 = Variant("1", 10, "A", "T")
+    collection = VariantCollection(
+        [v1, v2, Variant("1", 10, "A", "G"), Variant("2", 1, "C", "T"), v2])
+    eq_(list(collection), [v1, v2, Variant("2", 1, "C", "T")])
+
+def test_variant_collection_presorted():
+    variants = [Variant("1", 10, "A", "G"), Variant("2", 1, "C", "T")]
+    collection = VariantCollection(variants, presorted=True)
+    eq_(list(collection), variants)
+    # clones keep the same options
+    eq_(collection.filter(lambda v: v.contig == "2").sort_key,
+        collection.sort_key)
+
 def test_variant_collection_gene_counts():
     gene_counts = ov_wustle_variants.gene_counts()
     # test that each gene is counted just once
@@ -100,6 +164,18 @@ def test_gene_counts():
     # coding_gene_counts = variants.gene_counts(only_coding=True)
     # eq_(coding_gene_counts, expected_counts)
 
+def test_variant_collection_effects_memoized():
+    variants = load_maf(data_path("ov.wustle.subset5.maf"))
+    effects = variants.effects()
+    assert variants.effects() is effects
+    assert variants[0].effects() is variants[0].effects()
+    # filtered collections reuse the effects of the collection they came from
+    subset = variants.filter(lambda v: v.contig == "1")
+    subset_effects = subset.effects()
+    eq_(len(subset_effects), len([
+        effect for effect in effects if effect.variant.contig == "1"]))
+    eq_(set(subset_effects.groupby_variant().keys()), set(subset))
+
 def test_variant_collection_serialization():
     variant_list = [
         Variant(
@@ -0,0 +1,119 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test columnar storage of VCF metadata
+"""
+
+from __future__ import print_function, division, absolute_import
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from nose.tools import eq_, assert_raises
+from varcode import Variant, VariantCollection, load_vcf
+from varcode.variant_metadata import VariantMetadataStore
+
+from .data import data_path
+
+def test_metadata_store_view():
+    v1 = Variant("1", 10, "A", "G")
+    v2 = Variant("1", 10, "A", "T")
+    store = VariantMetadataStore(
+        info_parser=lambda s: dict(kv.split("=") for kv in s.split(";")))
+    record_index = store.add_record("rs1", 30.0, None, info_string="DP=3;GE=X")
+    store.add_variant(v1, record_index, 0)
+    store.add_variant(v2, record_index, 1)
+    eq_(len(store), 2)
+    eq_(store[v2]["alt_allele_index"], 1)
+    eq_(store[v1], {
+        "id": "rs1",
+        "qual": 30.0,
+        "filter": None,
+        "info": {"DP": "3", "GE": "X"},
+        "sample_info": None,
+        "alt_allele_index": 0,
+    })
+
+def test_load_vcf_metadata_store():
+    variants = load_vcf(data_path("multiallelic.vcf"), genome="GRCh37")
+    assert isinstance(variants.metadata, VariantMetadataStore)
+    eq_([variants.metadata[v]["alt_allele_index"] for v in variants], [0, 1])
+    eq_(variants.metadata[variants[0]]["filter"], [])
+
+def test_filtered_collection_shares_metadata_store():
+    variants = load_vcf(data_path("somatic_hg19_14muts.vcf"), genome="GRCh37")
+    subset = variants.filter(lambda v: v.is_snv)
+    assert subset.metadata is variants.metadata
+
+def test_metadata_store_serialization():
+    variants = load_vcf(data_path("somatic_hg19_14muts.vcf"), genome="GRCh37")
+    first_metadata = variants.metadata[variants[0]]
+    reconstructed = pickle.loads(pickle.dumps(variants))
+    eq_(reconstructed.metadata[variants[0]], first_metadata)
+    from_json = VariantCollection.from_json(variants.to_json())
+    eq_(from_json.metadata[variants[0]], first_metadata)
+
+def test_metadata_store_replaces_readded_variant():
+    v1 = Variant("1", 10, "A", "G")
+    store = VariantMetadataStore()
+    first = store.add_record("rs1", 30.0, None)
+    second = store.add_record("rs2", 40.0, [])
+    store.add_variant(v1, first, 0)
+    store.add_variant(v1, second, 0)
+    eq_(len(store), 1)
+    eq_(list(store), [v1])
+    eq_(store[v1]["id"], "rs2")
+    eq_(VariantMetadataStore(**store.to_dict()), store)
+
+def test_metadata_view_assignment():
+    v1 = Variant("1", 10, "A", "G")
+    v2 = Variant("1", 10, "A", "T")
+    store = VariantMetadataStore(
+        info_parser=lambda s: dict(kv.split("=") for kv in s.split(";")))
+    record_index = store.add_record("rs1", 30.0, None, info_string="DP=3")
+    store.add_variant(v1, record_index, 0)
+    store.add_variant(v2, record_index, 1)
+    # fields assigned for one allele of a record don't change the others
+    store[v1]["qual"] = 50.0
+    store[v1]["filter"] = ["LowQual"]
+    eq_((store[v1]["qual"], store[v1]["filter"]), (50.0, ["LowQual"]))
+    eq_((store[v2]["qual"], store[v2]["filter"]), (30.0, None))
+    # while their parsed INFO is still shared
+    store[v1]["info"]["GE"] = "X"
+    eq_(store[v2]["info"], {"DP": "3", "GE": "X"})
+    store[v2]["source"] = "caller"
+    eq_(store[v2]["source"], "caller")
+    assert "source" in store[v2]
+    assert "source" not in store[v1]
+    eq_(len(store[v2]), 7)
+    reconstructed = pickle.loads(pickle.dumps(store))
+    eq_(reconstructed, store)
+    del store[v2]["source"]
+    eq_(len(store[v2]), 6)
+    with assert_raises(TypeError):
+        del store[v2]["qual"]
+
+def test_combined_collections_merge_metadata_stores():
+    path = data_path("somatic_hg19_14muts.vcf")
+    variants = load_vcf(path, genome="GRCh37")
+    other = load_vcf(path, genome="GRCh37")
+    other.metadata[other[0]]["qual"] = 99.0
+    combined = variants.union(other)
+    assert isinstance(combined.metadata, VariantMetadataStore)
+    eq_(len(combined.metadata), len(variants))
+    # the later collection's metadata takes precedence
+    eq_(combined.metadata[variants[0]]["qual"], 99.0)
+    eq_(combined.metadata[variants[1]], variants.metadata[variants[1]])
@@ -17,6 +17,7 @@ import os
 from nose.tools import eq_
 from pyensembl import cached_release
 from varcode import load_vcf, load_vcf_fast, Variant
+from varcode.vcf import iter_vcf_chunks
 from .data import data_path
 
 # Set to 1 to enable, 0 to disable.
@@ -146,3 +147,13 @@ def test_sample_info_genotype():
         '0/1')
     eq_(variants.metadata[variants[1]]['sample_info']['metastasis']['GT'],
         '0/1')
+
+def test_iter_vcf_chunks():
+    variants = load_vcf(VCF_FILENAME)
+    chunks = list(iter_vcf_chunks(
+        VCF_FILENAME, chunk_size=4, include_info=True))
+    eq_([len(chunk) for chunk in chunks], [4, 4, 4, 2])
+    eq_([variant for chunk in chunks for variant in chunk], list(variants))
+    for chunk in chunks:
+        for variant in chunk:
+            eq_(chunk.metadata[variant], variants.metadata[variant])
@@ -0,0 +1,308 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test writing VCFs annotated with predicted effects
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_raises, eq_
+import vcf
+from varcode import (
+    Variant,
+    annotate_vcf,
+    check_stored_effects,
+    load_vcf,
+    register_genome,
+)
+from varcode.cli.annotate_vcf_script import main as run_script
+from varcode.effects import predict_variant_effects
+from varcode.effects.effect_cache import encode_effect
+from varcode.effects.effect_ordering import effect_sort_key
+from varcode.vcf_annotation import (
+    encode_effect_annotation,
+    parse_annotation_fields,
+)
+
+from .data import synthetic_genome, synthetic_reference_sequence
+
+def _write_vcf(path):
+    """
+    VCF of variants in the synthetic genome, including a multiallelic
+    record, indels, a filtered record and a symbolic allele.
+    """
+    sequence = synthetic_reference_sequence()
+    records = [
+        ("1", 101, "rs1", sequence[100], "A,G", "PASS", "DP=10"),
+        ("1", 159, ".", sequence[158:160], sequence[158], "PASS", "."),
+        ("1", 420, ".", sequence[419], "T", "LowQual", "DP=3"),
+        ("1", 850, ".", sequence[849], "<DEL>", "PASS", "SVTYPE=DEL"),
+        ("1", 1700, ".", sequence[1699], sequence[1699] + "GG", ".", "DP=7"),
+        ("1", 2800, ".", sequence[2799], "A", "PASS", "DP=8"),
+    ]
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.1\n")
+        f.write(
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n')
+        f.write(
+            '##INFO=<ID=SVTYPE,Number=1,Type=String,Description="SV type">\n')
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for (contig, position, id_, ref, alts, filter_, info) in records:
+            f.write("\t".join(
+                [contig, str(position), id_, ref, alts, "50", filter_, info]
+            ) + "\n")
+    return records
+
+def _expected_annotations(genome, contig, position, ref, alts):
+    annotations = []
+    for alt in alts.split(","):
+        if alt.startswith("<"):
+            continue
+        variant = Variant(contig, position, ref, alt, ensembl=genome)
+        annotations.extend(
+            encode_effect_annotation(alt, effect)
+            for effect in sorted(
+                predict_variant_effects(variant, raise_on_error=False),
+                key=effect_sort_key,
+                reverse=True))
+    return annotations
+
+def _read_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        return f.readlines()
+
+def test_annotate_vcf():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        input_path = os.path.join(directory, "input.vcf")
+        records = _write_vcf(input_path)
+        output_path = os.path.join(directory, "output.vcf")
+        eq_(annotate_vcf(input_path, output_path, genome=genome), len(records))
+        lines = _read_lines(output_path)
+        header = [line for line in lines if line.startswith("#")]
+        eq_(len(header), 5)
+        assert header[3].startswith("##INFO=<ID=VARCODE,"), header[3]
+        body = [line.rstrip("\n").split("\t") for line in lines[5:]]
+        eq_(len(body), len(records))
+        for (fields, record) in zip(body, records):
+            (contig, position, _, ref, alts, _, info) = record
+            expected = _expected_annotations(
+                genome, contig, position, ref, alts)
+            if not expected:
+                # symbolic alleles aren't annotated
+                eq_(fields[7], info)
+                continue
+            original_info = [] if info == "." else [info]
+            eq_(
+                fields[7],
+                ";".join(original_info + ["VARCODE=" + ",".join(expected)]))
+        # the INFO field is declared in the header and can be parsed
+        reader = vcf.Reader(filename=output_path)
+        assert "VARCODE" in reader.infos
+        for (record, fields) in zip(reader, body):
+            eq_(
+                record.INFO.get("VARCODE"),
+                [
+                    entry.split("=", 1)[1].split(",")
+                    for entry in fields[7].split(";")
+                    if entry.startswith("VARCODE=")
+                ][0] if "VARCODE=" in fields[7] else None)
+
+        # bgzipped output in parallel has the same lines, and annotating it
+        # again replaces its annotations
+        bgzip_path = os.path.join(directory, "output.vcf.gz")
+        annotate_vcf(input_path, bgzip_path, genome=genome, n_jobs=2,
+                     chunk_size=2)
+        with open(bgzip_path, "rb") as f:
+            # BGZF blocks are gzip members with a "BC" extra subfield
+            eq_(f.read(14)[12:14], b"BC")
+        eq_(_read_lines(bgzip_path), lines)
+        again_path = os.path.join(directory, "again.vcf")
+        annotate_vcf(bgzip_path, again_path, genome=genome)
+        eq_(_read_lines(again_path), lines)
+    finally:
+        shutil.rmtree(directory)
+
+def test_annotate_vcf_script():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        register_genome(genome, "varcode_synthetic_annotate_vcf")
+        input_path = os.path.join(directory, "input.vcf")
+        records = _write_vcf(input_path)
+        output_path = os.path.join(directory, "output.vcf")
+        run_script([
+            input_path,
+            "--genome", "varcode_synthetic_annotate_vcf",
+            "--output", output_path,
+            "--info-field", "EFF",
+            "--top-effect-only",
+            "--only-passing",
+        ])
+        body = [
+            line.rstrip("\n").split("\t")
+            for line in _read_lines(output_path)
+            if not line.startswith("#")
+        ]
+        for (fields, record) in zip(body, records):
+            (contig, position, _, ref, alts, filter_, info) = record
+            if filter_ not in (".", "PASS"):
+                eq_(fields[7], info)
+                continue
+            expected = [
+                encode_effect_annotation(alt, Variant(
+                    contig, position, ref, alt, ensembl=genome).top_effect())
+                for alt in alts.split(",")
+                if not alt.startswith("<")
+            ]
+            if not expected:
+                eq_(fields[7], info)
+                continue
+            assert fields[7].endswith("EFF=" + ",".join(expected)), fields[7]
+    finally:
+        shutil.rmtree(directory)
+
+def _effect_keys(effects):
+    return sorted(
+        json.dumps(encode_effect(effect), sort_keys=True)
+        for effect in effects)
+
+def test_load_vcf_stored_effects():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        input_path = os.path.join(directory, "input.vcf")
+        _write_vcf(input_path)
+        annotated_path = os.path.join(directory, "annotated.vcf")
+        annotate_vcf(input_path, annotated_path, genome=genome)
+        # load_vcf doesn't support symbolic alleles
+        lines = [
+            line for line in _read_lines(annotated_path)
+            if "<DEL>" not in line
+        ]
+        with open(annotated_path, "w") as f:
+            f.writelines(lines)
+
+        variants = load_vcf(
+            annotated_path,
+            genome=genome,
+            only_passing=False,
+            include_info=False,
+            stored_effects=True)
+        eq_(len(variants), 6)
+        (store,) = variants.stored_effects
+        eq_(len(store), len(variants))
+        effects = variants.effects(raise_on_error=False)
+        eq_(store.hits, len(variants))
+        eq_(store.misses, 0)
+        for variant in variants:
+            eq_(
+                _effect_keys(effects.groupby_variant()[variant]),
+                _effect_keys(
+                    predict_variant_effects(variant, raise_on_error=False)))
+        eq_(check_stored_effects(variants, random_seed=0), [])
+        # filtered collections share the stored effects
+        eq_(variants.filter(lambda v: v.is_snv).stored_effects, [store])
+
+        # effects stored for another variant are caught by the check
+        body = [line for line in lines if not line.startswith("#")]
+        info_column = [line.split("\t")[7] for line in body]
+        swapped = [
+            "\t".join(line.split("\t")[:7] + [info_column[-1 - i]])
+            for (i, line) in enumerate(body)
+        ]
+        tampered_path = os.path.join(directory, "tampered.vcf")
+        with open(tampered_path, "w") as f:
+            f.writelines(
+                [line for line in lines if line.startswith("#")] +
+                [line if line.endswith("\n") else line + "\n"
+                 for line in swapped])
+        tampered = load_vcf(
+            tampered_path,
+            genome=genome,
+            only_passing=False,
+            stored_effects="VARCODE")
+        assert len(check_stored_effects(tampered, random_seed=0)) > 0
+        with assert_raises(ValueError):
+            load_vcf(
+                tampered_path,
+                genome=genome,
+                only_passing=False,
+                stored_effects=True,
+                check_stored_effects=10)
+    finally:
+        shutil.rmtree(directory)
+
+def test_load_vcf_stored_effect_subsets():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = synthetic_genome(directory)
+        input_path = os.path.join(directory, "input.vcf")
+        _write_vcf(input_path)
+        for (kwargs, description) in [
+                (dict(top_effect_only=True),
+                 "Effects: top. Transcripts: all."),
+                (dict(transcript_filter="canonical"),
+                 "Effects: all. Transcripts: canonical.")]:
+            annotated_path = os.path.join(directory, "annotated.vcf")
+            annotate_vcf(input_path, annotated_path, genome=genome, **kwargs)
+            lines = [
+                line for line in _read_lines(annotated_path)
+                if "<DEL>" not in line
+            ]
+            assert description in lines[3], lines[3]
+            with open(annotated_path, "w") as f:
+                f.writelines(lines)
+            variants = load_vcf(
+                annotated_path,
+                genome=genome,
+                only_passing=False,
+                stored_effects=True)
+            (store,) = variants.stored_effects
+            # all effects are predicted instead of returning the subset
+            effects = variants.effects(raise_on_error=False)
+            eq_(store.hits, 0)
+            eq_(
+                _effect_keys(effects),
+                _effect_keys(
+                    effect
+                    for variant in variants
+                    for effect in predict_variant_effects(
+                        variant, raise_on_error=False)))
+            # the stored subset is checked against the same subset
+            eq_(check_stored_effects(variants, random_seed=0), [])
+    finally:
+        shutil.rmtree(directory)
+
+def test_parse_annotation_fields():
+    eq_(
+        parse_annotation_fields(
+            "Consequence annotations from Ensembl VEP. "
+            "Format: Allele|Consequence|IMPACT|SYMBOL"),
+        ["Allele", "Consequence", "IMPACT", "SYMBOL"])
+    eq_(
+        parse_annotation_fields(
+            "Functional annotations: 'Allele | Annotation | "
+            "Annotation_Impact | Gene_Name' "),
+        ["Allele", "Annotation", "Annotation_Impact", "Gene_Name"])
+    eq_(parse_annotation_fields("Depth"), None)
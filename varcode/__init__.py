@@ -12,18 +12,87 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .variant import Variant
-from .variant_collection import VariantCollection
-from .maf import load_maf, load_maf_dataframe
-from .vcf import load_vcf, load_vcf_fast
-from .effects import (
-    effect_priority,
-    top_priority_effect,
-    EffectCollection,
-    MutationEffect,
-    NonsilentCodingMutation,
+"""
+Attributes of this package are loaded on first access (PEP 562), so that
+`import varcode` doesn't import pandas, PyVCF or Biopython until something
+which needs them is used.
+"""
+
+from importlib import import_module
+
+# name of each public attribute -> module it's defined in
+_lazy_attributes = {
+    "Variant": ".variant",
+    "VariantCollection": ".variant_collection",
+    "load_maf": ".maf",
+    "load_maf_dataframe": ".maf",
+    "load_vcf": ".vcf",
+    "load_vcf_fast": ".vcf",
+    "annotate_vcf": ".vcf_annotation",
+    "AnnotationLayout": ".vcf_annotation",
+    "check_stored_effects": ".vcf_annotation",
+    "annotate_cohort": ".cohort",
+    "register_genome": ".genome_registry",
+    "TranscriptIndex": ".transcript_index",
+    "build_transcript_index": ".transcript_index",
+    "load_transcript_index": ".transcript_index",
+    "use_transcript_index": ".transcript_index",
+    "preload": ".transcript_index",
+    "use_gtf_annotation": ".transcript_index",
+    "AnnotationSource": ".annotation_source",
+    "AnnotationServer": ".server",
+    "request_effects": ".server",
+    "effect_priority": ".effects",
+    "top_priority_effect": ".effects",
+    "EffectCache": ".effects",
+    "EffectCollection": ".effects",
+    "MutationEffect": ".effects",
+    "NonsilentCodingMutation": ".effects",
+}
+
+# submodules which used to be loaded by importing this package, and so
+# can still be accessed as attributes without importing them first
+_submodules = (
+    "aio",
+    "annotation_source",
+    "cli",
+    "cohort",
+    "common",
+    "effects",
+    "genome_registry",
+    "gtf",
+    "maf",
+    "ndjson",
+    "nucleotides",
+    "parquet",
+    "reference",
+    "string_helpers",
+    "transcript_index",
+    "util",
+    "variant",
+    "variant_collection",
+    "variant_metadata",
+    "vcf",
+    "vcf_annotation",
 )
 
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        value = getattr(import_module(_lazy_attributes[name], __name__), name)
+    elif name in _submodules:
+        value = import_module("." + name, __name__)
+    else:
+        raise AttributeError(
+            "module '%s' has no attribute '%s'" % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes) | set(_submodules))
+
+
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
@@ -33,6 +102,7 @@ __all__ = [
     "Variant",
     "EffectCollection",
     "VariantCollection",
+    "EffectCache",
     # effects
     "effect_priority",
     "top_priority_effect",
@@ -43,4 +113,24 @@ __all__ = [
     "load_maf_dataframe",
     "load_vcf",
     "load_vcf_fast",
+    # writing annotated VCFs
+    "annotate_vcf",
+    "AnnotationLayout",
+    "check_stored_effects",
+    # annotating many samples
+    "annotate_cohort",
+    # serializing variants with custom genomes
+    "register_genome",
+    # memory-mapped transcript index
+    "TranscriptIndex",
+    "build_transcript_index",
+    "load_transcript_index",
+    "use_transcript_index",
+    "preload",
+    # annotation sources other than pyensembl databases
+    "AnnotationSource",
+    "use_gtf_annotation",
+    # long-running annotation service
+    "AnnotationServer",
+    "request_effects",
 ]
@@ -0,0 +1,295 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coroutines for loading and annotating variants from asyncio code without
+blocking the event loop.
+
+Parsing and effect prediction run in an executor (a thread pool shared by
+the coroutines of this module unless one is given) one chunk at a time.
+Between chunks control returns to the event loop, which is also where cancellation and timeouts
+take effect: a chunk which already started runs to completion, but no
+further chunks are started.
+
+The number of chunks running at once in each event loop is bounded (see
+`set_max_concurrent_chunks`), and a chunk only holds its slot while it
+runs, so that one large request can't starve smaller ones.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import weakref
+
+from .effects import EffectCollection, predict_variant_effects
+from .maf import load_maf
+from .vcf import _open_local_vcf, load_vcf, parse_url_or_path
+
+DEFAULT_MAX_CONCURRENT_CHUNKS = 4
+
+_max_concurrent_chunks = DEFAULT_MAX_CONCURRENT_CHUNKS
+
+# event loop -> semaphore bounding the chunks which run in it at once
+_semaphores = weakref.WeakKeyDictionary()
+
+# thread pool used when no executor is given
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_max_concurrent_chunks(n):
+    """
+    Maximum number of chunks which the coroutines of this module run at
+    once in each event loop, takes effect for loops which haven't used
+    them yet.
+    """
+    global _max_concurrent_chunks
+    if n < 1:
+        raise ValueError("Expected a positive number of chunks, got %s" % n)
+    _max_concurrent_chunks = n
+    _semaphores.clear()
+
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(
+            _max_concurrent_chunks)
+    return semaphore
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise asyncio.TimeoutError()
+    return remaining
+
+
+def _default_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor()
+        return _executor
+
+
+def _release_soon(loop, semaphore):
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # the event loop is closed, and so is its semaphore
+        pass
+
+
+async def _run_chunk(executor, deadline, function, *args):
+    """
+    Run a function in an executor while holding a slot of the event loop's
+    semaphore, giving up once the deadline passes.
+
+    The slot is released when the function finishes (or is cancelled
+    before it starts) rather than when the coroutine stops waiting for it,
+    since a function which already started keeps running after a timeout.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphore()
+    remaining = _remaining(deadline)
+    await asyncio.wait_for(semaphore.acquire(), remaining)
+    try:
+        remaining = _remaining(deadline)
+        future = (executor or _default_executor()).submit(function, *args)
+    except BaseException:
+        semaphore.release()
+        raise
+    future.add_done_callback(lambda _: _release_soon(loop, semaphore))
+    return await asyncio.wait_for(
+        asyncio.wrap_future(future), remaining)
+
+
+def _deadline(timeout):
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def _add_next_chunk(df_iterator, builder):
+    """
+    Parse the next chunk of records of a VCF, returns False once there are
+    no more chunks or no more are needed.
+    """
+    chunk = next(df_iterator, None)
+    if chunk is not None and builder.add_dataframe(chunk):
+        return True
+    close = getattr(df_iterator, "close", None)
+    if close is not None:
+        close()
+    return False
+
+
+async def async_load_vcf(
+        path,
+        genome=None,
+        reference_vcf_key="reference",
+        only_passing=True,
+        allow_extended_nucleotides=False,
+        include_info=True,
+        chunk_size=10 ** 4,
+        max_variants=None,
+        executor=None,
+        timeout=None):
+    """
+    Load a VCF like `varcode.load_vcf` in an executor, stopping between
+    chunks of records when the coroutine is cancelled or times out.
+
+    Parameters
+    ----------
+    path : str
+
+    genome, reference_vcf_key, only_passing, allow_extended_nucleotides,
+    include_info, max_variants
+        See `varcode.load_vcf`.
+
+    chunk_size : int, optional
+        Number of records parsed between checks for cancellation.
+
+    executor : concurrent.futures.ThreadPoolExecutor, optional
+        Defaults to the thread pool of this module. It has to run
+        functions in threads of this process, since the chunks of a file
+        are parsed by separate calls.
+
+    timeout : float, optional
+        Seconds after which loading stops and asyncio.TimeoutError is
+        raised.
+    """
+    parsed_path = parse_url_or_path(path)
+    if parsed_path.scheme and parsed_path.scheme.lower() != "file":
+        # remote files are downloaded first, which can't be split in chunks
+        return await _run_chunk(
+            executor,
+            _deadline(timeout),
+            lambda: load_vcf(
+                path,
+                genome=genome,
+                reference_vcf_key=reference_vcf_key,
+                only_passing=only_passing,
+                allow_extended_nucleotides=allow_extended_nucleotides,
+                include_info=include_info,
+                chunk_size=chunk_size,
+                max_variants=max_variants))
+
+    # each chunk of records is parsed by a separate call in the executor,
+    # so that no call waits for a slot of the semaphore and none are
+    # started once the coroutine is cancelled
+    deadline = _deadline(timeout)
+    (df_iterator, builder) = await _run_chunk(
+        executor,
+        deadline,
+        lambda: _open_local_vcf(
+            path,
+            genome=genome,
+            reference_vcf_key=reference_vcf_key,
+            only_passing=only_passing,
+            allow_extended_nucleotides=allow_extended_nucleotides,
+            include_info=include_info,
+            chunk_size=chunk_size,
+            max_variants=max_variants))
+    while await _run_chunk(
+            executor, deadline, _add_next_chunk, df_iterator, builder):
+        pass
+    return builder.variant_collection()
+
+
+async def async_load_maf(path, executor=None, timeout=None):
+    """
+    Load a MAF file like `varcode.load_maf` in an executor.
+    """
+    return await _run_chunk(executor, _deadline(timeout), load_maf, path)
+
+
+def _chunk_effects(variants, raise_on_error, transcript_filter):
+    return [
+        effect
+        for variant in variants
+        for effect in predict_variant_effects(
+            variant,
+            raise_on_error=raise_on_error,
+            transcript_filter=transcript_filter)
+    ]
+
+
+async def aiter_effects(
+        variants,
+        raise_on_error=True,
+        transcript_filter=None,
+        chunk_size=100,
+        executor=None,
+        timeout=None):
+    """
+    Asynchronously generate the effects of variants, which are predicted in
+    an executor `chunk_size` variants at a time.
+
+    Parameters
+    ----------
+    variants : VariantCollection or iterable of Variant
+
+    raise_on_error, transcript_filter
+        See `VariantCollection.effects`.
+
+    chunk_size : int, optional
+
+    executor : concurrent.futures.Executor, optional
+        Defaults to the thread pool of this module. A
+        ProcessPoolExecutor annotates chunks in parallel, but has to pickle
+        them.
+
+    timeout : float, optional
+        Seconds after which the generator raises asyncio.TimeoutError.
+    """
+    deadline = _deadline(timeout)
+    variants = list(variants)
+    for i in range(0, len(variants), chunk_size):
+        effects = await _run_chunk(
+            executor,
+            deadline,
+            _chunk_effects,
+            variants[i:i + chunk_size],
+            raise_on_error,
+            transcript_filter)
+        for effect in effects:
+            yield effect
+
+
+async def async_effects(
+        variants,
+        raise_on_error=True,
+        transcript_filter=None,
+        chunk_size=100,
+        executor=None,
+        timeout=None):
+    """
+    EffectCollection of the given variants, see `aiter_effects`.
+    """
+    return EffectCollection([
+        effect
+        async for effect in aiter_effects(
+            variants,
+            raise_on_error=raise_on_error,
+            transcript_filter=transcript_filter,
+            chunk_size=chunk_size,
+            executor=executor,
+            timeout=timeout)
+    ])
@@ -0,0 +1,94 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Interface of the transcript and gene lookups which variants and effect
+prediction make, so that annotations can come from somewhere other than a
+pyensembl database.
+
+A pyensembl.Genome already has all of these methods except
+`canonical_transcript_id`, which `varcode.effects.transcript_filter`
+computes from its database. Other sources get used for the variants of a
+genome once they're registered with
+`varcode.genome_registry.set_genome_annotation`.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+
+class AnnotationSource(object):
+    """
+    Base class of annotation sources, subclasses have to implement the
+    ID lookups and `transcript_ids_at_locus` / `gene_ids_at_locus`.
+
+    Transcripts returned by a source can be subclasses of
+    pyensembl.Transcript, as long as their exons, codons and sequences
+    don't need the genome's database.
+    """
+
+    def transcript_by_id(self, transcript_id):
+        raise NotImplementedError(
+            "%s must implement transcript_by_id" % self.__class__.__name__)
+
+    def gene_by_id(self, gene_id):
+        raise NotImplementedError(
+            "%s must implement gene_by_id" % self.__class__.__name__)
+
+    def exon_by_id(self, exon_id):
+        raise NotImplementedError(
+            "%s must implement exon_by_id" % self.__class__.__name__)
+
+    def gene_name_of_gene_id(self, gene_id):
+        return self.gene_by_id(gene_id).name
+
+    def canonical_transcript_id(self, gene_id):
+        """
+        ID of the canonical transcript of a gene, see
+        `varcode.effects.transcript_filter.canonical_transcript_id`.
+        """
+        raise NotImplementedError(
+            "%s must implement canonical_transcript_id" % (
+                self.__class__.__name__,))
+
+    def transcript_ids_at_locus(self, contig, position, end=None, strand=None):
+        raise NotImplementedError(
+            "%s must implement transcript_ids_at_locus" % (
+                self.__class__.__name__,))
+
+    def gene_ids_at_locus(self, contig, position, end=None, strand=None):
+        raise NotImplementedError(
+            "%s must implement gene_ids_at_locus" % self.__class__.__name__)
+
+    def transcripts_at_locus(self, contig, position, end=None, strand=None):
+        return [
+            self.transcript_by_id(transcript_id)
+            for transcript_id in self.transcript_ids_at_locus(
+                contig, position, end=end, strand=strand)
+        ]
+
+    def gene_names_at_locus(self, contig, position, end=None, strand=None):
+        return sorted(set(
+            gene_name
+            for gene_name in (
+                self.gene_name_of_gene_id(gene_id)
+                for gene_id in self.gene_ids_at_locus(
+                    contig, position, end=end, strand=strand))
+            if gene_name))
+
+    def genes_at_locus(self, contig, position, end=None, strand=None):
+        return [
+            self.gene_by_id(gene_id)
+            for gene_id in self.gene_ids_at_locus(
+                contig, position, end=end, strand=strand)
+        ]
@@ -0,0 +1,125 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import division, absolute_import
+from argparse import ArgumentParser
+import logging
+import sys
+import time
+
+from .effects_script import _log_to_stderr, parse_transcript_filter
+from .variants_script import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def make_annotate_vcf_parser():
+    parser = ArgumentParser(
+        description=(
+            "Copy a VCF with the predicted effects of its variants added to "
+            "the INFO column"))
+    parser.add_argument("input", help="Path to VCF, which can be gzipped")
+    parser.add_argument(
+        "--output",
+        default="-",
+        help=(
+            "Output path, by default the VCF is written to stdout. Paths "
+            "ending in .gz or .bgz are compressed with bgzip"))
+    parser.add_argument(
+        "--genome",
+        help=(
+            "Reference assembly of the variants, e.g. 'GRCh38', otherwise "
+            "guessed from the header"))
+    parser.add_argument(
+        "--info-field",
+        default="VARCODE",
+        help="Key of the added INFO field (default: VARCODE)")
+    parser.add_argument(
+        "--top-effect-only",
+        action="store_true",
+        help="Only add the highest priority effect of each allele")
+    parser.add_argument(
+        "--transcript-filter",
+        help=(
+            "Only annotate the canonical transcript of each gene ('canonical'), "
+            "complete protein coding transcripts ('coding'), or the "
+            "transcripts whose IDs are listed in a file (one per line) or "
+            "given separated by commas"))
+    parser.add_argument(
+        "--only-passing",
+        action="store_true",
+        help="Copy records which failed filters without annotating them")
+    parser.add_argument(
+        "--raise-on-error",
+        action="store_true",
+        help=(
+            "Stop when an effect can't be predicted or an allele isn't "
+            "valid, instead of adding a Failure effect or skipping it"))
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes which annotate records (default: 1)")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="Number of records annotated at once (default: 1000)")
+    return parser
+
+
+def main(args_list=None):
+    """
+    Script which writes a copy of a VCF annotated with varcode's effects.
+
+    Example usage:
+        varcode-annotate-vcf sample.vcf.gz \
+            --genome GRCh38 \
+            --jobs 4 \
+            --output sample.varcode.vcf.gz
+    """
+    configure_logging()
+    _log_to_stderr()
+    if args_list is None:
+        args_list = sys.argv[1:]
+    args = make_annotate_vcf_parser().parse_args(args_list)
+    if args.jobs < 1:
+        raise ValueError("Expected --jobs to be at least 1, got %d" % args.jobs)
+    if args.chunk_size < 1:
+        raise ValueError(
+            "Expected --chunk-size to be at least 1, got %d" % args.chunk_size)
+    # imported after parsing the arguments, since it loads pyensembl
+    from ..genome_registry import genome_from_key
+    from ..vcf_annotation import annotate_vcf
+    genome = args.genome
+    if genome is not None and genome_from_key(genome) is not None:
+        genome = genome_from_key(genome)
+    start_time = time.time()
+    n_records = annotate_vcf(
+        args.input,
+        args.output,
+        genome=genome,
+        info_field=args.info_field,
+        transcript_filter=parse_transcript_filter(args.transcript_filter),
+        top_effect_only=args.top_effect_only,
+        only_passing=args.only_passing,
+        raise_on_error=args.raise_on_error,
+        n_jobs=args.jobs,
+        chunk_size=args.chunk_size)
+    elapsed = max(time.time() - start_time, 1e-9)
+    logger.info(
+        "Annotated %d records in %0.1fs (%0.1f records/s)",
+        n_records,
+        elapsed,
+        n_records / elapsed)
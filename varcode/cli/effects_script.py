@@ -0,0 +1,369 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Script which predicts the effects of variants and writes them as they're
+annotated, reading its input one chunk of variants at a time so that memory
+use doesn't grow with the size of the input.
+"""
+
+from __future__ import print_function, division, absolute_import
+import logging
+import os
+import sys
+import time
+
+from .variant_args import make_variants_parser, variant_chunks_from_args
+from .variants_script import configure_logging
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ("tsv", "csv", "ndjson", "parquet")
+
+# file extensions (after removing .gz) of each output format
+OUTPUT_FORMAT_EXTENSIONS = {
+    ".tsv": "tsv",
+    ".txt": "tsv",
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+}
+
+# columns of EffectCollection.to_dataframe and their Parquet types
+EFFECT_COLUMNS = [
+    ("contig", "string"),
+    ("start", "int64"),
+    ("ref", "string"),
+    ("alt", "string"),
+    ("gene_id", "string"),
+    ("gene_name", "string"),
+    ("transcript_id", "string"),
+    ("transcript_name", "string"),
+    ("variant", "string"),
+    ("is_snv", "bool_"),
+    ("is_indel", "bool_"),
+    ("is_transversion", "bool_"),
+    ("is_transition", "bool_"),
+    ("effect", "string"),
+    ("effect_type", "string"),
+    ("effect_description", "string"),
+]
+
+
+def make_effects_parser():
+    parser = make_variants_parser(
+        description=(
+            "Predict the effects of variants, streaming them from the input "
+            "files to the output one chunk at a time"))
+    output_group = parser.add_argument_group(
+        title="Output",
+        description="Where and how to write the predicted effects")
+    output_group.add_argument(
+        "--output",
+        default="-",
+        help=(
+            "Output path, by default effects are written to stdout. Text "
+            "formats are compressed if the path ends with .gz"))
+    output_group.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        help=(
+            "Format of the output, by default inferred from the extension of "
+            "--output and otherwise tsv. The ndjson format can be loaded with "
+            "EffectCollection.from_ndjson, the others have one row per "
+            "effect with the columns of EffectCollection.to_dataframe"))
+    output_group.add_argument(
+        "--top-effect-only",
+        action="store_true",
+        help="Only write the highest priority effect of each variant")
+    output_group.add_argument(
+        "--transcript-filter",
+        help=(
+            "Only annotate the canonical transcript of each gene ('canonical'), "
+            "complete protein coding transcripts ('coding'), or the "
+            "transcripts whose IDs are listed in a file (one per line) or "
+            "given separated by commas"))
+    output_group.add_argument(
+        "--raise-on-error",
+        action="store_true",
+        help=(
+            "Stop when the effect of a variant on a transcript can't be "
+            "predicted, instead of writing a Failure effect"))
+    run_group = parser.add_argument_group(title="Execution")
+    run_group.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes which annotate chunks (default: 1)")
+    run_group.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10 ** 4,
+        help="Number of variants annotated at once (default: 10000)")
+    run_group.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10.0,
+        help=(
+            "Seconds between progress reports on stderr, 0 to only report "
+            "the total (default: 10)"))
+    return parser
+
+
+def infer_output_format(path):
+    """
+    Output format for a path from its extension, tsv if it's unknown.
+    """
+    if path.endswith(".gz"):
+        path = path[:-len(".gz")]
+    extension = os.path.splitext(path)[1].lower()
+    return OUTPUT_FORMAT_EXTENSIONS.get(extension, "tsv")
+
+
+def parse_transcript_filter(value):
+    """
+    Transcript filter given on the commandline: a mode of
+    `VariantCollection.effects`, a file of transcript IDs or a comma
+    separated list of them.
+    """
+    from ..effects.transcript_filter import TRANSCRIPT_FILTER_MODES
+    if value is None or value in TRANSCRIPT_FILTER_MODES:
+        return value
+    if os.path.exists(value):
+        with open(value) as f:
+            return frozenset(line.strip() for line in f if line.strip())
+    return frozenset(
+        transcript_id.strip()
+        for transcript_id in value.split(",")
+        if transcript_id.strip())
+
+
+def _annotate_chunk(
+        variants,
+        output_format,
+        top_effect_only,
+        transcript_filter,
+        raise_on_error):
+    """
+    Predict the effects of a chunk of variants, returning the number of
+    variants, the number of effects and the effects encoded for the output:
+    NDJSON lines or a DataFrame. Runs in worker processes, which only send
+    the encoded effects back.
+    """
+    from ..effects import EffectCollection
+    from ..ndjson import _effect_line
+    if top_effect_only:
+        effects = EffectCollection([
+            effect
+            for effect in (
+                variant.top_effect(
+                    raise_on_error=raise_on_error,
+                    transcript_filter=transcript_filter)
+                for variant in variants)
+            if effect is not None
+        ])
+    else:
+        effects = EffectCollection([
+            effect
+            for variant in variants
+            for effect in variant.effects(
+                raise_on_error=raise_on_error,
+                memoize=False,
+                transcript_filter=transcript_filter)
+        ])
+    if output_format == "ndjson":
+        rows = [_effect_line(effect) for effect in effects]
+    else:
+        rows = effects.to_dataframe()
+    return len(variants), len(effects), rows
+
+
+class TextEffectsWriter(object):
+    """
+    Writes the DataFrame of each chunk of effects as TSV or CSV, with a single
+    header line.
+    """
+    def __init__(self, path, sep):
+        from ..ndjson import _open
+        if path == "-":
+            self.f, self.close_file = sys.stdout, False
+        else:
+            self.f, self.close_file = _open(path, "w")
+        self.sep = sep
+        self.wrote_header = False
+
+    def write(self, df):
+        if len(df) == 0:
+            return
+        df.to_csv(
+            self.f,
+            sep=self.sep,
+            index=False,
+            header=not self.wrote_header)
+        self.wrote_header = True
+
+    def close(self):
+        if not self.wrote_header:
+            self.f.write(
+                self.sep.join(name for (name, _) in EFFECT_COLUMNS) + "\n")
+        if self.close_file:
+            self.f.close()
+        else:
+            self.f.flush()
+
+
+class NDJSONEffectsWriter(object):
+    """
+    Writes effects in the NDJSON format of `varcode.ndjson`, one line at a
+    time.
+    """
+    def __init__(self, path):
+        from ..ndjson import _effects_header, _open
+        if path == "-":
+            self.f, self.close_file = sys.stdout, False
+        else:
+            self.f, self.close_file = _open(path, "w")
+        self.f.write(_effects_header() + "\n")
+
+    def write(self, lines):
+        for line in lines:
+            self.f.write(line + "\n")
+
+    def close(self):
+        if self.close_file:
+            self.f.close()
+        else:
+            self.f.flush()
+
+
+class ParquetEffectsWriter(object):
+    """
+    Writes the DataFrame of each chunk of effects as a row group of a Parquet
+    file. Requires pyarrow.
+    """
+    def __init__(self, path):
+        from ..parquet import _import_pyarrow
+        if path == "-":
+            raise ValueError("Parquet output requires an --output path")
+        self.pa, pq = _import_pyarrow()
+        self.schema = self.pa.schema([
+            (name, getattr(self.pa, type_name)())
+            for (name, type_name) in EFFECT_COLUMNS
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, df):
+        if len(df) == 0:
+            return
+        self.writer.write_table(self.pa.Table.from_pandas(
+            df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self.writer.close()
+
+
+def effects_writer(path, output_format):
+    if output_format == "tsv":
+        return TextEffectsWriter(path, sep="\t")
+    elif output_format == "csv":
+        return TextEffectsWriter(path, sep=",")
+    elif output_format == "ndjson":
+        return NDJSONEffectsWriter(path)
+    elif output_format == "parquet":
+        return ParquetEffectsWriter(path)
+    raise ValueError("Unknown output format: %s" % output_format)
+
+
+class Progress(object):
+    """
+    Counts annotated variants and effects, logging the throughput at most
+    once per interval.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.n_variants = 0
+        self.n_effects = 0
+        self.start_time = self.last_report_time = time.time()
+
+    def report(self):
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        logger.info(
+            "Annotated %d variants with %d effects in %0.1fs "
+            "(%0.1f variants/s)",
+            self.n_variants,
+            self.n_effects,
+            elapsed,
+            self.n_variants / elapsed)
+
+    def update(self, n_variants, n_effects):
+        self.n_variants += n_variants
+        self.n_effects += n_effects
+        now = time.time()
+        if self.interval > 0 and now - self.last_report_time >= self.interval:
+            self.last_report_time = now
+            self.report()
+
+
+def _log_to_stderr():
+    # the logging configuration writes to stdout, which may be the output
+    for name in ("varcode", "pyensembl", "datacache"):
+        for handler in logging.getLogger(name).handlers:
+            if isinstance(handler, logging.StreamHandler):
+                handler.setStream(sys.stderr)
+
+
+def main(args_list=None):
+    """
+    Script which predicts the effects of variants, writing them in chunks.
+
+    Example usage:
+        varcode-effects
+            --vcf sample.vcf.gz \
+            --genome GRCh38 \
+            --jobs 4 \
+            --top-effect-only \
+            --transcript-filter canonical \
+            --output effects.tsv.gz
+    """
+    configure_logging()
+    _log_to_stderr()
+    from ..util import map_chunks_in_order
+    if args_list is None:
+        args_list = sys.argv[1:]
+    args = make_effects_parser().parse_args(args_list)
+    if args.jobs < 1:
+        raise ValueError("Expected --jobs to be at least 1, got %d" % args.jobs)
+    if args.chunk_size < 1:
+        raise ValueError(
+            "Expected --chunk-size to be at least 1, got %d" % args.chunk_size)
+    output_format = args.output_format or infer_output_format(args.output)
+    chunks = variant_chunks_from_args(args, chunk_size=args.chunk_size)
+    writer = effects_writer(args.output, output_format)
+    progress = Progress(args.progress_interval)
+    try:
+        for (n_variants, n_effects, rows) in map_chunks_in_order(
+                _annotate_chunk,
+                (list(chunk) for chunk in chunks),
+                n_jobs=args.jobs,
+                output_format=output_format,
+                top_effect_only=args.top_effect_only,
+                transcript_filter=parse_transcript_filter(
+                    args.transcript_filter),
+                raise_on_error=args.raise_on_error):
+            writer.write(rows)
+            progress.update(n_variants, n_effects)
+    finally:
+        writer.close()
+    progress.report()
@@ -0,0 +1,128 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import division, absolute_import
+from argparse import ArgumentParser
+import logging
+import sys
+import time
+
+from pyensembl import cached_release, genome_for_reference_name
+
+from .variants_script import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def make_index_parser():
+    parser = ArgumentParser(
+        description=(
+            "Build the memory-mapped transcript index of a genome, which "
+            "effect prediction uses instead of the pyensembl database once "
+            "it's loaded with varcode.use_transcript_index"))
+    genome_group = parser.add_mutually_exclusive_group(required=True)
+    genome_group.add_argument(
+        "--genome",
+        help="Reference assembly, e.g. 'GRCh38' or 'hg19'")
+    genome_group.add_argument(
+        "--ensembl-release",
+        type=int,
+        help="Ensembl release, e.g. 75")
+    genome_group.add_argument(
+        "--gtf",
+        help=(
+            "Index a local GTF file instead of a pyensembl genome, "
+            "requires --reference-name and --output"))
+    parser.add_argument(
+        "--species",
+        default="human",
+        help="Species of the Ensembl release (default: human)")
+    parser.add_argument(
+        "--reference-name",
+        help="Reference assembly of the GTF file, e.g. 'GRCh38'")
+    parser.add_argument(
+        "--transcript-fasta",
+        default=[],
+        action="append",
+        help="cDNA sequences of the GTF's transcripts, can be repeated")
+    parser.add_argument(
+        "--protein-fasta",
+        default=[],
+        action="append",
+        help="Protein sequences of the GTF's transcripts, can be repeated")
+    parser.add_argument(
+        "--contig",
+        default=[],
+        action="append",
+        help="Only index transcripts on this contig, can be repeated")
+    parser.add_argument(
+        "--output",
+        help=(
+            "Path of the index file, defaults to a file in the genome's "
+            "pyensembl cache directory"))
+    return parser
+
+
+def main(args_list=None):
+    """
+    Script which builds a transcript index.
+
+    Example usage:
+        varcode-index --ensembl-release 75
+        varcode-index --genome GRCh38 --contig 17 --output chr17.index
+        varcode-index --gtf gencode.basic.gtf.gz --reference-name GRCh38 \
+            --transcript-fasta cdna.fa.gz --protein-fasta pep.fa.gz \
+            --output gencode_basic.index
+    """
+    configure_logging()
+    if args_list is None:
+        args_list = sys.argv[1:]
+    parser = make_index_parser()
+    args = parser.parse_args(args_list)
+    contigs = args.contig if args.contig else None
+    if args.gtf:
+        if not args.reference_name or not args.output:
+            parser.error("--gtf requires --reference-name and --output")
+        from ..transcript_index import TranscriptIndex
+        start_time = time.time()
+        index = TranscriptIndex.from_gtf(
+            args.gtf,
+            transcript_fasta_paths=args.transcript_fasta,
+            protein_fasta_paths=args.protein_fasta,
+            reference_name=args.reference_name,
+            contigs=contigs)
+        path = index.save(args.output)
+        logger.info(
+            "Wrote transcript index of %s to %s in %0.1f seconds",
+            args.gtf,
+            path,
+            time.time() - start_time)
+        return path
+    if args.genome:
+        genome = genome_for_reference_name(args.genome)
+    else:
+        genome = cached_release(args.ensembl_release, args.species)
+    # imported after parsing the arguments, since it loads NumPy
+    from ..transcript_index import build_transcript_index
+    start_time = time.time()
+    path = build_transcript_index(
+        genome,
+        path=args.output,
+        contigs=contigs)
+    logger.info(
+        "Wrote transcript index of %s to %s in %0.1f seconds",
+        genome,
+        path,
+        time.time() - start_time)
+    return path
@@ -0,0 +1,122 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import division, absolute_import
+from argparse import ArgumentParser
+import logging
+import sys
+
+from .variants_script import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def make_serve_parser():
+    parser = ArgumentParser(
+        description=(
+            "Serve effect predictions over HTTP, keeping genomes, transcript "
+            "indices and worker processes warm between requests"))
+    parser.add_argument(
+        "--genome",
+        default=[],
+        action="append",
+        help=(
+            "Reference assembly or Ensembl release to warm up, e.g. 'GRCh38' "
+            "or 75. Can be repeated, the first is the default genome of "
+            "variants which don't name theirs"))
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=None,
+        help="TCP port to listen on")
+    parser.add_argument(
+        "--socket",
+        help="Listen on a Unix socket at this path instead of a TCP port")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes which annotate batches (default: 1)")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Maximum number of variants in one batch (default: 1000)")
+    parser.add_argument(
+        "--batch-wait-ms",
+        type=float,
+        default=5.0,
+        help=(
+            "Milliseconds to wait for concurrent requests to join a batch "
+            "(default: 5)"))
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help=(
+            "Query the pyensembl databases instead of preloading a "
+            "transcript index of each genome"))
+    parser.add_argument(
+        "--effect-cache",
+        help="Path of a persistent EffectCache database")
+    parser.add_argument(
+        "--max-body-mb",
+        type=float,
+        default=64.0,
+        help=(
+            "Maximum size of request bodies in megabytes, larger requests "
+            "are rejected (default: 64)"))
+    return parser
+
+
+def main(args_list=None):
+    """
+    Script which runs an annotation server until it's interrupted.
+
+    Example usage:
+        varcode-serve --genome GRCh38 --port 8457 --workers 4
+        varcode-serve --genome GRCh37 --socket /tmp/varcode.sock
+    """
+    configure_logging()
+    if args_list is None:
+        args_list = sys.argv[1:]
+    args = make_serve_parser().parse_args(args_list)
+    # imported after parsing the arguments, since they load pyensembl
+    from ..effects import EffectCache
+    from ..server import DEFAULT_PORT, AnnotationServer
+    genomes = [
+        int(genome) if genome.isdigit() else genome
+        for genome in args.genome
+    ]
+    server = AnnotationServer(
+        genomes,
+        host=args.host,
+        port=DEFAULT_PORT if args.port is None else args.port,
+        socket_path=args.socket,
+        n_workers=args.workers,
+        batch_size=args.batch_size,
+        batch_wait=args.batch_wait_ms / 1000.0,
+        use_index=not args.no_index,
+        cache=EffectCache(args.effect_cache) if args.effect_cache else None,
+        max_body_size=int(args.max_body_mb * 1024 * 1024))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.shutdown()
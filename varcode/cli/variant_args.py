@@ -17,9 +17,6 @@ from argparse import ArgumentParser
 
 from pyensembl import genome_for_reference_name
 
-from ..vcf import load_vcf
-from ..maf import load_maf
-from ..variant_collection import VariantCollection
 from ..variant import Variant
 
 
@@ -75,7 +72,10 @@ def add_variant_args(arg_parser):
         "--json-variants",
         default=[],
         action="append",
-        help="Path to Varcode.VariantCollection object serialized as a JSON file.")
+        help=(
+            "Path to Varcode.VariantCollection object serialized as a JSON "
+            "file, or written as newline delimited JSON by "
+            "VariantCollection.to_ndjson (which is read one line at a time)."))
 
     return variant_arg_group
 
@@ -94,15 +94,31 @@ def make_variants_parser(**kwargs):
     add_variant_args(parser)
     return parser
 
-def variant_collection_from_args(args, required=True):
-    variant_collections = []
-
-    if args.genome:
-        genome = genome_for_reference_name(args.genome)
-    else:
+def genome_from_args(args):
+    """
+    Genome named by the --genome argument, either a reference name or the
+    key of a genome registered with `varcode.register_genome`.
+    """
+    if not args.genome:
         # no genome specified, assume it can be inferred from the file(s)
         # we're loading
-        genome = None
+        return None
+    from ..genome_registry import genome_from_key
+    genome = genome_from_key(args.genome)
+    if genome is None:
+        genome = genome_for_reference_name(args.genome)
+    return genome
+
+def variant_collection_from_args(args, required=True):
+    # loaders import pandas and PyVCF, so only import them after the
+    # arguments were parsed (e.g. not for --help)
+    from ..maf import load_maf
+    from ..ndjson import is_ndjson_file, read_variants_ndjson
+    from ..variant_collection import VariantCollection
+    from ..vcf import load_vcf
+
+    variant_collections = []
+    genome = genome_from_args(args)
 
     for vcf_path in args.vcf:
         variant_collections.append(load_vcf(vcf_path, genome=genome))
@@ -128,6 +144,9 @@ def variant_collection_from_args(args, required=True):
         variant_collections.append(variant_collection)
 
     for json_path in args.json_variants:
+        if is_ndjson_file(json_path):
+            variant_collections.append(read_variants_ndjson(json_path))
+            continue
         with open(json_path, 'r') as f:
             variant_collections.append(
                 VariantCollection.from_json(f.read()))
@@ -137,3 +156,60 @@ def variant_collection_from_args(args, required=True):
             "No variants loaded (use --maf, --vcf, --variant, or --json-variants options)")
     # pylint: disable=no-value-for-parameter
     return VariantCollection.union(*variant_collections)
+
+def variant_chunks_from_args(args, chunk_size, required=True):
+    """
+    Generate the variants given by the commandline arguments as a sequence of
+    VariantCollections with at most `chunk_size` variants each, reading VCF,
+    MAF and NDJSON files one chunk at a time.
+    """
+    from ..maf import iter_maf_chunks
+    from ..ndjson import is_ndjson_file, iter_variants_ndjson
+    from ..variant_collection import VariantCollection
+    from ..vcf import iter_vcf_chunks
+
+    if required and not (
+            args.vcf or args.maf or args.variant or args.json_variants):
+        raise ValueError(
+            "No variants loaded (use --maf, --vcf, --variant, or --json-variants options)")
+    genome = genome_from_args(args)
+    if args.variant and not genome:
+        raise ValueError("--genome must be specified when using --variant")
+
+    def split(variants):
+        chunk = []
+        for variant in variants:
+            chunk.append(variant)
+            if len(chunk) == chunk_size:
+                yield VariantCollection(chunk)
+                chunk = []
+        if chunk:
+            yield VariantCollection(chunk)
+
+    def generate_chunks():
+        for vcf_path in args.vcf:
+            for chunk in iter_vcf_chunks(
+                    vcf_path, genome=genome, chunk_size=chunk_size):
+                yield chunk
+        for maf_path in args.maf:
+            for chunk in iter_maf_chunks(maf_path, chunk_size=chunk_size):
+                yield chunk
+        for chunk in split(
+                Variant(
+                    chromosome,
+                    start=position,
+                    ref=ref,
+                    alt=alt,
+                    ensembl=genome)
+                for (chromosome, position, ref, alt) in args.variant):
+            yield chunk
+        for json_path in args.json_variants:
+            if is_ndjson_file(json_path):
+                variants = iter_variants_ndjson(json_path)
+            else:
+                with open(json_path, 'r') as f:
+                    variants = VariantCollection.from_json(f.read())
+            for chunk in split(variants):
+                yield chunk
+
+    return generate_chunks()
@@ -15,16 +15,25 @@
 from __future__ import division, absolute_import
 import logging
 import logging.config
-import pkg_resources
+import os
 import sys
 
 from .variant_args import make_variants_parser, variant_collection_from_args
 
 
-logging.config.fileConfig(pkg_resources.resource_filename(__name__, 'logging.conf'))
 logger = logging.getLogger(__name__)
 
 
+def configure_logging():
+    """
+    Load the logging configuration shipped with varcode. This happens when
+    the script runs rather than when it's imported, and finds the file
+    relative to this module instead of importing pkg_resources.
+    """
+    logging.config.fileConfig(
+        os.path.join(os.path.dirname(__file__), 'logging.conf'))
+
+
 def main(args_list=None):
     """
     Script which loads variants and annotates them with  overlapping genes.
@@ -37,13 +46,21 @@ def main(args_list=None):
             --variant chr1 498584 C G \
             --json-variants more_variants.json
     """
+    configure_logging()
     if args_list is None:
         args_list = sys.argv[1:]
     arg_parser = make_variants_parser(
         description="Annotate variants with overlapping gene names")
     arg_parser.add_argument("--output-csv", help="Output path to CSV")
+    arg_parser.add_argument(
+        "--output-ndjson",
+        help=(
+            "Output path for the variants as newline delimited JSON, which "
+            "can be loaded again with --json-variants"))
     args = arg_parser.parse_args(args_list)
     variants = variant_collection_from_args(args)
+    if args.output_ndjson:
+        variants.to_ndjson(args.output_ndjson)
     variants_dataframe = variants.to_dataframe()
     logger.info('\n%s', variants_dataframe)
     if args.output_csv:
@@ -0,0 +1,181 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Annotate the variants of many samples at once, predicting the effects of
+each distinct variant only once.
+"""
+
+from __future__ import print_function, division, absolute_import
+from collections import OrderedDict
+import logging
+import multiprocessing
+
+from .effects import EffectCollection, predict_variant_effects
+from .effects.effect_cache import (
+    decode_effect,
+    encode_effect,
+    variant_annotation_key,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CohortAnnotationReport(object):
+    """
+    Summary of how much work was saved by annotating each distinct variant
+    of a cohort only once.
+    """
+    def __init__(self, n_collections, n_variants, n_distinct_variants):
+        self.n_collections = n_collections
+        self.n_variants = n_variants
+        self.n_distinct_variants = n_distinct_variants
+
+    @property
+    def n_annotations_saved(self):
+        return self.n_variants - self.n_distinct_variants
+
+    @property
+    def fraction_saved(self):
+        if self.n_variants == 0:
+            return 0.0
+        return self.n_annotations_saved / self.n_variants
+
+    def __str__(self):
+        return (
+            "CohortAnnotationReport(n_collections=%d, n_variants=%d, "
+            "n_distinct_variants=%d, fraction_saved=%0.3f)") % (
+                self.n_collections,
+                self.n_variants,
+                self.n_distinct_variants,
+                self.fraction_saved)
+
+    def __repr__(self):
+        return str(self)
+
+
+def _predict_effects_for_variants(args):
+    """
+    Worker function for annotating a chunk of variants in another process,
+    takes a single tuple of arguments so it can be used with Pool.map.
+
+    Effects are sent back encoded with `encode_effect` rather than pickled,
+    so that their transcripts and genomes don't have to be, and are decoded
+    from the annotation of the parent process.
+    """
+    (variants, raise_on_error, cache) = args
+    return [
+        [
+            encode_effect(effect)
+            for effect in predict_variant_effects(
+                variant,
+                raise_on_error=raise_on_error,
+                cache=cache)
+        ]
+        for variant in variants
+    ]
+
+
+def annotate_cohort(
+        variant_collections,
+        raise_on_error=True,
+        n_jobs=1,
+        chunk_size=1000,
+        cache=None):
+    """
+    Predict the effects of the variants in multiple VariantCollections
+    (e.g. one per tumor sample), annotating every distinct variant only once
+    and sharing the resulting effects between the collections which
+    contain it.
+
+    Parameters
+    ----------
+    variant_collections : list of VariantCollection
+
+    raise_on_error : bool, optional
+        Raise exceptions encountered while predicting effects rather than
+        only logging them.
+
+    n_jobs : int, optional
+        Number of processes to annotate the distinct variants with.
+
+    chunk_size : int, optional
+        Number of variants sent to a worker process at once when n_jobs > 1.
+
+    cache : EffectCache, optional
+        Persistent cache of previously predicted effects.
+
+    Returns a list with an EffectCollection for each of the given variant
+    collections and a CohortAnnotationReport.
+    """
+    distinct_variants = OrderedDict()
+    n_variants = 0
+    for variant_collection in variant_collections:
+        for variant in variant_collection:
+            n_variants += 1
+            key = variant_annotation_key(variant)
+            if key not in distinct_variants:
+                distinct_variants[key] = variant
+
+    report = CohortAnnotationReport(
+        n_collections=len(variant_collections),
+        n_variants=n_variants,
+        n_distinct_variants=len(distinct_variants))
+    logger.info("Annotating %s", report)
+
+    variants = list(distinct_variants.values())
+    if n_jobs > 1 and len(variants) > chunk_size:
+        chunks = [
+            variants[i:i + chunk_size]
+            for i in range(0, len(variants), chunk_size)
+        ]
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            chunk_results = pool.map(
+                _predict_effects_for_variants,
+                [(chunk, raise_on_error, cache) for chunk in chunks])
+        finally:
+            pool.close()
+            pool.join()
+        encoded_effects_per_variant = [
+            encoded_effects
+            for chunk_effects in chunk_results
+            for encoded_effects in chunk_effects
+        ]
+        effects_per_variant = [
+            [decode_effect(encoded, variant) for encoded in encoded_effects]
+            for (variant, encoded_effects) in zip(
+                variants, encoded_effects_per_variant)
+        ]
+    else:
+        effects_per_variant = [
+            list(predict_variant_effects(
+                variant,
+                raise_on_error=raise_on_error,
+                cache=cache))
+            for variant in variants
+        ]
+
+    key_to_effects = dict(zip(distinct_variants.keys(), effects_per_variant))
+    effect_collections = [
+        EffectCollection(
+            [
+                effect
+                for variant in variant_collection
+                for effect in key_to_effects[variant_annotation_key(variant)]
+            ],
+            sources=variant_collection.sources)
+        for variant_collection in variant_collections
+    ]
+    return effect_collections, report
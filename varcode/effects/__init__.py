@@ -12,50 +12,72 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""
+Effect classes and prediction functions, loaded on first access (PEP 562) so
+that importing this package doesn't import pandas or Biopython.
+"""
+
 from __future__ import print_function, division, absolute_import
 
-from .effect_collection import EffectCollection
-from .effect_ordering import (
-    effect_priority,
-    effect_sort_key,
-    top_priority_effect,
-)
-from .effect_prediction import (
-    predict_variant_effects,
-    predict_variant_effect_on_transcript,
-    predict_variant_effect_on_transcript_or_failure,
-)
-from .effect_classes import (
-    MutationEffect,
-    TranscriptMutationEffect,
-    NonsilentCodingMutation,
-    Failure,
-    IncompleteTranscript,
-    Intergenic,
-    Intragenic,
-    NoncodingTranscript,
-    Intronic,
-    ThreePrimeUTR,
-    FivePrimeUTR,
-    Silent,
-    Substitution,
-    Insertion,
-    Deletion,
-    ComplexSubstitution,
-    AlternateStartCodon,
-    IntronicSpliceSite,
-    ExonicSpliceSite,
-    StopLoss,
-    SpliceDonor,
-    SpliceAcceptor,
-    PrematureStop,
-    FrameShiftTruncation,
-    StartLoss,
-    FrameShift,
-    ExonLoss,
-)
+from importlib import import_module
+
+# name of each public attribute -> module it's defined in
+_lazy_attributes = {
+    "EffectCache": ".effect_cache",
+    "EffectCollection": ".effect_collection",
+    "effect_priority": ".effect_ordering",
+    "effect_sort_key": ".effect_ordering",
+    "top_priority_effect": ".effect_ordering",
+    "predict_variant_effects": ".effect_prediction",
+    "predict_variant_effect_on_transcript": ".effect_prediction",
+    "predict_variant_effect_on_transcript_or_failure": ".effect_prediction",
+    "predict_variant_top_effect": ".effect_prediction",
+    "filter_transcripts": ".transcript_filter",
+    "canonical_transcript_id": ".transcript_filter",
+    "MutationEffect": ".effect_classes",
+    "TranscriptMutationEffect": ".effect_classes",
+    "NonsilentCodingMutation": ".effect_classes",
+    "Failure": ".effect_classes",
+    "IncompleteTranscript": ".effect_classes",
+    "Intergenic": ".effect_classes",
+    "Intragenic": ".effect_classes",
+    "NoncodingTranscript": ".effect_classes",
+    "Intronic": ".effect_classes",
+    "ThreePrimeUTR": ".effect_classes",
+    "FivePrimeUTR": ".effect_classes",
+    "Silent": ".effect_classes",
+    "Substitution": ".effect_classes",
+    "Insertion": ".effect_classes",
+    "Deletion": ".effect_classes",
+    "ComplexSubstitution": ".effect_classes",
+    "AlternateStartCodon": ".effect_classes",
+    "IntronicSpliceSite": ".effect_classes",
+    "ExonicSpliceSite": ".effect_classes",
+    "StopLoss": ".effect_classes",
+    "SpliceDonor": ".effect_classes",
+    "SpliceAcceptor": ".effect_classes",
+    "PrematureStop": ".effect_classes",
+    "FrameShiftTruncation": ".effect_classes",
+    "StartLoss": ".effect_classes",
+    "FrameShift": ".effect_classes",
+    "ExonLoss": ".effect_classes",
+}
+
+
+def __getattr__(name):
+    if name not in _lazy_attributes:
+        raise AttributeError(
+            "module '%s' has no attribute '%s'" % (__name__, name))
+    value = getattr(import_module(_lazy_attributes[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
 
 __all__ = [
+    "EffectCache",
     "EffectCollection",
     # effect ordering
     "effect_priority",
@@ -66,6 +88,11 @@ __all__ = [
     "predict_variant_effects",
     "predict_variant_effect_on_transcript",
     "predict_variant_effect_on_transcript_or_failure",
+    "predict_variant_top_effect",
+
+    # selecting transcripts
+    "filter_transcripts",
+    "canonical_transcript_id",
 
     # effect classes
     "MutationEffect",
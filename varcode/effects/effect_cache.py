@@ -0,0 +1,358 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Persistent on-disk cache of predicted effects, so that variants which recur
+across samples or reruns only have to be annotated once.
+"""
+
+from __future__ import print_function, division, absolute_import
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from pyensembl import Exon, Gene, Transcript
+
+from ..genome_registry import annotation_for_genome
+
+from . import effect_classes
+from .effect_classes import MutationEffect, Failure
+
+logger = logging.getLogger(__name__)
+
+# bump this if the serialized representation of effects changes, entries
+# written with a different version are ignored
+EFFECT_CACHE_FORMAT_VERSION = 1
+
+
+def variant_annotation_key(variant):
+    """
+    Compact tuple which identifies a variant along with the annotation
+    release used to predict its effects, so that two variants with the same
+    key always have the same effects.
+    """
+    genome = variant.ensembl
+    return (
+        genome.reference_name,
+        genome.annotation_name,
+        genome.annotation_version,
+        variant.contig,
+        variant.start,
+        variant.ref,
+        variant.alt)
+
+
+def effect_cache_key(variant):
+    """
+    String key of a variant in the effect cache.
+    """
+    return "|".join(
+        str(x) for x in
+        (EFFECT_CACHE_FORMAT_VERSION,) + variant_annotation_key(variant))
+
+
+def _encode_value(value):
+    """
+    Encode a field of an effect as JSON-compatible data, replacing
+    PyEnsembl objects with their IDs. Non-primitive values are encoded
+    as a [tag, value] pair.
+    """
+    if isinstance(value, Transcript):
+        return ["T", value.id]
+    elif isinstance(value, Gene):
+        return ["G", value.id]
+    elif isinstance(value, Exon):
+        return ["E", value.id]
+    elif isinstance(value, MutationEffect):
+        return ["M", encode_effect(value)]
+    elif isinstance(value, (list, tuple)):
+        return ["L", [_encode_value(x) for x in value]]
+    return value
+
+
+def _decode_value(value, variant):
+    if not isinstance(value, list):
+        return value
+    tag, contents = value
+    annotation = annotation_for_genome(variant.ensembl)
+    if tag == "T":
+        return annotation.transcript_by_id(contents)
+    elif tag == "G":
+        return annotation.gene_by_id(contents)
+    elif tag == "E":
+        return annotation.exon_by_id(contents)
+    elif tag == "M":
+        return decode_effect(contents, variant)
+    elif tag == "L":
+        return [_decode_value(x, variant) for x in contents]
+    raise ValueError("Unknown tag '%s' in serialized effect" % (tag,))
+
+
+def encode_effect(effect):
+    """
+    Compact representation of a MutationEffect which doesn't include its
+    variant, as a [class name, {field: value}] pair.
+    """
+    fields = {
+        name: _encode_value(value)
+        for (name, value) in effect.to_dict().items()
+        if name != "variant"
+    }
+    return [effect.__class__.__name__, fields]
+
+
+def decode_effect(encoded_effect, variant):
+    """
+    Reconstruct a MutationEffect of the given variant from the result
+    of `encode_effect`.
+    """
+    class_name, fields = encoded_effect
+    effect_class = getattr(effect_classes, class_name)
+    kwargs = {
+        name: _decode_value(value, variant)
+        for (name, value) in fields.items()
+    }
+    return effect_class(variant=variant, **kwargs)
+
+
+class EffectCache(object):
+    """
+    SQLite-backed cache of the effects predicted for each variant, keyed by
+    reference name, annotation release and variant locus and alleles.
+
+    The database uses write-ahead logging so that multiple processes can
+    read and write the same cache file concurrently. Each process (and each
+    thread) opens its own connection, which also makes instances of this
+    class safe to pickle and send to worker processes or share between
+    threads.
+
+    If `max_size_bytes` is given then the least recently used entries are
+    evicted whenever the cached effects grow past that size.
+    """
+
+    def __init__(self, path, max_size_bytes=None, timeout=60.0):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite database file, created if it doesn't exist.
+
+        max_size_bytes : int, optional
+            Approximate limit on the total size of cached effects.
+
+        timeout : float
+            Seconds to wait for other processes holding a lock on the database.
+        """
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        # connection of each thread, along with the process it was opened in
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # checking the total size requires a full scan, so only do it
+        # after this many bytes have been written since the last check
+        self._bytes_since_size_check = 0
+
+    def __getstate__(self):
+        return dict(
+            path=self.path,
+            max_size_bytes=self.max_size_bytes,
+            timeout=self.timeout)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __str__(self):
+        return "EffectCache(path='%s', hits=%d, misses=%d)" % (
+            self.path, self.hits, self.misses)
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def connection(self):
+        """
+        SQLite connection owned by the current thread, created on first use.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                # only used by this thread, but closed by whichever
+                # thread calls close()
+                check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS effects ("
+                "key TEXT PRIMARY KEY, "
+                "value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "last_access REAL NOT NULL)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS effects_last_access "
+                "ON effects (last_access)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._connections.append((connection, os.getpid()))
+        return connection
+
+    def close(self):
+        """
+        Close the connections which threads of this process opened.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for (connection, pid) in connections:
+            if pid == os.getpid():
+                connection.close()
+        self._local = threading.local()
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of lookups by this process which were found in the cache.
+        """
+        n_lookups = self.hits + self.misses
+        if n_lookups == 0:
+            return 0.0
+        return self.hits / n_lookups
+
+    def get(self, variant):
+        """
+        Returns list of effects for the given variant, or None if they
+        aren't in the cache.
+        """
+        key = effect_cache_key(variant)
+        row = self.connection.execute(
+            "SELECT value FROM effects WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        if self.max_size_bytes is not None:
+            # access times only matter for eviction
+            self.connection.execute(
+                "UPDATE effects SET last_access = ? WHERE key = ?",
+                (time.time(), key))
+        encoded_effects = json.loads(
+            zlib.decompress(bytes(row[0])).decode("utf-8"))
+        return [decode_effect(e, variant) for e in encoded_effects]
+
+    def put(self, variant, effects):
+        """
+        Add the effects of a variant to the cache. Effects which include an
+        annotation `Failure` aren't cached, since they depend on whether
+        errors were being raised.
+        """
+        if any(isinstance(effect, Failure) for effect in effects):
+            return
+        value = zlib.compress(json.dumps(
+            [encode_effect(effect) for effect in effects],
+            separators=(",", ":")).encode("utf-8"))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO effects (key, value, size, last_access) "
+            "VALUES (?, ?, ?, ?)",
+            (effect_cache_key(variant), sqlite3.Binary(value), len(value), time.time()))
+        if self.max_size_bytes is not None:
+            with self._lock:
+                self._bytes_since_size_check += len(value)
+                check_size = (
+                    self._bytes_since_size_check > self.max_size_bytes // 100)
+            if check_size:
+                self.evict()
+
+    def size_bytes(self):
+        """
+        Total size of the cached effects, not counting database overhead.
+        """
+        (size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM effects").fetchone()
+        return size
+
+    def __len__(self):
+        (count,) = self.connection.execute(
+            "SELECT COUNT(*) FROM effects").fetchone()
+        return count
+
+    def evict(self, max_size_bytes=None):
+        """
+        Delete the least recently used entries until the cache is smaller than
+        90% of `max_size_bytes` (defaults to the limit given to the
+        constructor). Returns the number of deleted entries.
+        """
+        self._bytes_since_size_check = 0
+        if max_size_bytes is None:
+            max_size_bytes = self.max_size_bytes
+        if max_size_bytes is None:
+            return 0
+        excess = self.size_bytes() - max_size_bytes
+        if excess <= 0:
+            return 0
+        target_bytes_to_delete = excess + max_size_bytes // 10
+        deleted_keys = []
+        deleted_bytes = 0
+        for (key, size) in self.connection.execute(
+                "SELECT key, size FROM effects ORDER BY last_access"):
+            if deleted_bytes >= target_bytes_to_delete:
+                break
+            deleted_keys.append((key,))
+            deleted_bytes += size
+        self.connection.executemany(
+            "DELETE FROM effects WHERE key = ?", deleted_keys)
+        logger.info(
+            "Evicted %d entries (%d bytes) from %s",
+            len(deleted_keys),
+            deleted_bytes,
+            self)
+        return len(deleted_keys)
+
+    def clear(self):
+        self.connection.execute("DELETE FROM effects")
+
+
+class ChainedEffectCaches(object):
+    """
+    Looks up the effects of a variant in each of several caches in turn,
+    adding predicted effects to all of them.
+    """
+    def __init__(self, caches):
+        self.caches = list(caches)
+
+    def get(self, variant):
+        for cache in self.caches:
+            effects = cache.get(variant)
+            if effects is not None:
+                return effects
+        return None
+
+    def put(self, variant, effects):
+        for cache in self.caches:
+            cache.put(variant, effects)
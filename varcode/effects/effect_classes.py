@@ -19,10 +19,47 @@ from serializable import Serializable
 
 from .common import bio_seq_to_str
 
-class MutationEffect(Serializable):
+def effect_class_priority(effect_class):
+    """
+    Priority assigned to exactly the given effect class when
+    effect_ordering was imported, or None if it has none. Subclasses defined
+    later don't inherit the priority of their parent class.
+    """
+    return effect_class.__dict__.get("priority")
+
+class _SlottedSerializable(object):
+    """
+    The methods of serializable.Serializable on a class with empty __slots__.
+    Inheriting from Serializable itself, which doesn't declare __slots__,
+    would give every instance a __dict__.
+    """
+    __slots__ = ()
+
+    _SERIALIZABLE_KEYWORD_ALIASES = {}
+
+    __eq__ = Serializable.__eq__
+    __hash__ = Serializable.__hash__
+    __reduce__ = Serializable.__reduce__
+    to_dict = Serializable.to_dict
+    to_json = Serializable.to_json
+    write_json_file = Serializable.write_json_file
+    _reconstruct_nested_objects = Serializable.__dict__[
+        "_reconstruct_nested_objects"]
+    _update_kwargs = Serializable.__dict__["_update_kwargs"]
+    from_dict = Serializable.__dict__["from_dict"]
+    from_json = Serializable.__dict__["from_json"]
+    read_json_file = Serializable.__dict__["read_json_file"]
+
+class MutationEffect(_SlottedSerializable):
     """
     Base class for mutation effects.
+
+    Effect classes declare their fields with __slots__ and don't have a
+    __dict__, to keep instances compact since large collections can contain
+    millions of effects. Derived values such as the mutant protein sequence
+    are computed on first access and stored in slots of their own.
     """
+    __slots__ = ("variant", "_sort_key")
 
     def __init__(self, variant):
         self.variant = variant
@@ -40,6 +77,19 @@ class MutationEffect(Serializable):
         """
         return self.variant < other.variant
 
+    def _shallow_copy(self):
+        """
+        Copy of this effect which shares all of its field values. Avoids
+        copy.copy, since Serializable objects get copied by calling their
+        constructor again.
+        """
+        cls = self.__class__
+        result = cls.__new__(cls)
+        for name in _slot_names(cls):
+            if hasattr(self, name):
+                setattr(result, name, getattr(self, name))
+        return result
+
     @property
     def short_description(self):
         """
@@ -52,6 +102,30 @@ class MutationEffect(Serializable):
     transcript = None
     gene = None
 
+    # position of this effect's class in
+    # effect_ordering.transcript_effect_priority_list, assigned to each
+    # class when that module gets imported (see effect_class_priority)
+    priority = None
+
+    @memoized_property
+    def sort_key(self):
+        """
+        Tuple of the priority of this effect, the length of the coding
+        sequence of its transcript and the length of the transcript. Computed
+        once and then reused whenever effects are compared with
+        `effect_ordering.effect_sort_key`.
+        """
+        priority = effect_class_priority(self.__class__)
+        if priority is None:
+            raise KeyError(self.__class__)
+        transcript_length = 0
+        cds_length = 0
+        if self.transcript is not None:
+            transcript_length = len(self.transcript)
+            if self.transcript.complete:
+                cds_length = len(self.transcript.coding_sequence)
+        return (priority, cds_length, transcript_length)
+
     @property
     def original_protein_sequence(self):
         """Amino acid sequence of a coding transcript (without the nucleotide
@@ -111,6 +185,8 @@ class MutationEffect(Serializable):
 
 class Intergenic(MutationEffect):
     """Variant has unknown effect if it occurs between genes"""
+    __slots__ = ()
+
     short_description = "intergenic"
 
 
@@ -120,6 +196,8 @@ class Intragenic(MutationEffect):
     apparently does happen sometimes, maybe some genes have two distinct sets
     of exons which are never simultaneously expressed?
     """
+    __slots__ = ("gene",)
+
     short_description = "intragenic"
 
     def __init__(self, variant, gene):
@@ -127,6 +205,8 @@ class Intragenic(MutationEffect):
         self.gene = gene
 
 class TranscriptMutationEffect(Intragenic):
+    __slots__ = ("transcript",)
+
     def __init__(self, variant, transcript):
         Intragenic.__init__(self, variant, gene=transcript.gene)
         self.transcript = transcript
@@ -143,17 +223,23 @@ class Failure(TranscriptMutationEffect):
     """Special placeholder effect for when we want to suppress errors but still
     need to create a non-empty list of effects for each variant.
     """
+    __slots__ = ()
+
 
 class NoncodingTranscript(TranscriptMutationEffect):
     """
     Any mutation to a transcript with a non-coding biotype
     """
+    __slots__ = ()
+
     short_description = "non-coding-transcript"
 
 class IncompleteTranscript(TranscriptMutationEffect):
     """
     Any mutation to an incompletely annotated transcript with a coding biotype
     """
+    __slots__ = ()
+
     short_description = "incomplete"
 
 class FivePrimeUTR(TranscriptMutationEffect):
@@ -161,6 +247,8 @@ class FivePrimeUTR(TranscriptMutationEffect):
     Any mutation to the 5' untranslated region (before the start codon) of
     coding transcript.
     """
+    __slots__ = ()
+
     short_description = "5' UTR"
 
 class ThreePrimeUTR(TranscriptMutationEffect):
@@ -168,6 +256,8 @@ class ThreePrimeUTR(TranscriptMutationEffect):
     Any mutation to the 3' untranslated region (after the stop codon) of
     coding transcript.
     """
+    __slots__ = ()
+
     short_description = "3' UTR"
 
 
@@ -175,6 +265,8 @@ class Intronic(TranscriptMutationEffect):
     """
     Mutation in an intronic region of a coding transcript
     """
+    __slots__ = ("nearest_exon", "distance_to_exon")
+
     def __init__(self, variant, transcript, nearest_exon, distance_to_exon):
         TranscriptMutationEffect.__init__(self, variant, transcript)
         self.nearest_exon = nearest_exon
@@ -186,7 +278,7 @@ class SpliceSite(object):
     """
     Parent class for all splice site mutations.
     """
-    pass
+    __slots__ = ()
 
 class IntronicSpliceSite(Intronic, SpliceSite):
     """
@@ -194,6 +286,8 @@ class IntronicSpliceSite(Intronic, SpliceSite):
     nucleotides in an intron, since those are  known to more confidently
     affect splicing and are given their own effect classes below.
     """
+    __slots__ = ()
+
     def __init__(self, variant, transcript, nearest_exon, distance_to_exon):
         Intronic.__init__(
             self, variant, transcript, nearest_exon, distance_to_exon)
@@ -204,6 +298,8 @@ class SpliceDonor(IntronicSpliceSite):
     """
     Mutation in the first two intron residues.
     """
+    __slots__ = ()
+
     def __init__(self, variant, transcript, nearest_exon, distance_to_exon):
         IntronicSpliceSite.__init__(
             self, variant, transcript, nearest_exon, distance_to_exon)
@@ -214,18 +310,22 @@ class SpliceAcceptor(IntronicSpliceSite):
     """
     Mutation in the last two intron residues.
     """
+    __slots__ = ()
+
     short_description = "splice-acceptor"
 
 class Exonic(TranscriptMutationEffect):
     """
     Any mutation which affects the contents of an exon (coding region or UTRs)
     """
-    pass
+    __slots__ = ()
 
 class ExonLoss(Exonic):
     """
     Deletion of one or more exons in a transcript.
     """
+    __slots__ = ("exons",)
+
     def __init__(self, variant, transcript, exons):
         Exonic.__init__(self, variant, transcript)
         self.exons = exons
@@ -253,6 +353,8 @@ class ExonicSpliceSite(Exonic, SpliceSite):
     Mutation in the last three nucleotides before an intron
     or in the first nucleotide after an intron.
     """
+    __slots__ = ("exon", "alternate_effect")
+
     def __init__(self, variant, transcript, exon, alternate_effect):
         Exonic.__init__(self, variant, transcript)
         self.exon = exon
@@ -287,6 +389,8 @@ class CodingMutation(Exonic):
     """
     Base class for all mutations which result in a modified coding sequence.
     """
+    __slots__ = ()
+
     def __str__(self):
         fields = [
             ("variant", self.variant.short_description),
@@ -309,6 +413,8 @@ class Silent(CodingMutation):
     """Mutation to an exon of a coding region which doesn't change the
     amino acid sequence.
     """
+    __slots__ = ("aa_pos", "aa_ref")
+
     def __init__(
             self,
             variant,
@@ -343,6 +449,8 @@ class AlternateStartCodon(Silent):
     """Change to the start codon (e.g. ATG>CTG) but without changing the
     starting amino acid from methionine.
     """
+    __slots__ = ("ref_codon", "alt_codon")
+
     def __init__(
             self,
             variant,
@@ -367,6 +475,11 @@ class NonsilentCodingMutation(CodingMutation):
     """
     All coding mutations other than silent codon substitutions
     """
+    __slots__ = (
+        "aa_mutation_start_offset",
+        "aa_mutation_end_offset",
+        "aa_ref",
+    )
 
     def __init__(
             self,
@@ -408,6 +521,8 @@ class StartLoss(NonsilentCodingMutation):
     an alternative Kozak consensus sequence (either before or after the
     original) from which an alternative start codon can be inferred.
     """
+    __slots__ = ()
+
     def __init__(
             self,
             variant,
@@ -435,6 +550,8 @@ class KnownAminoAcidChange(NonsilentCodingMutation):
     Coding mutations in which we can predict what the new/mutant protein
     sequence will be.
     """
+    __slots__ = ("aa_alt", "_mutant_protein_sequence")
+
     def __init__(
             self,
             variant,
@@ -478,6 +595,8 @@ class Substitution(KnownAminoAcidChange):
     """
     Single amino acid substitution, e.g. BRAF-001 V600E
     """
+    __slots__ = ()
+
     def __init__(
             self,
             variant,
@@ -506,6 +625,8 @@ class ComplexSubstitution(KnownAminoAcidChange):
     non-empty ref and alt strings, is more complicated than an insertion or
     deletion alone.
     """
+    __slots__ = ()
+
     def __init__(
             self,
             variant,
@@ -529,6 +650,8 @@ class Insertion(KnownAminoAcidChange):
     """
     In-frame insertion of one or more amino acids.
     """
+    __slots__ = ()
+
     def __init__(
             self,
             variant,
@@ -547,6 +670,8 @@ class Deletion(KnownAminoAcidChange):
     """
     In-frame deletion of one or more amino acids.
     """
+    __slots__ = ()
+
 
     def __init__(
             self,
@@ -566,6 +691,8 @@ class Deletion(KnownAminoAcidChange):
 class PrematureStop(KnownAminoAcidChange):
     """In-frame insertion of codons containing a stop codon. May also involve
     insertion/deletion/substitution of other amino acids preceding the stop."""
+    __slots__ = ("stop_codon_offset",)
+
     def __init__(
             self,
             variant,
@@ -613,6 +740,8 @@ class PrematureStop(KnownAminoAcidChange):
 
 
 class StopLoss(KnownAminoAcidChange):
+    __slots__ = ()
+
     def __init__(
             self,
             variant,
@@ -639,6 +768,8 @@ class StopLoss(KnownAminoAcidChange):
 
 
 class FrameShift(KnownAminoAcidChange):
+    __slots__ = ()
+
     def __init__(
             self,
             variant,
@@ -680,6 +811,8 @@ class FrameShiftTruncation(PrematureStop, FrameShift):
     """
     A frame-shift mutation which immediately introduces a stop codon.
     """
+    __slots__ = ()
+
     def __init__(
             self,
             variant,
@@ -703,3 +836,16 @@ class FrameShiftTruncation(PrematureStop, FrameShift):
         return "p.%s%dfs*" % (
             self.aa_ref,
             self.aa_mutation_start_offset + 1)
+
+
+# cache of the slot names declared by each effect class and its ancestors
+_slot_names_cache = {}
+
+def _slot_names(cls):
+    if cls not in _slot_names_cache:
+        _slot_names_cache[cls] = tuple(
+            name
+            for klass in cls.__mro__
+            for name in klass.__dict__.get("__slots__", ())
+        )
+    return _slot_names_cache[cls]
@@ -15,9 +15,12 @@
 from __future__ import print_function, division, absolute_import
 from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
 from sercol import Collection
 
+from ..genome_registry import annotation_for_genome
+from .effect_columns import EffectColumns, group_indices, take_values
 from .effect_ordering import (
     effect_priority,
     effect_sort_key,
@@ -54,6 +57,8 @@ class EffectCollection(Collection):
             distinct=distinct,
             sort_key=sort_key,
             sources=sources)
+        # columnar index of the effects, built on first use
+        self._columns = None
 
     def to_dict(self):
         return dict(
@@ -68,39 +73,97 @@ class EffectCollection(Collection):
             new_elements,
             rename_dict={"elements": "effects"})
 
+    @property
+    def _effect_columns(self):
+        """
+        EffectColumns with the variant, transcript, gene, class and
+        amino acid change of every effect, used to filter and group
+        effects with array operations.
+        """
+        if self._columns is None:
+            self._columns = EffectColumns.from_effects(list(self.elements))
+        return self._columns
+
+    def _take(self, indices):
+        """
+        New EffectCollection with the effects at the given indices, which
+        reuses the columns of this collection when the elements keep
+        their order.
+        """
+        elements = self.elements
+        if not isinstance(elements, list):
+            # distinct collections without a sort key keep a set of elements
+            elements = list(elements)
+        result = self.clone_with_new_elements([elements[i] for i in indices])
+        if self._columns is not None and (
+                self.sort_key is None and not self.distinct):
+            result._columns = self._columns.take(indices)
+        return result
+
+    def _filter_by_mask(self, mask):
+        return self._take(np.flatnonzero(mask))
+
+    def _groupby_field(self, field):
+        """
+        Group effects by one of the fields in EffectColumns, such as
+        "variant", "transcript" or "gene_name". Groups are ordered by their
+        first effect, like the groups of `groupby`.
+        """
+        keys, codes = self._effect_columns.keys_and_codes(field)
+        return {
+            keys[code]: self._take(indices)
+            for (code, indices) in group_indices(codes)
+        }
+
     def groupby_variant(self):
-        return self.groupby(key_fn=lambda effect: effect.variant)
+        return self._groupby_field("variant")
 
     def groupby_transcript(self):
-        return self.groupby(key_fn=lambda effect: effect.transcript)
+        return self._groupby_field("transcript")
 
     def groupby_transcript_name(self):
-        return self.groupby(key_fn=lambda effect: effect.transcript_name)
+        return self._groupby_field("transcript_name")
 
     def groupby_transcript_id(self):
-        return self.groupby(key_fn=lambda effect: effect.transcript_id)
+        return self._groupby_field("transcript_id")
 
     def groupby_gene(self):
-        return self.groupby(key_fn=lambda effect: effect.gene)
+        return self._groupby_field("gene")
 
     def groupby_gene_name(self):
-        return self.groupby(key_fn=lambda effect: effect.gene_name)
+        return self._groupby_field("gene_name")
 
     def groupby_gene_id(self):
-        return self.groupby(key_fn=lambda effect: effect.gene_id)
+        return self._groupby_field("gene_id")
 
     def gene_counts(self):
         """
-        Returns number of elements overlapping each gene name. Expects the
-        derived class (VariantCollection or EffectCollection) to have
-        an implementation of groupby_gene_name.
+        Returns number of elements overlapping each gene name.
         """
+        gene_names, codes = self._effect_columns.keys_and_codes("gene_name")
+        counts = np.bincount(codes, minlength=len(gene_names))
         return {
-            gene_name: len(group)
-            for (gene_name, group)
-            in self.groupby_gene_name().items()
+            gene_name: int(count)
+            for (gene_name, count) in zip(gene_names, counts)
+            if count > 0
         }
 
+    def _filter_by_expression(
+            self,
+            field,
+            expression_dict,
+            min_expression_value):
+        """
+        Keep effects whose value of `field` (a transcript or gene ID) has an
+        expression greater than `min_expression_value`, treating missing IDs
+        as having expression 0.0. Each distinct ID is only looked up once.
+        """
+        ids, codes = self._effect_columns.keys_and_codes(field)
+        id_passes = np.array(
+            [expression_dict.get(x, 0.0) > min_expression_value for x in ids],
+            dtype=bool)
+        return self._filter_by_mask(id_passes[codes])
+
     def filter_by_transcript_expression(
             self,
             transcript_expression_dict,
@@ -119,10 +182,10 @@ class EffectCollection(Collection):
         min_expression_value : float
             Threshold above which we'll keep an effect in the result collection
         """
-        return self.filter_above_threshold(
-            key_fn=lambda effect: effect.transcript_id,
-            value_dict=transcript_expression_dict,
-            threshold=min_expression_value)
+        return self._filter_by_expression(
+            "transcript_id",
+            transcript_expression_dict,
+            min_expression_value)
 
     def filter_by_gene_expression(
             self,
@@ -142,10 +205,10 @@ class EffectCollection(Collection):
         min_expression_value : float
             Threshold above which we'll keep an effect in the result collection
         """
-        return self.filter_above_threshold(
-            key_fn=lambda effect: effect.gene_id,
-            value_dict=gene_expression_dict,
-            threshold=min_expression_value)
+        return self._filter_by_expression(
+            "gene_id",
+            gene_expression_dict,
+            min_expression_value)
 
     def filter_by_effect_priority(self, min_priority_class):
         """
@@ -153,14 +216,15 @@ class EffectCollection(Collection):
         falls below the given class.
         """
         min_priority = transcript_effect_priority_dict[min_priority_class]
-        return self.filter(
-            lambda effect: effect_priority(effect) >= min_priority)
+        return self._filter_by_mask(
+            self._effect_columns.priority >= min_priority)
 
     def drop_silent_and_noncoding(self):
         """
         Create a new EffectCollection containing only non-silent coding effects
         """
-        return self.filter(lambda effect: effect.modifies_protein_sequence)
+        return self._filter_by_mask(
+            self._effect_columns.modifies_protein_sequence)
 
     def detailed_string(self):
         """
@@ -177,7 +241,8 @@ class EffectCollection(Collection):
             gene_effects_groups = variant_effects.groupby_gene_id()
             for (gene_id, gene_effects) in gene_effects_groups.items():
                 if gene_id:
-                    gene_name = variant.ensembl.gene_name_of_gene_id(gene_id)
+                    gene_name = annotation_for_genome(
+                        variant.ensembl).gene_name_of_gene_id(gene_id)
                     lines.append("  Gene: %s (%s)" % (gene_name, gene_id))
                 # place transcript effects with more significant impact
                 # on top (e.g. FrameShift should go before NoncodingTranscript)
@@ -204,28 +269,37 @@ class EffectCollection(Collection):
         """
         return top_priority_effect(self.elements)
 
-    # TODO: find a way to express these kinds of methods without
-    # duplicating every single groupby_* method
+    def _top_priority_effect_per_group(self, key_fn):
+        """
+        Highest priority effect for each distinct value of `key_fn`, found
+        in a single pass over the effects. Groups are ordered by their
+        first effect and ties go to the earliest effect, as with
+        `top_priority_effect` on the result of `groupby`.
+        """
+        best_effects = OrderedDict()
+        best_keys = {}
+        for effect in self:
+            group = key_fn(effect)
+            sort_key = effect_sort_key(effect)
+            if group not in best_keys or sort_key > best_keys[group]:
+                best_effects[group] = effect
+                best_keys[group] = sort_key
+        return best_effects
+
     def top_priority_effect_per_variant(self):
         """Highest priority effect for each unique variant"""
-        return OrderedDict(
-            (variant, top_priority_effect(variant_effects))
-            for (variant, variant_effects)
-            in self.groupby_variant().items())
+        return self._top_priority_effect_per_group(
+            lambda effect: effect.variant)
 
     def top_priority_effect_per_transcript_id(self):
         """Highest priority effect for each unique transcript ID"""
-        return OrderedDict(
-            (transcript_id, top_priority_effect(variant_effects))
-            for (transcript_id, variant_effects)
-            in self.groupby_transcript_id().items())
+        return self._top_priority_effect_per_group(
+            lambda effect: effect.transcript_id)
 
     def top_priority_effect_per_gene_id(self):
         """Highest priority effect for each unique gene ID"""
-        return OrderedDict(
-            (gene_id, top_priority_effect(variant_effects))
-            for (gene_id, variant_effects)
-            in self.groupby_gene_id().items())
+        return self._top_priority_effect_per_group(
+            lambda effect: effect.gene_id)
 
     def effect_expression(self, expression_levels):
         """
@@ -267,25 +341,74 @@ class EffectCollection(Collection):
 
         return max(effect_expression_dict.items(), key=key_fn)[0]
 
+    def to_parquet(self, path, row_group_size=None):
+        """
+        Save these effects as a Parquet file, see
+        `varcode.parquet.write_effects_parquet`. Requires pyarrow.
+        """
+        from ..parquet import write_effects_parquet
+        write_effects_parquet(self, path, row_group_size=row_group_size)
+
+    @classmethod
+    def from_parquet(cls, path, contigs=None, genome=None, memory_map=True):
+        """
+        Load effects saved by `to_parquet` without predicting them again,
+        optionally only reading the effects of variants on some contigs.
+        See `varcode.parquet.read_effects_parquet`.
+        """
+        from ..parquet import read_effects_parquet
+        return read_effects_parquet(
+            path,
+            contigs=contigs,
+            genome=genome,
+            memory_map=memory_map)
+
+    def to_ndjson(self, path_or_file):
+        """
+        Write these effects as newline delimited JSON, one effect per line.
+        See `varcode.ndjson.write_effects_ndjson`.
+        """
+        from ..ndjson import write_effects_ndjson
+        write_effects_ndjson(self, path_or_file)
+
+    @classmethod
+    def from_ndjson(cls, path_or_file):
+        """
+        Load effects written by `to_ndjson` without predicting them again.
+        """
+        from ..ndjson import read_effects_ndjson
+        return read_effects_ndjson(path_or_file)
+
     def to_dataframe(self):
         """Build a dataframe from the effect collection"""
-        def row_from_effect(effect):
-            row = {}
-            row['contig'] = effect.variant.contig
-            row['start'] = effect.variant.start
-            row['ref'] = effect.variant.ref
-            row['alt'] = effect.variant.alt
-            row['gene_id'] = effect.gene_id
-            row['gene_name'] = effect.gene_name
-            row['transcript_id'] = effect.transcript_id
-            row['transcript_name'] = effect.transcript_name
-            row['variant'] = str(effect.variant)
-            row['is_snv'] = effect.variant.is_snv
-            row['is_indel'] = effect.variant.is_indel
-            row['is_transversion'] = effect.variant.is_transversion
-            row['is_transition'] = effect.variant.is_transition
-            row['effect'] = str(effect)
-            row['effect_type'] = effect.__class__.__name__
-            row['effect_description'] = effect.short_description
-            return row
-        return pd.DataFrame.from_records([row_from_effect(effect) for effect in self])
+        if len(self) == 0:
+            return pd.DataFrame.from_records([])
+        columns = self._effect_columns
+        variants, variant_codes = columns.keys_and_codes("variant")
+
+        def variant_column(fn):
+            return take_values(
+                [fn(variant) for variant in variants],
+                variant_codes)
+
+        return pd.DataFrame(OrderedDict([
+            ("contig", variant_column(lambda v: v.contig)),
+            ("start", variant_column(lambda v: v.start)),
+            ("ref", variant_column(lambda v: v.ref)),
+            ("alt", variant_column(lambda v: v.alt)),
+            ("gene_id", columns.values_per_effect("gene_id")),
+            ("gene_name", columns.values_per_effect("gene_name")),
+            ("transcript_id", columns.values_per_effect("transcript_id")),
+            ("transcript_name", columns.values_per_effect("transcript_name")),
+            ("variant", variant_column(str)),
+            ("is_snv", variant_column(lambda v: v.is_snv)),
+            ("is_indel", variant_column(lambda v: v.is_indel)),
+            ("is_transversion", variant_column(lambda v: v.is_transversion)),
+            ("is_transition", variant_column(lambda v: v.is_transition)),
+            ("effect", [str(effect) for effect in self]),
+            ("effect_type", take_values(
+                [c.__name__ for c in columns.effect_classes],
+                columns.class_codes)),
+            ("effect_description", [
+                effect.short_description for effect in self]),
+        ]))
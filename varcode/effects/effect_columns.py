@@ -0,0 +1,209 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Columnar index over the effects of an EffectCollection, used to filter, group
+and convert effects to a DataFrame with array operations instead of
+accessing the attributes of every effect object.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+
+from .effect_classes import effect_class_priority
+
+
+def _intern(values):
+    """
+    Returns a list of the distinct values in the order of their first
+    appearance and an integer array with the index of each value in
+    that list.
+    """
+    value_to_code = {}
+    distinct_values = []
+    codes = np.empty(len(values), dtype=np.int64)
+    for (i, value) in enumerate(values):
+        code = value_to_code.get(value)
+        if code is None:
+            code = len(distinct_values)
+            value_to_code[value] = code
+            distinct_values.append(value)
+        codes[i] = code
+    return distinct_values, codes
+
+
+def group_indices(codes):
+    """
+    Indices of elements with the same code, as a list of (code, indices)
+    pairs ordered by the first element of each group.
+    """
+    if len(codes) == 0:
+        return []
+    order = np.argsort(codes, kind="mergesort")
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    groups = np.split(order, boundaries)
+    groups.sort(key=lambda indices: indices[0])
+    return [(codes[indices[0]], indices) for indices in groups]
+
+
+def take_values(values, codes):
+    """
+    List with the value of each code.
+    """
+    values_array = np.empty(len(values), dtype=object)
+    values_array[:] = values
+    return values_array[codes].tolist()
+
+
+class EffectColumns(object):
+    """
+    Arrays with one entry per effect, holding integer codes for its variant,
+    transcript, gene and effect class along with its priority and amino
+    acid change. Variants, transcripts, genes and classes are stored once
+    in lists which the codes index into, and which are shared by the
+    columns of filtered subsets.
+    """
+    def __init__(
+            self,
+            variants,
+            variant_codes,
+            transcripts,
+            transcript_codes,
+            genes,
+            gene_codes,
+            effect_classes,
+            class_codes,
+            priority,
+            modifies_coding_sequence,
+            modifies_protein_sequence,
+            aa_mutation_start_offset,
+            aa_ref,
+            aa_alt):
+        self.variants = variants
+        self.variant_codes = variant_codes
+        self.transcripts = transcripts
+        self.transcript_codes = transcript_codes
+        self.genes = genes
+        self.gene_codes = gene_codes
+        self.effect_classes = effect_classes
+        self.class_codes = class_codes
+        self.priority = priority
+        self.modifies_coding_sequence = modifies_coding_sequence
+        self.modifies_protein_sequence = modifies_protein_sequence
+        self.aa_mutation_start_offset = aa_mutation_start_offset
+        self.aa_ref = aa_ref
+        self.aa_alt = aa_alt
+
+    @classmethod
+    def from_effects(cls, effects):
+        variants, variant_codes = _intern([e.variant for e in effects])
+        transcripts, transcript_codes = _intern(
+            [e.transcript for e in effects])
+        genes, gene_codes = _intern([e.gene for e in effects])
+        effect_classes, class_codes = _intern([e.__class__ for e in effects])
+        class_priority = np.array(
+            [
+                -1 if effect_class_priority(c) is None
+                else effect_class_priority(c)
+                for c in effect_classes
+            ],
+            dtype=np.int64)
+        aa_mutation_start_offset = np.array(
+            [
+                -1 if e.aa_mutation_start_offset is None
+                else e.aa_mutation_start_offset
+                for e in effects
+            ],
+            dtype=np.int64)
+        return cls(
+            variants=variants,
+            variant_codes=variant_codes,
+            transcripts=transcripts,
+            transcript_codes=transcript_codes,
+            genes=genes,
+            gene_codes=gene_codes,
+            effect_classes=effect_classes,
+            class_codes=class_codes,
+            priority=class_priority[class_codes],
+            modifies_coding_sequence=np.array(
+                [bool(e.modifies_coding_sequence) for e in effects],
+                dtype=bool),
+            modifies_protein_sequence=np.array(
+                [bool(e.modifies_protein_sequence) for e in effects],
+                dtype=bool),
+            aa_mutation_start_offset=aa_mutation_start_offset,
+            aa_ref=np.array(
+                [getattr(e, "aa_ref", None) for e in effects], dtype=object),
+            aa_alt=np.array(
+                [getattr(e, "aa_alt", None) for e in effects], dtype=object))
+
+    def __len__(self):
+        return len(self.variant_codes)
+
+    def take(self, indices):
+        """
+        Columns of the effects at the given indices.
+        """
+        return EffectColumns(
+            variants=self.variants,
+            variant_codes=self.variant_codes[indices],
+            transcripts=self.transcripts,
+            transcript_codes=self.transcript_codes[indices],
+            genes=self.genes,
+            gene_codes=self.gene_codes[indices],
+            effect_classes=self.effect_classes,
+            class_codes=self.class_codes[indices],
+            priority=self.priority[indices],
+            modifies_coding_sequence=self.modifies_coding_sequence[indices],
+            modifies_protein_sequence=self.modifies_protein_sequence[indices],
+            aa_mutation_start_offset=self.aa_mutation_start_offset[indices],
+            aa_ref=self.aa_ref[indices],
+            aa_alt=self.aa_alt[indices])
+
+    def keys_and_codes(self, field):
+        """
+        Distinct values of one of the fields which effects get grouped by
+        (e.g. 'variant', 'transcript_id', 'gene_name') and the code of each
+        effect's value. Attributes of transcripts and genes are only looked up
+        once per distinct transcript or gene actually used by these effects.
+        """
+        if field == "variant":
+            return self.variants, self.variant_codes
+        elif field.startswith("transcript"):
+            objects, codes = self.transcripts, self.transcript_codes
+            prefix = "transcript"
+        elif field.startswith("gene"):
+            objects, codes = self.genes, self.gene_codes
+            prefix = "gene"
+        else:
+            raise ValueError("Unknown effect field '%s'" % (field,))
+        if field == prefix:
+            return objects, codes
+        attribute = field[len(prefix) + 1:]
+        used_codes, inverse = np.unique(codes, return_inverse=True)
+        # distinct objects might share a name, so values get interned again
+        keys, value_codes = _intern([
+            getattr(objects[code], attribute)
+            if objects[code] is not None else None
+            for code in used_codes
+        ])
+        return keys, value_codes[inverse.reshape(-1)]
+
+    def values_per_effect(self, field):
+        """
+        List with the value of the given field for each effect.
+        """
+        keys, codes = self.keys_and_codes(field)
+        return take_values(keys, codes)
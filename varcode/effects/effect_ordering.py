@@ -15,6 +15,8 @@
 from __future__ import print_function, division, absolute_import
 
 from .effect_classes import (
+    effect_class_priority,
+    MutationEffect,
     Failure,
     IncompleteTranscript,
     Intergenic,
@@ -93,6 +95,19 @@ transcript_effect_priority_dict = {
     in enumerate(transcript_effect_priority_list)
 }
 
+def _assign_effect_class_priorities(effect_class=MutationEffect):
+    """
+    Store the priority of each effect class as a class attribute, so that
+    it doesn't have to be looked up for every effect. Abstract classes which
+    aren't in the priority list get None, and classes defined afterwards
+    have none of their own (see `effect_class_priority`).
+    """
+    effect_class.priority = transcript_effect_priority_dict.get(effect_class)
+    for subclass in effect_class.__subclasses__():
+        _assign_effect_class_priorities(subclass)
+
+_assign_effect_class_priorities()
+
 def effect_priority(effect):
     """
     Returns the integer priority for a given transcript effect
@@ -102,7 +117,10 @@ def effect_priority(effect):
     # here
     if effect is None:
         return -1
-    return transcript_effect_priority_dict[effect.__class__]
+    priority = effect_class_priority(effect.__class__)
+    if priority is None:
+        raise KeyError(effect.__class__)
+    return priority
 
 def effect_sort_key(effect):
     """Returns key tuple with the following fields that should be sorted
@@ -114,16 +132,10 @@ def effect_sort_key(effect):
             This value will be 0 intra/intergenic variants effects without
             an associated transcript.
     """
-    # by default, we'll return (0, 0) for effects without an associated
-    # transcript
-    transcript_length = 0
-    cds_length = 0
-    if hasattr(effect, 'transcript') and effect.transcript is not None:
-        transcript_length = len(effect.transcript)
-        if effect.transcript.complete:
-            cds_length = len(effect.transcript.coding_sequence)
-    effect_class_priority = effect_priority(effect)
-    return (effect_class_priority, cds_length, transcript_length)
+    # lengths are 0 for effects without an associated transcript
+    if effect is None:
+        return (-1, 0, 0)
+    return effect.sort_key
 
 def top_priority_effect(effects):
     """
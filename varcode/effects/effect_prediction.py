@@ -19,11 +19,15 @@ from Bio.Seq import reverse_complement
 from pyensembl import Transcript
 
 from ..common import groupby_field
+from ..genome_registry import annotation_for_genome
 
 from .transcript_helpers import interval_offset_on_transcript
 from .effect_helpers import changes_exonic_splice_site
 from .effect_collection import EffectCollection
 from .effect_prediction_coding import predict_variant_coding_effect_on_transcript
+from .effect_ordering import effect_sort_key, transcript_effect_priority_dict
+from .transcript_filter import _filter_transcripts
+from .translate import find_first_stop_codon
 from .effect_classes import (
     Failure,
     Intergenic,
@@ -39,13 +43,26 @@ from .effect_classes import (
     StartLoss,
     ExonLoss,
     ExonicSpliceSite,
+    Silent,
+    Substitution,
+    Insertion,
+    Deletion,
+    ComplexSubstitution,
+    AlternateStartCodon,
+    StopLoss,
+    PrematureStop,
+    FrameShift,
 )
 
 
 logger = logging.getLogger(__name__)
 
 
-def predict_variant_effects(variant, raise_on_error=False):
+def predict_variant_effects(
+        variant,
+        raise_on_error=False,
+        cache=None,
+        transcript_filter=None):
     """Determine the effects of a variant on any transcripts it overlaps.
     Returns an EffectCollection object.
 
@@ -57,7 +74,24 @@ def predict_variant_effects(variant, raise_on_error=False):
         Raise an exception if we encounter an error while trying to
         determine the effect of this variant on a transcript, or simply
         log the error and continue.
+
+    cache : EffectCache, optional
+        Persistent cache to look up previously predicted effects in, and to
+        which newly predicted effects get added. Only used when all
+        transcripts are annotated.
+
+    transcript_filter : str or collection of str, optional
+        Only annotate the canonical transcript of each gene ("canonical"),
+        complete protein coding transcripts ("coding") or the transcripts
+        with the given IDs. Genes whose overlapping transcripts are all
+        excluded get no effects, so the result can be empty.
     """
+    if transcript_filter is not None:
+        cache = None
+    if cache is not None:
+        cached_effects = cache.get(variant)
+        if cached_effects is not None:
+            return EffectCollection(cached_effects)
     # if this variant isn't overlapping any genes, return a
     # Intergenic effect
     # TODO: look for nearby genes and mark those as Upstream and Downstream
@@ -68,14 +102,23 @@ def predict_variant_effects(variant, raise_on_error=False):
         # list of all MutationEffects for all genes & transcripts
         effects = []
 
+        (transcripts, excluded_gene_ids) = _filter_transcripts(
+            variant, transcript_filter)
+
         # group transcripts by their gene ID
-        transcripts_grouped_by_gene = groupby_field(variant.transcripts, 'gene_id')
+        transcripts_grouped_by_gene = groupby_field(transcripts, 'gene_id')
+
+        # coding effects shared by transcripts with identical coding sequences
+        coding_effect_memo = {}
 
         # want effects in the list grouped by the gene they come from
         for gene_id in sorted(variant.gene_ids):
             if gene_id not in transcripts_grouped_by_gene:
+                if gene_id in excluded_gene_ids:
+                    # the gene's overlapping transcripts were filtered out
+                    continue
                 # intragenic variant overlaps a gene but not any transcripts
-                gene = variant.ensembl.gene_by_id(gene_id)
+                gene = annotation_for_genome(variant.ensembl).gene_by_id(gene_id)
                 effects.append(Intragenic(variant, gene))
             else:
                 # gene ID  has transcripts overlapped by this variant
@@ -83,25 +126,124 @@ def predict_variant_effects(variant, raise_on_error=False):
                     if raise_on_error:
                         effect = predict_variant_effect_on_transcript(
                             variant=variant,
-                            transcript=transcript)
+                            transcript=transcript,
+                            coding_effect_memo=coding_effect_memo)
                     else:
                         effect = predict_variant_effect_on_transcript_or_failure(
                             variant=variant,
-                            transcript=transcript)
+                            transcript=transcript,
+                            coding_effect_memo=coding_effect_memo)
                     effects.append(effect)
+    if cache is not None:
+        cache.put(variant, effects)
     return EffectCollection(effects)
 
 
-def predict_variant_effect_on_transcript_or_failure(variant, transcript):
+def predict_variant_top_effect(
+        variant,
+        raise_on_error=False,
+        transcript_filter=None):
+    """Highest priority effect of a variant, the same effect which
+    `predict_variant_effects(variant).top_priority_effect()` would return.
+
+    Effects which don't involve the coding sequence (e.g. intronic or UTR
+    variants, exon losses) are cheap to determine and get predicted for
+    every transcript. For the remaining transcripts we first compute an upper
+    bound on the sort key of their effect from the position and length of
+    the variant, and then only run the full coding effect prediction (in
+    order of decreasing bounds) while a transcript can still beat the best
+    effect found so far.
+
+    Parameters
+    ----------
+    variant : Variant
+
+    raise_on_error : bool
+        Raise an exception if we encounter an error while trying to
+        determine the effect of this variant on a transcript, or simply
+        log the error and continue.
+
+    transcript_filter : str or collection of str, optional
+        Only consider the canonical transcript of each gene ("canonical"),
+        complete protein coding transcripts ("coding") or the transcripts
+        with the given IDs. Returns None if the variant overlaps transcripts
+        which were all excluded.
     """
-    Try predicting the effect of a variant on a particular transcript but
-    suppress raised exceptions by converting them into `Failure` effect
-    values.
+    if len(variant.gene_ids) == 0:
+        return Intergenic(variant)
+
+    (transcripts, excluded_gene_ids) = _filter_transcripts(
+        variant, transcript_filter)
+    transcripts_grouped_by_gene = groupby_field(transcripts, 'gene_id')
+
+    # effects or deferred coding effects, in the same order as they'd
+    # appear in the result of predict_variant_effects
+    candidates = []
+    for gene_id in sorted(variant.gene_ids):
+        if gene_id not in transcripts_grouped_by_gene:
+            if gene_id in excluded_gene_ids:
+                continue
+            gene = annotation_for_genome(variant.ensembl).gene_by_id(gene_id)
+            candidates.append(Intragenic(variant, gene))
+        else:
+            for transcript in transcripts_grouped_by_gene[gene_id]:
+                candidates.append(_predict_or_failure(
+                    variant,
+                    transcript,
+                    raise_on_error,
+                    _predict_variant_effect_or_deferred_coding_effect,
+                    variant,
+                    transcript))
+
+    if not candidates:
+        return None
+
+    keys = [
+        None if isinstance(candidate, _DeferredCodingEffect)
+        else effect_sort_key(candidate)
+        for candidate in candidates
+    ]
+    known_keys = [key for key in keys if key is not None]
+    best_key = max(known_keys) if known_keys else None
+
+    upper_bounds = {
+        i: candidate.sort_key_upper_bound()
+        for (i, candidate) in enumerate(candidates)
+        if isinstance(candidate, _DeferredCodingEffect)
+    }
+    coding_effect_memo = {}
+    for i in sorted(upper_bounds, key=upper_bounds.get, reverse=True):
+        if best_key is not None and upper_bounds[i] < best_key:
+            # bounds are visited in decreasing order, so none of the
+            # remaining transcripts can have the top effect either
+            break
+        deferred = candidates[i]
+        effect = _predict_or_failure(
+            variant,
+            deferred.transcript,
+            raise_on_error,
+            deferred.resolve,
+            coding_effect_memo)
+        candidates[i] = effect
+        keys[i] = effect_sort_key(effect)
+        if best_key is None or keys[i] > best_key:
+            best_key = keys[i]
+
+    # like max(), return the first of the effects with the highest key
+    for (candidate, key) in zip(candidates, keys):
+        if key == best_key:
+            return candidate
+
+
+def _predict_or_failure(variant, transcript, raise_on_error, fn, *args):
+    """
+    Call `fn` with the given arguments, converting raised exceptions into a
+    `Failure` effect unless `raise_on_error` is True.
     """
+    if raise_on_error:
+        return fn(*args)
     try:
-        return predict_variant_effect_on_transcript(
-            variant=variant,
-            transcript=transcript)
+        return fn(*args)
     except (AssertionError, ValueError) as error:
         logger.warn(
             "Encountered error annotating %s for %s: %s",
@@ -110,17 +252,49 @@ def predict_variant_effect_on_transcript_or_failure(variant, transcript):
             error)
         return Failure(variant, transcript)
 
-def predict_variant_effect_on_transcript(variant, transcript):
-        """Return the transcript effect (such as FrameShift) that results from
-        applying this genomic variant to a particular transcript.
 
-        Parameters
-        ----------
-        transcript :  Transcript
-            Transcript we're going to apply mutation to.
+def predict_variant_effect_on_transcript_or_failure(
+        variant, transcript, coding_effect_memo=None):
+    """
+    Try predicting the effect of a variant on a particular transcript but
+    suppress raised exceptions by converting them into `Failure` effect
+    values.
+    """
+    return _predict_or_failure(
+        variant,
+        transcript,
+        False,
+        predict_variant_effect_on_transcript,
+        variant,
+        transcript,
+        coding_effect_memo)
+
+def predict_variant_effect_on_transcript(
+        variant, transcript, coding_effect_memo=None):
+    """Return the transcript effect (such as FrameShift) that results from
+    applying this genomic variant to a particular transcript.
+
+    Parameters
+    ----------
+    transcript :  Transcript
+        Transcript we're going to apply mutation to.
+
+    coding_effect_memo : dict, optional
+        Coding effects of this variant already predicted on other
+        transcripts, reused for transcripts with the same coding sequence.
+    """
+    effect = _predict_variant_effect_or_deferred_coding_effect(
+        variant, transcript)
+    if isinstance(effect, _DeferredCodingEffect):
+        return effect.resolve(coding_effect_memo)
+    return effect
+
+def _predict_variant_effect_or_deferred_coding_effect(variant, transcript):
+        """Effect of a variant on a transcript, or a `_DeferredCodingEffect`
+        if determining it requires predicting the coding effect.
         """
 
-        if transcript.__class__ is not Transcript:
+        if not isinstance(transcript, Transcript):
             raise TypeError(
                 "Expected %s : %s to have type Transcript" % (
                     transcript, type(transcript)))
@@ -200,9 +374,16 @@ def predict_variant_effect_on_transcript(variant, transcript):
 
         exon_number, exon = overlapping_exon_numbers_and_exons[0]
 
-        exonic_effect_annotation = exonic_transcript_effect(
+        exonic_effect_annotation = _exonic_effect_or_deferred_coding_effect(
             variant, exon, exon_number, transcript)
 
+        if isinstance(exonic_effect_annotation, _DeferredCodingEffect):
+            # the coding effect gets wrapped in an ExonicSpliceSite
+            # if the variant also overlaps an intron
+            exonic_effect_annotation.overlaps_intron = not (
+                start_in_exon and end_in_exon)
+            return exonic_effect_annotation
+
         # simple case: both start and end are in the same
         if start_in_exon and end_in_exon:
             return exonic_effect_annotation
@@ -268,7 +449,8 @@ def choose_intronic_effect_class(
         # intronic mutation unrelated to splicing
         return Intronic
 
-def exonic_transcript_effect(variant, exon, exon_number, transcript):
+def exonic_transcript_effect(
+        variant, exon, exon_number, transcript, coding_effect_memo=None):
     """Effect of this variant on a Transcript, assuming we already know
     that this variant overlaps some exon of the transcript.
 
@@ -284,8 +466,18 @@ def exonic_transcript_effect(variant, exon, exon_number, transcript):
         sequence of exons.
 
     transcript : pyensembl.Transcript
-    """
 
+    coding_effect_memo : dict, optional
+        Coding effects of this variant already predicted on other transcripts.
+    """
+    effect = _exonic_effect_or_deferred_coding_effect(
+        variant, exon, exon_number, transcript)
+    if isinstance(effect, _DeferredCodingEffect):
+        return effect.resolve(coding_effect_memo)
+    return effect
+
+def _exonic_effect_or_deferred_coding_effect(
+        variant, exon, exon_number, transcript):
     genome_ref = variant.trimmed_ref
     genome_alt = variant.trimmed_alt
     variant_start = variant.trimmed_base1_start
@@ -364,29 +556,140 @@ def exonic_transcript_effect(variant, exon, exon_number, transcript):
         exon.start, exon.end, transcript)
     exon_end_offset = exon_start_offset + len(exon) - 1
 
-    # Further below we're going to try to predict exonic splice site
-    # modifications, which will take this effect_annotation as their
+    # Exonic splice site modifications take the coding effect as their
     # alternative hypothesis for what happens if splicing doesn't change.
     # If the mutation doesn't affect an exonic splice site, then
-    # we'll just return this effect.
-    coding_effect_annotation = predict_variant_coding_effect_on_transcript(
+    # the result is just the coding effect.
+    return _DeferredCodingEffect(
         variant=variant,
         transcript=transcript,
-        trimmed_cdna_ref=cdna_ref,
-        trimmed_cdna_alt=cdna_alt,
-        transcript_offset=transcript_offset)
-
-    if changes_exonic_splice_site(
+        exon=exon,
+        cdna_ref=cdna_ref,
+        cdna_alt=cdna_alt,
+        transcript_offset=transcript_offset,
+        changes_splice_site=changes_exonic_splice_site(
             transcript=transcript,
             transcript_ref=cdna_ref,
             transcript_alt=cdna_alt,
             transcript_offset=transcript_offset,
             exon_start_offset=exon_start_offset,
             exon_end_offset=exon_end_offset,
-            exon_number=exon_number):
-        return ExonicSpliceSite(
-            variant=variant,
-            transcript=transcript,
-            exon=exon,
-            alternate_effect=coding_effect_annotation)
-    return coding_effect_annotation
+            exon_number=exon_number))
+
+
+# coding effects which in-frame changes away from the start and stop codons
+# can have, in addition to effects on splicing
+_IN_FRAME_CODING_EFFECT_CLASSES = (
+    Silent,
+    Substitution,
+    Insertion,
+    Deletion,
+    ComplexSubstitution,
+    PrematureStop,
+)
+
+
+class _DeferredCodingEffect(object):
+    """
+    Everything needed to predict the coding effect of a variant on a
+    transcript, which is the most expensive part of effect prediction. Keeping
+    it around lets `predict_variant_top_effect` skip transcripts whose effect
+    can't have the highest priority.
+    """
+    def __init__(
+            self,
+            variant,
+            transcript,
+            exon,
+            cdna_ref,
+            cdna_alt,
+            transcript_offset,
+            changes_splice_site,
+            overlaps_intron=False):
+        self.variant = variant
+        self.transcript = transcript
+        self.exon = exon
+        self.cdna_ref = cdna_ref
+        self.cdna_alt = cdna_alt
+        self.transcript_offset = transcript_offset
+        self.changes_splice_site = changes_splice_site
+        self.overlaps_intron = overlaps_intron
+
+    def resolve(self, coding_effect_memo=None):
+        coding_effect = predict_variant_coding_effect_on_transcript(
+            variant=self.variant,
+            transcript=self.transcript,
+            trimmed_cdna_ref=self.cdna_ref,
+            trimmed_cdna_alt=self.cdna_alt,
+            transcript_offset=self.transcript_offset,
+            memo=coding_effect_memo)
+        if self.changes_splice_site or self.overlaps_intron:
+            return ExonicSpliceSite(
+                variant=self.variant,
+                transcript=self.transcript,
+                exon=self.exon,
+                alternate_effect=coding_effect)
+        return coding_effect
+
+    def sort_key_upper_bound(self):
+        """
+        Upper bound on `effect_sort_key` of the resolved effect.
+        """
+        if self.changes_splice_site or self.overlaps_intron:
+            priority = transcript_effect_priority_dict[ExonicSpliceSite]
+        else:
+            priority = max(
+                transcript_effect_priority_dict[effect_class]
+                for effect_class in self._possible_coding_effect_classes())
+        # only complete transcripts have coding effects
+        return (
+            priority,
+            len(self.transcript.coding_sequence),
+            len(self.transcript))
+
+    def _possible_coding_effect_classes(self):
+        transcript = self.transcript
+        n_ref = len(self.cdna_ref)
+        n_alt = len(self.cdna_alt)
+        if (n_ref - n_alt) % 3 != 0:
+            # FrameShift has the highest priority of all the effects a
+            # frameshift can have
+            return [FrameShift]
+
+        start_codon_offset = transcript.first_start_codon_spliced_offset
+        stop_codon_offset = transcript.last_stop_codon_spliced_offset
+        cds_offset = self.transcript_offset - start_codon_offset
+
+        # be generous about what counts as touching the start or stop
+        # codon, since insertions are placed differently on each strand
+        near_start_codon = cds_offset <= 5
+        near_stop_codon = self.transcript_offset + n_ref >= stop_codon_offset - 5
+
+        possible_classes = list(_IN_FRAME_CODING_EFFECT_CLASSES)
+        if near_start_codon:
+            possible_classes.extend([AlternateStartCodon, StartLoss])
+        if near_stop_codon:
+            possible_classes.append(StopLoss)
+        elif (not near_start_codon and n_ref == n_alt and
+                transcript.protein_sequence is not None):
+            # substitutions which don't change the length of the coding
+            # sequence can only be a PrematureStop if the mutated codons
+            # contain a stop codon
+            first_codon = cds_offset // 3
+            last_codon = (cds_offset + n_ref - 1) // 3
+            codons_start = start_codon_offset + 3 * first_codon
+            codons_end = start_codon_offset + 3 * (last_codon + 1)
+            ref_codons = str(transcript.sequence[codons_start:codons_end])
+            offset = self.transcript_offset - codons_start
+            mutant_codons = (
+                ref_codons[:offset] +
+                self.cdna_alt +
+                ref_codons[offset + n_ref:])
+            if (last_codon < len(transcript.protein_sequence) and
+                    find_first_stop_codon(mutant_codons) == -1):
+                if first_codon == last_codon:
+                    possible_classes = [Silent, Substitution]
+                else:
+                    possible_classes = [
+                        Silent, Substitution, ComplexSubstitution]
+        return possible_classes
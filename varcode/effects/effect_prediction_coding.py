@@ -22,7 +22,8 @@ def predict_variant_coding_effect_on_transcript(
         transcript,
         trimmed_cdna_ref,
         trimmed_cdna_alt,
-        transcript_offset):
+        transcript_offset,
+        memo=None):
     """
     Given a minimal cDNA ref/alt nucleotide string pair and an offset into a
     given transcript, determine the coding effect of this nucleotide substitution
@@ -42,6 +43,12 @@ def predict_variant_coding_effect_on_transcript(
 
     transcript_offset : int
         Offset into the full transcript sequence of the ref->alt substitution
+
+    memo : dict, optional
+        Coding effects already predicted for this variant on other
+        transcripts. Transcripts which share the same sequence from their
+        start codon onward (and the same protein) get the same coding effect,
+        so it's only computed once and then copied for each transcript.
     """
     if not transcript.complete:
         raise ValueError(
@@ -110,6 +117,60 @@ def predict_variant_coding_effect_on_transcript(
 
     sequence_from_start_codon = str(sequence[start_codon_offset:])
 
+    if memo is None:
+        return _predict_coding_effect(
+            variant=variant,
+            transcript=transcript,
+            trimmed_cdna_ref=trimmed_cdna_ref,
+            trimmed_cdna_alt=trimmed_cdna_alt,
+            cds_offset=cds_offset,
+            sequence_from_start_codon=sequence_from_start_codon)
+
+    # the first three nucleotides of the transcript are part of the key since
+    # AlternateStartCodon effects use them as their reference codon
+    key = (
+        sequence_from_start_codon,
+        transcript.protein_sequence,
+        str(sequence[:3]),
+        cds_offset,
+        trimmed_cdna_ref,
+        trimmed_cdna_alt,
+    )
+    effect = memo.get(key)
+    if effect is None:
+        effect = _predict_coding_effect(
+            variant=variant,
+            transcript=transcript,
+            trimmed_cdna_ref=trimmed_cdna_ref,
+            trimmed_cdna_alt=trimmed_cdna_alt,
+            cds_offset=cds_offset,
+            sequence_from_start_codon=sequence_from_start_codon)
+        memo[key] = effect
+    elif effect.transcript is not transcript:
+        effect = _rebind_effect_to_transcript(effect, transcript)
+    return effect
+
+def _rebind_effect_to_transcript(effect, transcript):
+    """
+    Shallow copy of an effect associated with a different transcript.
+    """
+    rebound = effect._shallow_copy()
+    rebound.transcript = transcript
+    rebound.gene = transcript.gene
+    if hasattr(rebound, "_sort_key"):
+        # the sort key includes the length of the transcript
+        del rebound._sort_key
+    return rebound
+
+def _predict_coding_effect(
+        variant,
+        transcript,
+        trimmed_cdna_ref,
+        trimmed_cdna_alt,
+        cds_offset,
+        sequence_from_start_codon):
+    n_ref = len(trimmed_cdna_ref)
+    n_alt = len(trimmed_cdna_alt)
     # is this an in-frame mutations?
     if (n_ref - n_alt) % 3 == 0:
         return predict_in_frame_coding_effect(
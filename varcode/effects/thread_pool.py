@@ -0,0 +1,234 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Predict effects with a pool of threads, which overlaps the SQLite queries
+and sequence lookups of different variants without pickling anything.
+
+Every thread queries a genome through its own read-only SQLite connection,
+and lazily loaded parts of each genome (its database connection and FASTA
+dictionaries) are loaded before the threads start, since pyensembl fills
+them in place.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sqlite3
+import threading
+
+from six.moves.urllib.request import pathname2url
+
+from ..genome_registry import annotation_for_genome
+
+logger = logging.getLogger(__name__)
+
+# guards installing ThreadLocalConnections on a pyensembl Database, which
+# can't be looked up in a dictionary since databases of the same GTF compare
+# equal
+_install_lock = threading.Lock()
+
+
+class ThreadLocalConnections(object):
+    """
+    Read-only SQLite connections to a pyensembl database, one for each thread
+    which queries it. The thread which created the database keeps using its
+    original connection.
+
+    Connections stay open until they're closed with `close`, which thread
+    pools do for their own threads once they shut down.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.path = db.local_db_path
+        self.owner_thread = threading.current_thread()
+        self.owner_connection = db.connection
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (thread, connection) pairs
+        self._connections = []
+
+    def get(self):
+        if threading.current_thread() is self.owner_thread:
+            return self.owner_connection
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                "file:%s?mode=ro" % pathname2url(self.path),
+                uri=True,
+                check_same_thread=False)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(
+                    (threading.current_thread(), connection))
+        return connection
+
+    def __len__(self):
+        return len(self._connections)
+
+    def close(self, threads=None):
+        """
+        Close the connections opened by the given threads, which mustn't
+        query the database anymore, or by default those of all threads
+        besides the owner.
+        """
+        with self._lock:
+            closed = [
+                connection
+                for (thread, connection) in self._connections
+                if threads is None or thread in threads
+            ]
+            self._connections = [
+                (thread, connection)
+                for (thread, connection) in self._connections
+                if threads is not None and thread not in threads
+            ]
+        for connection in closed:
+            connection.close()
+        if threads is None:
+            self._local = threading.local()
+
+
+def use_thread_local_connections(genome):
+    """
+    Make each thread which queries the given genome's database use its own
+    connection. Returns the ThreadLocalConnections, which stay installed
+    on the genome, or None if pyensembl doesn't look up connections with
+    the method they replace, in which case only the thread which opened
+    the database's connection can query it.
+    """
+    db = genome.db
+    with _install_lock:
+        get_connection = getattr(db, "_get_connection", None)
+        if not callable(get_connection):
+            logger.warning(
+                "Can't open a connection to the database of %s for each "
+                "thread, since pyensembl.Database has no _get_connection "
+                "method; using its default connection instead",
+                genome)
+            return None
+        connections = getattr(get_connection, "__self__", None)
+        if not isinstance(connections, ThreadLocalConnections):
+            # raises if the database hasn't been created yet
+            connections = ThreadLocalConnections(db)
+            # Database.connection looks up the connection with this method
+            db._get_connection = connections.get
+    return connections
+
+
+def _queries_database(genome):
+    return annotation_for_genome(genome) is genome and genome.requires_gtf
+
+
+def warm_up_genome(genome):
+    """
+    Load the parts of a genome which pyensembl loads lazily and which
+    threads mustn't race to fill in: its database connection and the
+    dictionaries of its FASTA files.
+
+    Returns the genome's ThreadLocalConnections, or None if threads don't
+    query its database or can't have their own connections to it.
+    """
+    if annotation_for_genome(genome) is not genome:
+        # a registered annotation source answers the lookups of effect
+        # prediction instead of the genome
+        return None
+    connections = None
+    if _queries_database(genome):
+        connections = use_thread_local_connections(genome)
+    if genome.requires_transcript_fasta:
+        genome.transcript_sequences.fasta_dictionary
+    if genome.requires_protein_fasta:
+        genome.protein_sequences.fasta_dictionary
+    return connections
+
+
+def default_n_threads():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def predict_effects_in_threads(
+        variants,
+        n_threads=None,
+        chunk_size=None,
+        **effects_kwargs):
+    """
+    Effects of each variant, predicted by a pool of threads with
+    `Variant.effects`.
+
+    Parameters
+    ----------
+    variants : list of Variant
+
+    n_threads : int, optional
+        Defaults to the number of CPUs plus four (at most 32), since
+        threads spend much of their time waiting on SQLite.
+
+    chunk_size : int, optional
+        Number of variants annotated by a thread at once, defaults to
+        spreading the variants over four chunks per thread.
+
+    effects_kwargs
+        Passed to `Variant.effects`.
+
+    Returns a list with the EffectCollection of each variant.
+
+    Variants of genomes whose database threads can't open their own
+    connections to are annotated in the calling thread.
+    """
+    if n_threads is None:
+        n_threads = default_n_threads()
+    connections = []
+    serial_genomes = set()
+    for genome in set(variant.ensembl for variant in variants):
+        genome_connections = warm_up_genome(genome)
+        if genome_connections is not None:
+            connections.append(genome_connections)
+        elif _queries_database(genome):
+            serial_genomes.add(genome)
+    threaded_indices = [
+        i
+        for (i, variant) in enumerate(variants)
+        if variant.ensembl not in serial_genomes
+    ]
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(threaded_indices) // (4 * n_threads)))
+    pool_threads = set()
+
+    def annotate(chunk):
+        pool_threads.add(threading.current_thread())
+        return [variants[i].effects(**effects_kwargs) for i in chunk]
+
+    chunks = [
+        threaded_indices[i:i + chunk_size]
+        for i in range(0, len(threaded_indices), chunk_size)
+    ]
+    results = [None] * len(variants)
+    try:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for (chunk, chunk_effects) in zip(
+                    chunks, executor.map(annotate, chunks)):
+                for (i, effects) in zip(chunk, chunk_effects):
+                    results[i] = effects
+    finally:
+        # the pool's threads have exited by now, so nothing else will use
+        # their connections
+        for genome_connections in connections:
+            genome_connections.close(threads=pool_threads)
+    for (i, variant) in enumerate(variants):
+        if variant.ensembl in serial_genomes:
+            results[i] = variant.effects(**effects_kwargs)
+    return results
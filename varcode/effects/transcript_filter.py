@@ -0,0 +1,229 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Restrict effect prediction to a subset of the transcripts overlapping a
+variant. Transcripts are selected by querying the annotation database for
+their IDs, so excluded transcripts never get turned into Transcript objects.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import weakref
+
+from six import string_types
+
+from ..genome_registry import annotation_for_genome
+
+# only annotate the canonical transcript of each gene
+CANONICAL = "canonical"
+
+# tag of the canonical transcript of each gene in Ensembl and GENCODE GTFs
+ENSEMBL_CANONICAL_TAG = "Ensembl_canonical"
+
+# only annotate complete protein coding transcripts
+CODING = "coding"
+
+TRANSCRIPT_FILTER_MODES = (CANONICAL, CODING)
+
+
+def normalize_transcript_filter(transcript_filter):
+    """
+    Returns None, one of the names in TRANSCRIPT_FILTER_MODES, or a frozenset
+    of allowed transcript IDs. The result is hashable, so it can be used
+    as part of the key for memoized effects.
+    """
+    if transcript_filter is None:
+        return None
+    elif isinstance(transcript_filter, string_types):
+        if transcript_filter not in TRANSCRIPT_FILTER_MODES:
+            raise ValueError(
+                "Unknown transcript filter '%s', expected one of %s or a "
+                "collection of transcript IDs" % (
+                    transcript_filter,
+                    TRANSCRIPT_FILTER_MODES))
+        return transcript_filter
+    return frozenset(transcript_filter)
+
+
+def _sql_placeholders(values):
+    return ", ".join(["?"] * len(values))
+
+
+# genome -> gene ID -> canonical transcript ID, dropped along with the genome
+_canonical_transcript_ids = weakref.WeakKeyDictionary()
+
+
+def _tagged_canonical_transcript_id(db, gene_id):
+    if not db.column_exists("transcript", "tag"):
+        return None
+    # repeated tags of a transcript are joined with commas
+    results = db.run_sql_query(
+        """
+        SELECT transcript_id
+        FROM transcript
+        WHERE gene_id = ?
+        AND instr(',' || tag || ',', ?) > 0
+        ORDER BY transcript_id ASC
+        LIMIT 1
+        """,
+        query_params=[gene_id, ",%s," % ENSEMBL_CANONICAL_TAG])
+    return results[0][0] if results else None
+
+
+def _longest_transcript_id(db, gene_id):
+    for feature in ("CDS", "exon"):
+        results = db.run_sql_query(
+            """
+            SELECT transcript_id, SUM(end - start + 1) AS length
+            FROM %s
+            WHERE gene_id = ?
+            GROUP BY transcript_id
+            ORDER BY length DESC, transcript_id ASC
+            LIMIT 1
+            """ % feature,
+            query_params=[gene_id])
+        if results:
+            return results[0][0]
+    return None
+
+
+def canonical_transcript_id(genome, gene_id):
+    """
+    ID of the canonical transcript of a gene, which is the transcript tagged
+    "Ensembl_canonical" (in recent Ensembl and GENCODE releases) if the
+    annotation kept GTF tags. Annotations read with `use_gtf_annotation`
+    keep them, but the databases which pyensembl.Genome builds don't.
+    Otherwise this is a heuristic: the transcript with the longest coding
+    sequence or, for genes without any coding transcripts, the longest
+    spliced transcript. Ties are broken by the lowest transcript ID.
+    """
+    annotation = annotation_for_genome(genome)
+    if annotation is not genome:
+        return annotation.canonical_transcript_id(gene_id)
+    transcript_ids = _canonical_transcript_ids.get(genome)
+    if transcript_ids is None:
+        transcript_ids = _canonical_transcript_ids[genome] = {}
+    if gene_id not in transcript_ids:
+        transcript_ids[gene_id] = (
+            _tagged_canonical_transcript_id(genome.db, gene_id) or
+            _longest_transcript_id(genome.db, gene_id))
+    return transcript_ids[gene_id]
+
+
+def _protein_coding_transcript_ids_with_codons(genome, transcript_ids):
+    """
+    Subset of the given transcript IDs which have a protein coding biotype
+    and both start and stop codons, checked with a single query.
+    """
+    annotation = annotation_for_genome(genome)
+    if annotation is not genome:
+        return set(
+            transcript_id
+            for transcript_id in transcript_ids
+            if annotation.transcript_by_id(transcript_id).complete)
+    db = genome.db
+    if db.column_exists("transcript", "transcript_biotype"):
+        biotype_column = "transcript_biotype"
+    else:
+        # older GTFs put the biotype in the source column
+        biotype_column = "source"
+    results = db.run_sql_query(
+        """
+        SELECT DISTINCT transcript_id
+        FROM transcript
+        WHERE transcript_id IN (%s)
+        AND %s = 'protein_coding'
+        AND transcript_id IN (SELECT transcript_id FROM start_codon)
+        AND transcript_id IN (SELECT transcript_id FROM stop_codon)
+        """ % (_sql_placeholders(transcript_ids), biotype_column),
+        query_params=list(transcript_ids))
+    return set(row[0] for row in results)
+
+
+def _gene_ids_of_transcript_ids(genome, transcript_ids):
+    annotation = annotation_for_genome(genome)
+    if annotation is not genome:
+        return set(
+            annotation.transcript_by_id(transcript_id).gene_id
+            for transcript_id in transcript_ids)
+    results = genome.db.run_sql_query(
+        """
+        SELECT DISTINCT gene_id
+        FROM transcript
+        WHERE transcript_id IN (%s)
+        """ % _sql_placeholders(transcript_ids),
+        query_params=list(transcript_ids))
+    return set(row[0] for row in results)
+
+
+def filter_transcripts(variant, transcript_filter):
+    """
+    Transcripts overlapping a variant which pass the given filter.
+
+    Parameters
+    ----------
+    variant : Variant
+
+    transcript_filter : str or collection of str, optional
+        One of:
+            - None: all overlapping transcripts
+            - "canonical": the canonical transcript of each gene,
+              see `canonical_transcript_id`
+            - "coding": complete protein coding transcripts
+            - a collection of allowed transcript IDs
+    """
+    return _filter_transcripts(variant, transcript_filter)[0]
+
+
+def _filter_transcripts(variant, transcript_filter):
+    """
+    Transcripts overlapping a variant which pass the given filter, and the
+    IDs of the genes of the overlapping transcripts which didn't, so that
+    effect prediction can tell those genes from genes which the variant
+    overlaps without overlapping any of their transcripts.
+    """
+    transcript_filter = normalize_transcript_filter(transcript_filter)
+    if transcript_filter is None:
+        return (variant.transcripts, set())
+    genome = variant.ensembl
+    annotation = annotation_for_genome(genome)
+    overlapping_ids = annotation.transcript_ids_at_locus(
+        variant.contig, variant.start, variant.end)
+    if len(overlapping_ids) == 0:
+        return ([], set())
+    if transcript_filter == CANONICAL:
+        canonical_ids = set(
+            canonical_transcript_id(genome, gene_id)
+            for gene_id in variant.gene_ids)
+        transcript_ids = [t for t in overlapping_ids if t in canonical_ids]
+    elif transcript_filter == CODING:
+        coding_ids = _protein_coding_transcript_ids_with_codons(
+            genome, overlapping_ids)
+        transcript_ids = [t for t in overlapping_ids if t in coding_ids]
+    else:
+        transcript_ids = [t for t in overlapping_ids if t in transcript_filter]
+    transcripts = [annotation.transcript_by_id(t) for t in transcript_ids]
+    if transcript_filter == CODING:
+        # the database query can't check that the length of each coding
+        # sequence is divisible by three
+        transcripts = [
+            t for t in transcripts if t.is_protein_coding and t.complete
+        ]
+    kept_ids = set(t.id for t in transcripts)
+    excluded_ids = [t for t in overlapping_ids if t not in kept_ids]
+    excluded_gene_ids = (
+        _gene_ids_of_transcript_ids(genome, excluded_ids)
+        if excluded_ids else set())
+    return (transcripts, excluded_gene_ids)
@@ -0,0 +1,170 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Process-wide registry of genomes, which lets serialized variants refer to
+their genome by a short string key instead of embedding the whole Genome
+object.
+
+Ensembl releases always have a key of the form "ensembl:<release>:<species>".
+Custom genomes only get a key once they're registered with `register_genome`,
+which has to happen in every process that loads variants referring to them.
+
+Genomes can also be given an annotation source, such as a `TranscriptIndex`,
+which variants and effect prediction query instead of the genome's
+database.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+from pyensembl import EnsemblRelease, cached_release
+
+ENSEMBL_KEY_PREFIX = "ensembl:"
+
+# key -> Genome and Genome -> key for registered custom genomes
+_genomes_by_key = {}
+_keys_by_genome = {}
+
+# keys of Ensembl releases which have already been looked up in either
+# direction, reusing the same key string lets pickle store it only once
+_ensembl_genomes_by_key = {}
+_ensembl_keys_by_genome = {}
+
+# Genome -> AnnotationSource which is used instead of the genome
+_annotations_by_genome = {}
+
+
+def register_genome(genome, key=None):
+    """
+    Register a custom genome so that variants which use it can be pickled or
+    serialized without including the genome itself.
+
+    Parameters
+    ----------
+    genome : pyensembl.Genome
+
+    key : str, optional
+        Name to refer to the genome by, defaults to
+        "<annotation name>:<annotation version>:<reference name>".
+
+    Returns the key of the genome.
+    """
+    if key is None:
+        key = "%s:%s:%s" % (
+            genome.annotation_name,
+            genome.annotation_version,
+            genome.reference_name)
+    if key.startswith(ENSEMBL_KEY_PREFIX):
+        raise ValueError(
+            "Genome keys starting with '%s' are reserved for Ensembl "
+            "releases" % ENSEMBL_KEY_PREFIX)
+    existing = _genomes_by_key.get(key)
+    if existing is not None and existing != genome:
+        raise ValueError(
+            "A different genome was already registered as '%s'" % key)
+    _genomes_by_key[key] = genome
+    _keys_by_genome[genome] = key
+    return key
+
+
+def genome_key(genome):
+    """
+    Key which `genome_from_key` resolves back to the given genome, or None
+    for custom genomes which haven't been registered.
+    """
+    if isinstance(genome, EnsemblRelease):
+        key = _ensembl_keys_by_genome.get(genome)
+        if key is None:
+            key = "%s%d:%s" % (
+                ENSEMBL_KEY_PREFIX,
+                genome.release,
+                genome.species.latin_name)
+            _ensembl_keys_by_genome[genome] = key
+            _ensembl_genomes_by_key[key] = genome
+        return key
+    return _keys_by_genome.get(genome)
+
+
+def genome_from_key(key):
+    """
+    Genome with the given key, or None if the key isn't for an Ensembl
+    release or a registered genome.
+    """
+    if key in _genomes_by_key:
+        return _genomes_by_key[key]
+    if key in _ensembl_genomes_by_key:
+        return _ensembl_genomes_by_key[key]
+    if key.startswith(ENSEMBL_KEY_PREFIX):
+        release, _, species = key[len(ENSEMBL_KEY_PREFIX):].partition(":")
+        if release.isdigit() and species:
+            genome = cached_release(int(release), species)
+            _ensembl_genomes_by_key[key] = genome
+            _ensembl_keys_by_genome[genome] = key
+            return genome
+    return None
+
+
+def genome_descriptor(genome):
+    """
+    Dictionary identifying a genome, from which `genome_from_descriptor`
+    can load it again.
+    """
+    descriptor = dict(
+        key=genome_key(genome),
+        reference_name=genome.reference_name,
+        annotation_name=genome.annotation_name,
+        annotation_version=genome.annotation_version)
+    if isinstance(genome, EnsemblRelease):
+        descriptor["release"] = genome.release
+        descriptor["species"] = genome.species.latin_name
+    return descriptor
+
+
+def genome_from_descriptor(descriptor):
+    if "release" in descriptor:
+        return cached_release(descriptor["release"], descriptor["species"])
+    if descriptor.get("key") is not None:
+        genome = genome_from_key(descriptor["key"])
+        if genome is not None:
+            return genome
+    raise ValueError(
+        "Data was saved with a custom genome (%s %s for %s), register "
+        "it with varcode.register_genome or pass it as the `genome` "
+        "argument to load it" % (
+            descriptor["annotation_name"],
+            descriptor["annotation_version"],
+            descriptor["reference_name"]))
+
+
+def set_genome_annotation(genome, annotation):
+    """
+    Look up the transcripts and genes of the given genome in `annotation`
+    (a `varcode.annotation_source.AnnotationSource`, such as a
+    TranscriptIndex) instead of the genome's database, or stop doing so if
+    `annotation` is None.
+    """
+    if annotation is None:
+        _annotations_by_genome.pop(genome, None)
+    else:
+        _annotations_by_genome[genome] = annotation
+
+
+def annotation_for_genome(genome):
+    """
+    Annotation source registered for a genome with `set_genome_annotation`,
+    or the genome itself.
+    """
+    if not _annotations_by_genome:
+        return genome
+    return _annotations_by_genome.get(genome, genome)
@@ -0,0 +1,408 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read the transcripts and genes of a local GTF file (e.g. a patched or
+GENCODE "basic" annotation) and its cDNA and protein FASTA files into the
+records of a `TranscriptIndex`, without building a pyensembl database.
+
+Transcripts are derived from the GTF the same way pyensembl does: exons
+are ordered by their exon_number, codons are collected from the
+start_codon and stop_codon features and the canonical transcript of a gene
+is the one tagged "Ensembl_canonical", or else the one with the longest
+coding sequence (see `varcode.effects.transcript_filter`).
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import gzip
+import io
+import logging
+
+from pyensembl.fasta import parse_fasta_dictionary
+from pyensembl.locus import normalize_chromosome, normalize_strand
+from six import string_types
+
+from .effects.transcript_filter import ENSEMBL_CANONICAL_TAG
+from .transcript_index import (
+    COMPLETE,
+    CONTAINS_START_CODON,
+    CONTAINS_STOP_CODON,
+    HAS_PROTEIN_SEQUENCE,
+    HAS_SEQUENCE,
+    MISSING_CODON,
+    START_CODON_COMPLETE,
+    STOP_CODON_COMPLETE,
+    GeneRecord,
+    TranscriptRecord,
+)
+
+logger = logging.getLogger(__name__)
+
+# features which are needed to build transcripts, all others are skipped
+# before their attributes get parsed
+GTF_FEATURES = frozenset([
+    "gene", "transcript", "exon", "CDS", "start_codon", "stop_codon"])
+
+
+def _parse_attributes(text):
+    """
+    Attributes of a GTF line, e.g. 'gene_id "ENSG01"; exon_number 1;'.
+    The values of repeated attributes (such as tags) are joined with commas,
+    as they are in pyensembl's database.
+    """
+    attributes = {}
+    for field in text.split(";"):
+        key, _, value = field.strip().partition(" ")
+        if not key:
+            continue
+        value = value.strip().strip('"')
+        if key in attributes:
+            attributes[key] += "," + value
+        else:
+            attributes[key] = value
+    return attributes
+
+
+def _open_text(path):
+    if path.endswith(".gz") or path.endswith(".gzip"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return io.open(path, "r", encoding="utf-8")
+
+
+def read_gtf(path, features=GTF_FEATURES):
+    """
+    Generate the lines of a (possibly gzipped) GTF file as tuples of
+    (contig, source, feature, start, end, strand, attributes), with
+    contigs and strands normalized like pyensembl does.
+
+    Parameters
+    ----------
+    path : str
+
+    features : collection of str, optional
+        Lines of other features are skipped.
+    """
+    contigs = {}
+    with _open_text(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9 or fields[2] not in features:
+                continue
+            contig = contigs.get(fields[0])
+            if contig is None:
+                contig = contigs[fields[0]] = normalize_chromosome(fields[0])
+            yield (
+                contig,
+                fields[1],
+                fields[2],
+                int(fields[3]),
+                int(fields[4]),
+                normalize_strand(fields[6]),
+                _parse_attributes(fields[8]))
+
+
+class _SequenceLookup(object):
+    """
+    Sequences of one or more FASTA files, looked up by ID with or without
+    a version suffix (the GTF and FASTA files don't always agree on it).
+    """
+    def __init__(self, paths):
+        if isinstance(paths, string_types):
+            paths = [paths]
+        self.sequences = {}
+        for path in paths:
+            self.sequences.update(parse_fasta_dictionary(path))
+        self.unversioned = {}
+        for (sequence_id, sequence) in self.sequences.items():
+            base_id, dot, version = sequence_id.rpartition(".")
+            if dot and version.isdigit():
+                self.unversioned.setdefault(base_id, sequence)
+
+    def get(self, sequence_id, version=None):
+        if not sequence_id:
+            return None
+        if version:
+            sequence = self.sequences.get("%s.%s" % (sequence_id, version))
+            if sequence is not None:
+                return sequence
+        sequence = self.sequences.get(sequence_id)
+        if sequence is None:
+            sequence = self.unversioned.get(sequence_id)
+        return sequence
+
+
+def _biotype(attributes, prefix, source):
+    # GENCODE calls biotypes "types", older Ensembl GTFs put them in the
+    # source column
+    return attributes.get(
+        prefix + "_biotype", attributes.get(prefix + "_type", source))
+
+
+def _support_level(value):
+    # e.g. "1", "NA" or "1 (assigned to previous version 5)"
+    if value:
+        value = value.split()[0]
+        if value.isdigit():
+            return int(value)
+    return None
+
+
+def _codon_positions(ranges):
+    """
+    Positions of a codon split over one or more ranges, or None unless
+    it covers exactly three distinct positions.
+    """
+    positions = []
+    for (start, end) in ranges:
+        positions.extend(range(start, end + 1))
+    if len(positions) != 3 or len(set(positions)) != 3:
+        return None
+    return positions
+
+
+def _spliced_offset(exons, strand, position):
+    """
+    Offset of a position into the spliced sequence of a transcript with
+    the given (exon ID, start, end) exons, or None if it's in an intron.
+    """
+    total = 0
+    for (_, start, end) in exons:
+        if start <= position <= end:
+            if strand == "+":
+                return total + position - start
+            return total + end - position
+        total += end - start + 1
+    return None
+
+
+def _spliced_codon_range(exons, strand, positions):
+    if positions is None:
+        return None
+    offsets = [_spliced_offset(exons, strand, p) for p in positions]
+    if None in offsets:
+        return None
+    return (min(offsets), max(offsets))
+
+
+class _GTFTranscript(object):
+    """
+    Features of one transcript collected while reading a GTF.
+    """
+    def __init__(self, contig, strand, source, attributes):
+        self.contig = contig
+        self.strand = strand
+        self.source = source
+        self.attributes = attributes
+        self.start = self.end = None
+        self.exons = []
+        self.cds_length = 0
+        self.protein_id = None
+        self.start_codon = []
+        self.stop_codon = []
+
+
+def _transcript_record(transcript_id, t, transcript_sequences,
+                       protein_sequences):
+    attributes = t.attributes
+    if all(exon_number is not None for (exon_number, _, _, _) in t.exons):
+        t.exons.sort(key=lambda exon: exon[0])
+    else:
+        t.exons.sort(
+            key=lambda exon: exon[2] if t.strand == "+" else -exon[2])
+    exons = [
+        (exon_id, start, end) for (_, exon_id, start, end) in t.exons]
+    if t.start is None:
+        t.start = min(start for (_, start, _) in exons)
+        t.end = max(end for (_, _, end) in exons)
+
+    sequence = transcript_sequences.get(
+        transcript_id, attributes.get("transcript_version"))
+    protein_sequence = protein_sequences.get(
+        t.protein_id, attributes.get("protein_version"))
+
+    start_codon = _codon_positions(t.start_codon)
+    stop_codon = _codon_positions(t.stop_codon)
+    flags = 0
+    if t.start_codon:
+        flags |= CONTAINS_START_CODON
+    if start_codon is not None:
+        flags |= START_CODON_COMPLETE
+    if t.stop_codon:
+        flags |= CONTAINS_STOP_CODON
+    if stop_codon is not None:
+        flags |= STOP_CODON_COMPLETE
+    if sequence is not None:
+        flags |= HAS_SEQUENCE
+    if protein_sequence is not None:
+        flags |= HAS_PROTEIN_SEQUENCE
+
+    start_range = _spliced_codon_range(exons, t.strand, start_codon)
+    stop_range = _spliced_codon_range(exons, t.strand, stop_codon)
+    cds_spliced_start = -1 if start_range is None else start_range[0]
+    cds_spliced_end = -1 if stop_range is None else stop_range[1]
+    if start_range is not None and stop_range is not None and \
+            sequence is not None:
+        # length of the coding sequence as pyensembl slices it from the
+        # cDNA, which is cut short if the sequence is truncated
+        coding_length = max(
+            0,
+            min(cds_spliced_end + 1, len(sequence)) - cds_spliced_start)
+        if coding_length % 3 == 0:
+            flags |= COMPLETE
+
+    return TranscriptRecord(
+        transcript_id=transcript_id,
+        transcript_name=attributes.get("transcript_name"),
+        gene_id=attributes.get("gene_id"),
+        contig=t.contig,
+        start=t.start,
+        end=t.end,
+        strand=t.strand,
+        biotype=_biotype(attributes, "transcript", t.source),
+        support_level=_support_level(
+            attributes.get("transcript_support_level")),
+        exons=exons,
+        flags=flags,
+        start_codon=MISSING_CODON if start_codon is None else start_codon,
+        stop_codon=MISSING_CODON if stop_codon is None else stop_codon,
+        cds_spliced_start=cds_spliced_start,
+        cds_spliced_end=cds_spliced_end,
+        sequence=sequence,
+        protein_id=t.protein_id,
+        protein_sequence=protein_sequence)
+
+
+def gtf_records(
+        gtf_path,
+        transcript_fasta_paths=(),
+        protein_fasta_paths=(),
+        contigs=None):
+    """
+    Transcript and gene records of a GTF file, sorted by ID.
+
+    Parameters
+    ----------
+    gtf_path : str
+
+    transcript_fasta_paths : str or list of str
+        cDNA sequences of the transcripts.
+
+    protein_fasta_paths : str or list of str
+        Protein sequences, looked up by the protein_id of CDS features.
+
+    contigs : list of str, optional
+        Only read the features on these contigs.
+
+    Returns lists of TranscriptRecord and GeneRecord.
+    """
+    if contigs is not None:
+        contigs = set(normalize_chromosome(contig) for contig in contigs)
+    genes = {}
+    transcripts = {}
+    for (contig, source, feature, start, end, strand, attributes) in \
+            read_gtf(gtf_path):
+        if contigs is not None and contig not in contigs:
+            continue
+        if feature == "gene":
+            genes[attributes["gene_id"]] = (
+                contig, start, end, strand, source, attributes)
+            continue
+        transcript_id = attributes.get("transcript_id")
+        if not transcript_id:
+            continue
+        t = transcripts.get(transcript_id)
+        if t is None:
+            t = transcripts[transcript_id] = _GTFTranscript(
+                contig, strand, source, attributes)
+        if feature == "transcript":
+            t.start, t.end = start, end
+            t.attributes = attributes
+        elif feature == "exon":
+            exon_number = attributes.get("exon_number")
+            t.exons.append((
+                int(exon_number) if exon_number else None,
+                attributes.get("exon_id"),
+                start,
+                end))
+        elif feature == "CDS":
+            t.cds_length += end - start + 1
+            if t.protein_id is None:
+                t.protein_id = attributes.get("protein_id")
+        elif feature == "start_codon":
+            t.start_codon.append((start, end))
+        else:
+            t.stop_codon.append((start, end))
+
+    transcript_sequences = _SequenceLookup(transcript_fasta_paths)
+    protein_sequences = _SequenceLookup(protein_fasta_paths)
+    transcript_records = []
+    transcripts_by_gene_id = {}
+    for transcript_id in sorted(transcripts):
+        t = transcripts[transcript_id]
+        if not t.exons:
+            logger.warning("Skipping transcript %s without exons", transcript_id)
+            continue
+        record = _transcript_record(
+            transcript_id, t, transcript_sequences, protein_sequences)
+        transcript_records.append(record)
+        transcripts_by_gene_id.setdefault(record.gene_id, []).append(
+            (record, t))
+
+    gene_records = []
+    for gene_id in sorted(set(genes) | set(transcripts_by_gene_id)):
+        gene_transcripts = transcripts_by_gene_id.get(gene_id, [])
+        if gene_id in genes:
+            contig, start, end, strand, source, attributes = genes[gene_id]
+        else:
+            # genes without their own line span all of their transcripts
+            first = gene_transcripts[0][0]
+            contig, strand = first.contig, first.strand
+            start = min(record.start for (record, _) in gene_transcripts)
+            end = max(record.end for (record, _) in gene_transcripts)
+            source = gene_transcripts[0][1].source
+            attributes = gene_transcripts[0][1].attributes
+        # the transcript tagged as canonical, or else the one with the
+        # longest coding sequence, then longest spliced length, with ties
+        # broken by the lowest transcript ID
+        tagged = [
+            (0, record.transcript_id)
+            for (record, t) in gene_transcripts
+            if ENSEMBL_CANONICAL_TAG in t.attributes.get("tag", "").split(",")
+        ]
+        coding = tagged or [
+            (-t.cds_length, record.transcript_id)
+            for (record, t) in gene_transcripts
+            if t.cds_length
+        ]
+        if not coding:
+            coding = [(0, None)] + [
+                (
+                    -sum(end - start + 1 for (_, start, end) in record.exons),
+                    record.transcript_id,
+                )
+                for (record, _) in gene_transcripts
+            ]
+        gene_records.append(GeneRecord(
+            gene_id=gene_id,
+            gene_name=attributes.get("gene_name"),
+            contig=contig,
+            start=start,
+            end=end,
+            strand=strand,
+            biotype=_biotype(attributes, "gene", source),
+            canonical_transcript_id=min(coding)[1]))
+    return transcript_records, gene_records
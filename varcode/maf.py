@@ -52,19 +52,28 @@ def load_maf_dataframe(path, nrows=None, verbose=False):
     Load the guaranteed columns of a TCGA MAF file into a DataFrame
     """
     require_string(path, "Path to MAF")
+    return _normalize_maf_columns(_read_maf(path), path)
 
-    n_basic_columns = len(MAF_COLUMN_NAMES)
 
+def _read_maf(path, chunk_size=None):
     # pylint: disable=no-member
     # pylint gets confused by read_csv
-    df = pandas.read_csv(
+    return pandas.read_csv(
         path,
         comment="#",
         sep="\t",
         low_memory=False,
         skip_blank_lines=True,
-        header=0)
+        header=0,
+        chunksize=chunk_size)
+
 
+def _normalize_maf_columns(df, path):
+    """
+    Check that a dataframe read from a MAF has the guaranteed columns and
+    normalize the capitalization of their names.
+    """
+    n_basic_columns = len(MAF_COLUMN_NAMES)
     if len(df.columns) < n_basic_columns:
         raise ValueError(
             "Too few columns in MAF file %s, expected %d but got  %d : %s" % (
@@ -97,8 +106,29 @@ def load_maf(path):
 
     if len(maf_df) == 0:
         raise ValueError("Empty MAF file %s" % path)
+    return _maf_dataframe_to_variant_collection(maf_df, path, {})
+
 
+def iter_maf_chunks(path, chunk_size=10 ** 4):
+    """
+    Generate a VariantCollection for each chunk of rows in a MAF file, so that
+    files of any size can be processed in constant memory.
+    """
+    require_string(path, "Path to MAF")
+    # genomes of the NCBI builds seen so far, shared by all chunks
     ensembl_objects = {}
+    for maf_df in _read_maf(path, chunk_size=chunk_size):
+        yield _maf_dataframe_to_variant_collection(
+            _normalize_maf_columns(maf_df, path),
+            path,
+            ensembl_objects)
+
+
+def _maf_dataframe_to_variant_collection(maf_df, path, ensembl_objects):
+    """
+    VariantCollection of the rows of a MAF dataframe, with a dictionary
+    caching the genome of each NCBI build.
+    """
     variants = []
     metadata = {}
     for _, x in maf_df.iterrows():
@@ -0,0 +1,349 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Newline delimited JSON (NDJSON) files of variants or effects, which can be
+written and read one record at a time.
+
+The first line of each file is a header object describing the collection
+(e.g. its sources), every following line holds a single variant or effect.
+Genomes are referred to by their key in the genome registry, so custom
+genomes have to be registered with `varcode.register_genome`. Paths ending
+in ".gz" are compressed with gzip.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import gzip
+import io
+import json
+
+from six import string_types
+
+from .effects import EffectCollection
+from .effects.effect_cache import decode_effect, encode_effect
+from .genome_registry import genome_key
+from .variant import _restore_variant, variant_ascending_position_sort_key
+from .variant_collection import VariantCollection
+from .variant_metadata import VCF_METADATA_FIELDS, VariantMetadataStore
+
+# first key of every header line, used to recognize NDJSON files
+HEADER_KEY = "varcode_ndjson"
+
+FORMAT_VERSION = 1
+
+
+def _json_default(value):
+    # numpy scalars, e.g. from MAF columns loaded by pandas
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError("Can't encode %s : %s as JSON" % (value, type(value)))
+
+
+def _dumps(value):
+    return json.dumps(value, default=_json_default, separators=(",", ":"))
+
+
+def _open(path_or_file, mode):
+    """
+    Returns a text file and whether it should be closed by the caller,
+    which is only the case when a path was given.
+    """
+    if not isinstance(path_or_file, string_types):
+        return path_or_file, False
+    if path_or_file.endswith(".gz"):
+        return io.TextIOWrapper(
+            gzip.open(path_or_file, mode + "b"),
+            encoding="utf-8"), True
+    return io.open(path_or_file, mode, encoding="utf-8"), True
+
+
+def is_ndjson_file(path):
+    """
+    Does the file at the given path start with a varcode NDJSON header?
+    """
+    prefix = '{"%s"' % HEADER_KEY
+    f, _ = _open(path, "r")
+    with f:
+        return f.read(len(prefix)) == prefix
+
+
+def _variant_record(variant):
+    """
+    Encode the normalized fields of a variant, only including its original
+    fields and options when they differ from the defaults.
+    """
+    key = genome_key(variant.ensembl)
+    if key is None:
+        raise ValueError(
+            "Can't write variants with an unregistered custom genome to "
+            "NDJSON, register it with varcode.register_genome")
+    record = {
+        "contig": variant.contig,
+        "start": variant.start,
+        "ref": variant.ref,
+        "alt": variant.alt,
+        "genome": key,
+    }
+    original_fields = [
+        variant.original_contig,
+        variant.original_start,
+        variant.original_ref,
+        variant.original_alt,
+    ]
+    if original_fields != [
+            variant.contig, variant.start, variant.ref, variant.alt]:
+        record["original"] = original_fields
+    if variant.allow_extended_nucleotides:
+        record["allow_extended_nucleotides"] = True
+    if not variant.normalize_contig_name:
+        record["normalize_contig_name"] = False
+    return record
+
+
+def _variant_from_record(record):
+    original_fields = record.get("original")
+    return _restore_variant(
+        record["contig"],
+        record["start"],
+        record["ref"],
+        record["alt"],
+        record["genome"],
+        record.get("allow_extended_nucleotides", False),
+        record.get("normalize_contig_name", True),
+        None if original_fields is None else tuple(original_fields))
+
+
+def _read_lines(path_or_file, collection):
+    """
+    Parse the header of a file and generate the record on each
+    following line.
+    """
+    f, close = _open(path_or_file, "r")
+    try:
+        header = json.loads(f.readline())
+        if not isinstance(header, dict) or HEADER_KEY not in header:
+            raise ValueError("Missing varcode NDJSON header")
+        if header[HEADER_KEY] > FORMAT_VERSION:
+            raise ValueError(
+                "NDJSON format version %d isn't supported by this version "
+                "of varcode" % header[HEADER_KEY])
+        if header["collection"] != collection:
+            raise ValueError(
+                "Expected NDJSON file of a %s but got %s" % (
+                    collection, header["collection"]))
+        yield header
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if close:
+            f.close()
+
+
+def write_variants_ndjson(variants, path_or_file):
+    """
+    Write variants to a NDJSON file one at a time.
+
+    Parameters
+    ----------
+    variants : VariantCollection or iterable of Variant
+        The metadata of each source is included when given a
+        VariantCollection.
+
+    path_or_file : str or file
+    """
+    if isinstance(variants, VariantCollection):
+        sources = sorted(variants.sources)
+        source_metadata = [
+            variants.source_to_metadata_dict.get(source)
+            for source in sources
+        ]
+        header = {
+            HEADER_KEY: FORMAT_VERSION,
+            "collection": "VariantCollection",
+            "sources": sources,
+            "metadata_kinds": [
+                None if metadata is None
+                else "vcf" if isinstance(metadata, VariantMetadataStore)
+                else "dict"
+                for metadata in source_metadata
+            ],
+            "distinct": variants.distinct,
+            "sorted_by_position": (
+                variants.sort_key is variant_ascending_position_sort_key),
+        }
+    else:
+        source_metadata = []
+        header = {
+            HEADER_KEY: FORMAT_VERSION,
+            "collection": "VariantCollection",
+        }
+    f, close = _open(path_or_file, "w")
+    try:
+        f.write(_dumps(header) + "\n")
+        for variant in variants:
+            record = _variant_record(variant)
+            metadata = {
+                str(i): dict(metadata[variant])
+                for (i, metadata) in enumerate(source_metadata)
+                if metadata is not None and variant in metadata
+            }
+            if metadata:
+                record["metadata"] = metadata
+            f.write(_dumps(record) + "\n")
+    finally:
+        if close:
+            f.close()
+
+
+def iter_variants_ndjson(path_or_file):
+    """
+    Generate the variants in a NDJSON file written by
+    `write_variants_ndjson`, reading one line at a time.
+    """
+    records = _read_lines(path_or_file, "VariantCollection")
+    next(records)
+    for record in records:
+        yield _variant_from_record(record)
+
+
+def read_variants_ndjson(path_or_file):
+    """
+    Load a VariantCollection, including the metadata of its sources, from a
+    NDJSON file written by `write_variants_ndjson`.
+    """
+    records = _read_lines(path_or_file, "VariantCollection")
+    header = next(records)
+    sources = header.get("sources", [])
+    metadata_kinds = header.get("metadata_kinds", [])
+    variants = []
+    source_metadata = [[] for _ in sources]
+    for record in records:
+        variant = _variant_from_record(record)
+        variants.append(variant)
+        for (i, metadata) in record.get("metadata", {}).items():
+            source_metadata[int(i)].append((variant, metadata))
+
+    source_to_metadata_dict = {}
+    for (source, kind, pairs) in zip(sources, metadata_kinds, source_metadata):
+        if kind == "dict":
+            source_to_metadata_dict[source] = dict(pairs)
+        elif kind == "vcf":
+            source_to_metadata_dict[source] = VariantMetadataStore(
+                variants=[variant for (variant, _) in pairs],
+                record_indices=list(range(len(pairs))),
+                alt_allele_indices=[m["alt_allele_index"] for (_, m) in pairs],
+                ids=[m["id"] for (_, m) in pairs],
+                quals=[m["qual"] for (_, m) in pairs],
+                filters=[m["filter"] for (_, m) in pairs],
+                info=[m["info"] for (_, m) in pairs],
+                sample_info=[m["sample_info"] for (_, m) in pairs],
+                extra_fields=[
+                    (j, dict(
+                        (name, value)
+                        for (name, value) in m.items()
+                        if name not in VCF_METADATA_FIELDS))
+                    for (j, (_, m)) in enumerate(pairs)
+                    if len(m) > len(VCF_METADATA_FIELDS)
+                ])
+
+    # missing for files which weren't written from a VariantCollection,
+    # whose variants get sorted by position as usual
+    sorted_by_position = header.get("sorted_by_position")
+    if sorted_by_position is False:
+        sort_key = None
+    else:
+        sort_key = variant_ascending_position_sort_key
+    return VariantCollection(
+        variants=variants,
+        distinct=header.get("distinct", True),
+        sort_key=sort_key,
+        sources=set(sources),
+        source_to_metadata_dict=source_to_metadata_dict,
+        presorted=bool(sorted_by_position))
+
+
+def write_effects_ndjson(effects, path_or_file):
+    """
+    Write effects to a NDJSON file one at a time. Transcripts, genes and exons
+    are stored as their IDs, as in `EffectCache`.
+
+    Parameters
+    ----------
+    effects : EffectCollection or iterable of MutationEffect
+
+    path_or_file : str or file
+    """
+    f, close = _open(path_or_file, "w")
+    try:
+        f.write(_effects_header(effects) + "\n")
+        for effect in effects:
+            f.write(_effect_line(effect) + "\n")
+    finally:
+        if close:
+            f.close()
+
+
+def _effects_header(effects=None):
+    header = {
+        HEADER_KEY: FORMAT_VERSION,
+        "collection": "EffectCollection",
+    }
+    if isinstance(effects, EffectCollection):
+        header["sources"] = sorted(effects.sources)
+        header["distinct"] = effects.distinct
+    return _dumps(header)
+
+
+def _effect_line(effect):
+    return _dumps({
+        "variant": _variant_record(effect.variant),
+        "effect": encode_effect(effect),
+    })
+
+
+def _iter_effects(records):
+    # consecutive effects usually belong to the same variant
+    previous_variant_record = variant = None
+    for record in records:
+        if record["variant"] != previous_variant_record:
+            previous_variant_record = record["variant"]
+            variant = _variant_from_record(previous_variant_record)
+        yield decode_effect(record["effect"], variant)
+
+
+def iter_effects_ndjson(path_or_file):
+    """
+    Generate the effects in a NDJSON file written by `write_effects_ndjson`,
+    reading one line at a time. Effects aren't predicted again, their
+    transcripts and genes are looked up by ID.
+    """
+    records = _read_lines(path_or_file, "EffectCollection")
+    next(records)
+    for effect in _iter_effects(records):
+        yield effect
+
+
+def read_effects_ndjson(path_or_file):
+    """
+    Load an EffectCollection from a NDJSON file written by
+    `write_effects_ndjson`.
+    """
+    records = _read_lines(path_or_file, "EffectCollection")
+    header = next(records)
+    return EffectCollection(
+        list(_iter_effects(records)),
+        distinct=header.get("distinct", False),
+        sources=set(header.get("sources", [])))
@@ -0,0 +1,569 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Save VariantCollection and EffectCollection objects as Parquet files and load
+them back without re-annotating any variants. Requires pyarrow, which can be
+installed with `pip install varcode[parquet]`.
+
+Each file has one row per variant (or effect) with typed columns for its
+locus and alleles, and each row group only contains a single contig so
+loading a subset of contigs skips the rest of the file. Genomes are stored
+once in the file's schema metadata, as their Ensembl release or their key in
+the genome registry (see `varcode.register_genome`).
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import json
+
+from pyensembl import Exon
+from pyensembl.locus import normalize_chromosome
+
+from .effects import EffectCollection
+from .effects.effect_classes import (
+    Intragenic,
+    MutationEffect,
+    TranscriptMutationEffect,
+)
+from .genome_registry import (
+    annotation_for_genome,
+    genome_descriptor,
+    genome_from_descriptor,
+)
+from .reference import infer_genome
+from .variant import Variant, variant_ascending_position_sort_key
+from .variant_collection import VariantCollection
+from .variant_metadata import VCF_METADATA_FIELDS, VariantMetadataStore
+
+# key of the varcode specific entry in the schema metadata of each file
+SCHEMA_METADATA_KEY = b"varcode"
+
+FORMAT_VERSION = 1
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "Reading and writing Parquet files requires pyarrow, install it "
+            "with `pip install varcode[parquet]`")
+    return pyarrow, pyarrow.parquet
+
+
+def _json_default(value):
+    # numpy scalars, e.g. from MAF columns loaded by pandas
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError("Can't encode %s : %s as JSON" % (value, type(value)))
+
+
+def _to_json(value):
+    return json.dumps(value, default=_json_default)
+
+
+def _from_json(string):
+    return None if string is None else json.loads(string)
+
+
+def _contig_runs(contigs, row_group_size):
+    """
+    Generates (start, end) ranges of rows which have the same contig, with at
+    most `row_group_size` rows in each range.
+    """
+    start = 0
+    n_rows = len(contigs)
+    while start < n_rows:
+        end = start + 1
+        while (end < n_rows and contigs[end] == contigs[start] and
+                (row_group_size is None or end - start < row_group_size)):
+            end += 1
+        yield (start, end)
+        start = end
+
+
+def _contig_aliases(contig):
+    """
+    Names which a contig might be stored as, since depending on the input
+    file variants may or may not have a 'chr' prefix.
+    """
+    contig = normalize_chromosome(contig)
+    if contig[:3].lower() == "chr":
+        contig = contig[3:]
+    return [contig, "chr" + contig]
+
+
+def _variant_columns(variants, genome_indices):
+    """
+    Columns describing each variant along with the types to store them as,
+    as an ordered list of (name, type, values) triples.
+    """
+    pa, _ = _import_pyarrow()
+    return [
+        # contigs loaded from MAF files can be integers
+        ("contig", pa.string(), [str(v.contig) for v in variants]),
+        ("start", pa.int64(), [v.start for v in variants]),
+        ("end", pa.int64(), [v.end for v in variants]),
+        ("ref", pa.string(), [v.ref for v in variants]),
+        ("alt", pa.string(), [v.alt for v in variants]),
+        ("original_contig", pa.string(), [
+            str(v.original_contig) for v in variants]),
+        ("original_start", pa.int64(), [v.original_start for v in variants]),
+        ("original_ref", pa.string(), [v.original_ref for v in variants]),
+        ("original_alt", pa.string(), [v.original_alt for v in variants]),
+        ("genome", pa.int32(), [genome_indices[v.ensembl] for v in variants]),
+        ("normalize_contig_name", pa.bool_(), [
+            v.normalize_contig_name for v in variants]),
+        ("allow_extended_nucleotides", pa.bool_(), [
+            v.allow_extended_nucleotides for v in variants]),
+    ]
+
+
+def _metadata_columns(index, metadata, variants):
+    """
+    Columns holding the metadata of a single source. VCF metadata gets
+    typed ID, QUAL, FILTER and allele columns, with INFO and sample fields
+    encoded as JSON. Any other metadata is stored as one JSON object per
+    variant.
+    """
+    pa, _ = _import_pyarrow()
+    prefix = "metadata_%d" % index
+    rows = [
+        metadata[variant] if variant in metadata else None
+        for variant in variants
+    ]
+    if not isinstance(metadata, VariantMetadataStore):
+        return "dict", [(prefix, pa.string(), [
+            None if row is None else _to_json(dict(row)) for row in rows
+        ])]
+
+    def field(name):
+        return [None if row is None else row[name] for row in rows]
+
+    return "vcf", [
+        (prefix + ".id", pa.string(), field("id")),
+        (prefix + ".qual", pa.float64(), field("qual")),
+        (prefix + ".filter", pa.list_(pa.string()), field("filter")),
+        (prefix + ".alt_allele_index", pa.int32(), field("alt_allele_index")),
+        (prefix + ".info", pa.string(), [
+            None if row is None else _to_json(row["info"]) for row in rows]),
+        (prefix + ".sample_info", pa.string(), [
+            None if row is None else _to_json(row["sample_info"])
+            for row in rows]),
+        (prefix + ".extra", pa.string(), [
+            _extra_fields_json(row) for row in rows]),
+    ]
+
+
+def _extra_fields_json(row):
+    """
+    Fields other than the VCF fields which were added to a variant's
+    metadata, or None if there are none.
+    """
+    if row is None or len(row) == len(VCF_METADATA_FIELDS):
+        return None
+    return _to_json(dict(
+        (name, value)
+        for (name, value) in row.items()
+        if name not in VCF_METADATA_FIELDS))
+
+
+def _write_table(path, columns, header, row_group_size):
+    pa, pq = _import_pyarrow()
+    schema = pa.schema(
+        [pa.field(name, column_type) for (name, column_type, _) in columns],
+        metadata={SCHEMA_METADATA_KEY: _to_json(header)})
+    table = pa.Table.from_arrays(
+        [
+            pa.array(values, type=column_type)
+            for (_, column_type, values) in columns
+        ],
+        schema=schema)
+    contigs = columns[0][2]
+    writer = pq.ParquetWriter(path, schema)
+    try:
+        if len(contigs) == 0:
+            writer.write_table(table)
+        for (start, end) in _contig_runs(contigs, row_group_size):
+            writer.write_table(table.slice(start, end - start))
+    finally:
+        writer.close()
+
+
+def _read_table(path, contigs, memory_map):
+    """
+    Returns the header stored by `_write_table` and a dictionary mapping each
+    column name to a list of values, only reading row groups which might
+    contain one of the given contigs.
+    """
+    _, pq = _import_pyarrow()
+    if contigs is None:
+        filters = None
+    else:
+        filters = [("contig", "in", sorted(set(
+            alias
+            for contig in contigs
+            for alias in _contig_aliases(contig))))]
+    table = pq.read_table(path, filters=filters, memory_map=memory_map)
+    metadata = table.schema.metadata or {}
+    if SCHEMA_METADATA_KEY not in metadata:
+        raise ValueError("%s wasn't written by varcode" % path)
+    header = json.loads(metadata[SCHEMA_METADATA_KEY].decode("utf-8"))
+    if header["format_version"] > FORMAT_VERSION:
+        raise ValueError(
+            "%s has format version %d, this version of varcode only "
+            "supports up to %d" % (
+                path, header["format_version"], FORMAT_VERSION))
+    return header, table.to_pydict()
+
+
+def _genomes_and_indices(variants):
+    genomes = []
+    genome_indices = {}
+    for variant in variants:
+        if variant.ensembl not in genome_indices:
+            genome_indices[variant.ensembl] = len(genomes)
+            genomes.append(variant.ensembl)
+    return genomes, genome_indices
+
+
+def _load_genomes(header, genome):
+    if genome is not None:
+        genome = infer_genome(genome)
+        return [genome] * len(header["genomes"])
+    return [
+        genome_from_descriptor(descriptor)
+        for descriptor in header["genomes"]
+    ]
+
+
+def _variants_from_columns(columns, genomes):
+    """
+    Reconstruct the Variant of each row, creating a single object for
+    rows with the same variant.
+    """
+    variant_cache = {}
+    variants = []
+    for key in zip(
+            columns["original_contig"],
+            columns["original_start"],
+            columns["original_ref"],
+            columns["original_alt"],
+            columns["genome"],
+            columns["allow_extended_nucleotides"],
+            columns["normalize_contig_name"]):
+        variant = variant_cache.get(key)
+        if variant is None:
+            (contig, start, ref, alt, genome_index,
+                allow_extended_nucleotides, normalize_contig_name) = key
+            variant = variant_cache[key] = Variant(
+                contig,
+                start,
+                ref,
+                alt,
+                ensembl=genomes[genome_index],
+                allow_extended_nucleotides=allow_extended_nucleotides,
+                normalize_contig_name=normalize_contig_name)
+        variants.append(variant)
+    return variants
+
+
+def write_variants_parquet(variant_collection, path, row_group_size=None):
+    """
+    Save a VariantCollection, including the metadata of each of its sources,
+    as a Parquet file.
+
+    Parameters
+    ----------
+    variant_collection : VariantCollection
+
+    path : str
+
+    row_group_size : int, optional
+        Maximum number of rows in each row group, by default each contig is
+        written as a single row group.
+    """
+    variants = list(variant_collection)
+    genomes, genome_indices = _genomes_and_indices(variants)
+    columns = _variant_columns(variants, genome_indices)
+    sources = sorted(variant_collection.sources)
+    metadata_kinds = []
+    for (i, source) in enumerate(sources):
+        metadata = variant_collection.source_to_metadata_dict.get(source)
+        if metadata is None:
+            metadata_kinds.append(None)
+            continue
+        (kind, metadata_columns) = _metadata_columns(i, metadata, variants)
+        metadata_kinds.append(kind)
+        columns.extend(metadata_columns)
+    header = dict(
+        format_version=FORMAT_VERSION,
+        collection="VariantCollection",
+        genomes=[genome_descriptor(genome) for genome in genomes],
+        sources=sources,
+        metadata_kinds=metadata_kinds,
+        distinct=variant_collection.distinct,
+        sorted_by_position=(
+            variant_collection.sort_key is
+            variant_ascending_position_sort_key))
+    _write_table(path, columns, header, row_group_size)
+
+
+def read_variants_parquet(path, contigs=None, genome=None, memory_map=True):
+    """
+    Load a VariantCollection saved by `write_variants_parquet`.
+
+    Parameters
+    ----------
+    path : str
+
+    contigs : list of str, optional
+        Only load variants on these contigs (with or without a 'chr'
+        prefix), skipping the row groups of all other contigs.
+
+    genome : Genome, int or str, optional
+        Genome to use for all variants instead of the Ensembl releases they
+        were saved with. Required for variants which used a custom genome.
+
+    memory_map : bool, optional
+        Memory map the file instead of reading it into memory.
+    """
+    header, columns = _read_table(path, contigs, memory_map)
+    variants = _variants_from_columns(columns, _load_genomes(header, genome))
+    source_to_metadata_dict = {}
+    for (i, (source, kind)) in enumerate(
+            zip(header["sources"], header["metadata_kinds"])):
+        prefix = "metadata_%d" % i
+        if kind == "dict":
+            source_to_metadata_dict[source] = {
+                variant: _from_json(value)
+                for (variant, value) in zip(variants, columns[prefix])
+                if value is not None
+            }
+        elif kind == "vcf":
+            rows = [
+                row for (row, alt_allele_index) in enumerate(
+                    columns[prefix + ".alt_allele_index"])
+                if alt_allele_index is not None
+            ]
+
+            def field(name, parse=lambda value: value):
+                return [parse(columns[prefix + "." + name][i]) for i in rows]
+
+            # files written before extra fields were kept don't have them
+            extra_fields = [
+                (j, _from_json(value))
+                for (j, value) in enumerate(
+                    field("extra") if prefix + ".extra" in columns else [])
+                if value is not None
+            ]
+            source_to_metadata_dict[source] = VariantMetadataStore(
+                variants=[variants[i] for i in rows],
+                record_indices=list(range(len(rows))),
+                alt_allele_indices=field("alt_allele_index"),
+                ids=field("id"),
+                quals=field("qual"),
+                filters=field("filter"),
+                info=field("info", _from_json),
+                sample_info=field("sample_info", _from_json),
+                extra_fields=extra_fields)
+    if header["sorted_by_position"]:
+        sort_key = variant_ascending_position_sort_key
+    else:
+        sort_key = None
+    return VariantCollection(
+        variants=variants,
+        distinct=header["distinct"],
+        sort_key=sort_key,
+        sources=set(header["sources"]),
+        source_to_metadata_dict=source_to_metadata_dict,
+        presorted=header["sorted_by_position"])
+
+
+def _effect_classes_by_name(cls=MutationEffect, result=None):
+    if result is None:
+        result = {}
+    result[cls.__name__] = cls
+    for subclass in cls.__subclasses__():
+        _effect_classes_by_name(subclass, result)
+    return result
+
+
+def _encode_effect_field(value):
+    if isinstance(value, MutationEffect):
+        return dict(
+            effect=value.__class__.__name__,
+            fields=_encode_effect_fields(value))
+    elif isinstance(value, Exon):
+        return dict(exon_id=value.id)
+    elif isinstance(value, (list, tuple)):
+        return [_encode_effect_field(x) for x in value]
+    return value
+
+
+def _encode_effect_fields(effect):
+    """
+    Arguments needed to reconstruct an effect other than its variant,
+    transcript and gene, which are stored in their own columns.
+    """
+    return {
+        name: _encode_effect_field(value)
+        for (name, value) in effect.to_dict().items()
+        if name not in ("variant", "transcript", "gene")
+    }
+
+
+def _decode_effect(
+        effect_classes,
+        effect_type,
+        fields,
+        variant,
+        transcript,
+        gene):
+    def decode_field(value):
+        if isinstance(value, dict) and "effect" in value:
+            return _decode_effect(
+                effect_classes,
+                value["effect"],
+                value["fields"],
+                variant,
+                transcript,
+                gene)
+        elif isinstance(value, dict) and "exon_id" in value:
+            return annotation_for_genome(variant.ensembl).exon_by_id(
+                value["exon_id"])
+        elif isinstance(value, list):
+            return [decode_field(x) for x in value]
+        return value
+
+    effect_class = effect_classes[effect_type]
+    kwargs = {
+        name: decode_field(value)
+        for (name, value) in fields.items()
+    }
+    kwargs["variant"] = variant
+    if issubclass(effect_class, TranscriptMutationEffect):
+        kwargs["transcript"] = transcript
+    elif issubclass(effect_class, Intragenic):
+        kwargs["gene"] = gene
+    return effect_class.from_dict(kwargs)
+
+
+def write_effects_parquet(effect_collection, path, row_group_size=None):
+    """
+    Save an EffectCollection as a Parquet file, with one row per effect.
+    Besides the columns of each effect's variant the file has typed columns
+    for the gene, transcript and class of each effect, along with the
+    class-specific fields needed to reconstruct it (e.g. amino acid
+    changes) encoded as JSON.
+
+    Parameters
+    ----------
+    effect_collection : EffectCollection
+
+    path : str
+
+    row_group_size : int, optional
+        Maximum number of rows in each row group, by default each run of
+        effects on the same contig is written as a single row group.
+    """
+    pa, _ = _import_pyarrow()
+    effects = list(effect_collection)
+    variants = [effect.variant for effect in effects]
+    genomes, genome_indices = _genomes_and_indices(variants)
+    columns = _variant_columns(variants, genome_indices)
+    columns.extend([
+        ("gene_id", pa.string(), [e.gene_id for e in effects]),
+        ("gene_name", pa.string(), [e.gene_name for e in effects]),
+        ("transcript_id", pa.string(), [e.transcript_id for e in effects]),
+        ("transcript_name", pa.string(), [
+            e.transcript_name for e in effects]),
+        ("effect_type", pa.string(), [
+            e.__class__.__name__ for e in effects]),
+        ("effect_fields", pa.string(), [
+            _to_json(_encode_effect_fields(e)) for e in effects]),
+    ])
+    header = dict(
+        format_version=FORMAT_VERSION,
+        collection="EffectCollection",
+        genomes=[genome_descriptor(genome) for genome in genomes],
+        sources=sorted(effect_collection.sources),
+        distinct=effect_collection.distinct)
+    _write_table(path, columns, header, row_group_size)
+
+
+def read_effects_parquet(path, contigs=None, genome=None, memory_map=True):
+    """
+    Load an EffectCollection saved by `write_effects_parquet`. Transcripts and
+    genes are looked up by their IDs, effects aren't predicted again.
+
+    Parameters
+    ----------
+    path : str
+
+    contigs : list of str, optional
+        Only load effects of variants on these contigs (with or without a
+        'chr' prefix), skipping the row groups of all other contigs.
+
+    genome : Genome, int or str, optional
+        Genome to use for all variants instead of the Ensembl releases they
+        were saved with. Required for variants which used a custom genome.
+
+    memory_map : bool, optional
+        Memory map the file instead of reading it into memory.
+    """
+    header, columns = _read_table(path, contigs, memory_map)
+    variants = _variants_from_columns(columns, _load_genomes(header, genome))
+    # transcripts, genes and exons come from the annotation registered for
+    # each genome (e.g. a TranscriptIndex), which may be its only source
+    annotations = {}
+    effect_classes = _effect_classes_by_name()
+    transcripts = {}
+    genes = {}
+    effects = []
+    for (variant, gene_id, transcript_id, effect_type, fields) in zip(
+            variants,
+            columns["gene_id"],
+            columns["transcript_id"],
+            columns["effect_type"],
+            columns["effect_fields"]):
+        transcript = gene = None
+        if variant.ensembl not in annotations:
+            annotations[variant.ensembl] = annotation_for_genome(
+                variant.ensembl)
+        annotation = annotations[variant.ensembl]
+        if transcript_id is not None:
+            key = (variant.ensembl, transcript_id)
+            if key not in transcripts:
+                transcripts[key] = annotation.transcript_by_id(transcript_id)
+            transcript = transcripts[key]
+        if gene_id is not None:
+            key = (variant.ensembl, gene_id)
+            if key not in genes:
+                genes[key] = annotation.gene_by_id(gene_id)
+            gene = genes[key]
+        effects.append(_decode_effect(
+            effect_classes,
+            effect_type,
+            json.loads(fields),
+            variant,
+            transcript,
+            gene))
+    return EffectCollection(
+        effects,
+        distinct=header["distinct"],
+        sources=set(header["sources"]))
+
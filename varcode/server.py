@@ -0,0 +1,768 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Long-running annotation service, which keeps genomes, transcript indices
+and worker processes warm so that many small client jobs can share them
+instead of each paying for their startup.
+
+The server speaks HTTP over a TCP port or a Unix socket:
+
+    POST /effects
+        Body is either varcode NDJSON variants (see `varcode.ndjson`), a
+        JSON list of {"contig", "start", "ref", "alt"[, "genome"]} objects
+        (or an object with such a list under "variants"), or VCF text.
+        Query parameters: genome (default genome of JSON and VCF variants),
+        transcript_filter ("canonical", "coding") and top (only return
+        the highest priority effect of each variant).
+        Responds with the effects as varcode NDJSON, which
+        `varcode.ndjson.iter_effects_ndjson` reads. Variants of genomes
+        which the server didn't warm up are rejected, and so are bodies
+        larger than its maximum (with 413).
+
+    GET /metrics
+        Counters of requests, variants, batches and timings as JSON.
+
+    GET /health
+
+Variants of concurrent requests are collected into batches, each distinct
+variant of a batch is annotated once and batches are split between the
+processes of a worker pool.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+from collections import OrderedDict
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from pyensembl import EnsemblRelease
+from six.moves import BaseHTTPServer, socketserver
+from six.moves import http_client
+from six.moves.urllib.parse import parse_qs, urlencode, urlsplit
+
+from .effects import predict_variant_effects, top_priority_effect
+from .effects.effect_cache import (
+    decode_effect,
+    encode_effect,
+    variant_annotation_key,
+)
+from .effects.transcript_filter import normalize_transcript_filter
+from .genome_registry import (
+    annotation_for_genome,
+    genome_from_key,
+    genome_key,
+    register_genome,
+)
+from .ndjson import (
+    HEADER_KEY,
+    iter_effects_ndjson,
+    iter_variants_ndjson,
+    write_effects_ndjson,
+    write_variants_ndjson,
+)
+from .reference import infer_genome
+from .transcript_index import preload, use_transcript_index
+from .variant import Variant
+from .vcf import load_vcf
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8457
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+DEFAULT_MAX_BODY_SIZE = 64 * 1024 * 1024
+
+
+def _resolve_genome(name):
+    """
+    Genome for a registry key (e.g. "ensembl:75:homo_sapiens"), reference
+    name or Ensembl release given in a request.
+    """
+    genome = genome_from_key(name)
+    if genome is not None:
+        return genome
+    if name.isdigit():
+        return infer_genome(int(name))
+    return infer_genome(name)
+
+
+def _initialize_worker(custom_genomes, indices):
+    """
+    Register the server's custom genomes and transcript indices in a worker
+    process, which only matters for workers that weren't forked.
+    """
+    for (key, genome) in custom_genomes:
+        register_genome(genome, key=key)
+    for index in indices:
+        use_transcript_index(index)
+
+
+def _predict_effects(variants, transcript_filter, cache):
+    return [
+        list(predict_variant_effects(
+            variant,
+            raise_on_error=False,
+            cache=cache,
+            transcript_filter=transcript_filter))
+        for variant in variants
+    ]
+
+
+def _predict_encoded_effects(args):
+    """
+    Worker function which returns the effects of a chunk of variants
+    encoded with `encode_effect`, so that the batching thread decodes them
+    from its own annotation instead of unpickling transcripts and genomes.
+    """
+    (variants, transcript_filter, cache) = args
+    return [
+        [encode_effect(effect) for effect in effects]
+        for effects in _predict_effects(variants, transcript_filter, cache)
+    ]
+
+
+class ServerMetrics(object):
+    """
+    Counters of an AnnotationServer, updated by its request and batching
+    threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+        self.requests = 0
+        self.request_errors = 0
+        self.request_seconds = 0.0
+        self.variants = 0
+        self.effects = 0
+        self.batches = 0
+        self.batch_variants = 0
+        self.distinct_batch_variants = 0
+        self.largest_batch = 0
+        self.prediction_seconds = 0.0
+
+    def add_request(self, n_variants, n_effects, seconds, error=False):
+        with self._lock:
+            self.requests += 1
+            self.request_seconds += seconds
+            self.variants += n_variants
+            self.effects += n_effects
+            if error:
+                self.request_errors += 1
+
+    def add_batch(self, n_variants, n_distinct_variants, seconds):
+        with self._lock:
+            self.batches += 1
+            self.batch_variants += n_variants
+            self.distinct_batch_variants += n_distinct_variants
+            self.largest_batch = max(self.largest_batch, n_variants)
+            self.prediction_seconds += seconds
+
+    def to_dict(self):
+        with self._lock:
+            return dict(
+                uptime_seconds=time.time() - self.start_time,
+                requests=self.requests,
+                request_errors=self.request_errors,
+                request_seconds=self.request_seconds,
+                variants=self.variants,
+                effects=self.effects,
+                batches=self.batches,
+                batch_variants=self.batch_variants,
+                distinct_batch_variants=self.distinct_batch_variants,
+                largest_batch=self.largest_batch,
+                prediction_seconds=self.prediction_seconds)
+
+
+class _PendingRequest(object):
+    def __init__(self, variants, transcript_filter):
+        self.variants = variants
+        self.transcript_filter = transcript_filter
+        self.effects = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _EffectBatcher(object):
+    """
+    Collects the variants of concurrent requests into batches, which are
+    annotated by a single thread either in this process or by the workers
+    of a process pool.
+    """
+    def __init__(self, metrics, pool=None, n_workers=1, batch_size=1000,
+                 batch_wait=0.005, cache=None):
+        self.metrics = metrics
+        self.pool = pool
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.cache = cache
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="varcode-batcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, variants, transcript_filter=None):
+        """
+        Effects of each variant, waiting for the batch they're added to.
+        """
+        request = _PendingRequest(variants, transcript_filter)
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Annotation server is shutting down")
+            self._pending.append(request)
+            self._condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.effects
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            if not self._pending:
+                return None
+            # give concurrent requests a moment to join the batch
+            deadline = time.time() + self.batch_wait
+            while (sum(len(r.variants) for r in self._pending) <
+                    self.batch_size and not self._stopped):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = []
+            n_variants = 0
+            while self._pending and (
+                    not batch or
+                    n_variants + len(self._pending[0].variants) <=
+                    self.batch_size):
+                request = self._pending.pop(0)
+                batch.append(request)
+                n_variants += len(request.variants)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            by_filter = OrderedDict()
+            for request in batch:
+                by_filter.setdefault(
+                    request.transcript_filter, []).append(request)
+            for (transcript_filter, requests) in by_filter.items():
+                try:
+                    self._annotate(requests, transcript_filter)
+                except Exception as e:
+                    logger.exception("Failed to annotate batch")
+                    for request in requests:
+                        request.error = e
+                for request in requests:
+                    request.done.set()
+
+    def _annotate(self, requests, transcript_filter):
+        start_time = time.time()
+        distinct_variants = OrderedDict()
+        n_variants = 0
+        for request in requests:
+            for variant in request.variants:
+                n_variants += 1
+                key = variant_annotation_key(variant)
+                if key not in distinct_variants:
+                    distinct_variants[key] = variant
+        variants = list(distinct_variants.values())
+        if self.pool is not None and len(variants) > 1:
+            chunk_size = -(-len(variants) // self.n_workers)
+            chunk_results = self.pool.map(
+                _predict_encoded_effects,
+                [
+                    (variants[i:i + chunk_size], transcript_filter, self.cache)
+                    for i in range(0, len(variants), chunk_size)
+                ])
+            effects_per_variant = [
+                [decode_effect(encoded, variant) for encoded in encoded_effects]
+                for (variant, encoded_effects) in zip(
+                    variants,
+                    (encoded for chunk in chunk_results for encoded in chunk))
+            ]
+        else:
+            effects_per_variant = _predict_effects(
+                variants, transcript_filter, self.cache)
+        key_to_effects = dict(zip(distinct_variants, effects_per_variant))
+        for request in requests:
+            request.effects = [
+                key_to_effects[variant_annotation_key(variant)]
+                for variant in request.variants
+            ]
+        self.metrics.add_batch(
+            n_variants, len(variants), time.time() - start_time)
+
+
+class _RequestError(Exception):
+    pass
+
+
+def _variants_from_json(records, default_genome):
+    if isinstance(records, dict):
+        records = records.get("variants", [])
+    variants = []
+    for record in records:
+        if "genome" in record:
+            genome = _resolve_genome(record["genome"])
+        elif default_genome is not None:
+            genome = default_genome
+        else:
+            raise _RequestError("Variant without a genome: %s" % (record,))
+        variants.append(Variant(
+            record["contig"],
+            int(record["start"]),
+            record["ref"],
+            record["alt"],
+            ensembl=genome))
+    return variants
+
+
+def _variants_from_vcf(text, genome):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "request.vcf")
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return list(load_vcf(path, genome=genome, include_info=False))
+    finally:
+        shutil.rmtree(directory)
+
+
+def parse_variants(body, default_genome=None):
+    """
+    Variants in the body of a request, given as varcode NDJSON, a JSON list
+    of variant objects or VCF text.
+    """
+    text = body.decode("utf-8") if isinstance(body, bytes) else body
+    stripped = text.lstrip()
+    if stripped.startswith('{"%s"' % HEADER_KEY):
+        return list(iter_variants_ndjson(io.StringIO(stripped)))
+    if stripped.startswith("##fileformat=VCF") or \
+            stripped.startswith("#CHROM"):
+        return _variants_from_vcf(stripped, default_genome)
+    try:
+        records = json.loads(stripped)
+    except ValueError:
+        raise _RequestError(
+            "Expected varcode NDJSON, a JSON list of variants or VCF")
+    return _variants_from_json(records, default_genome)
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # set on the subclass which each server creates
+    annotation_server = None
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # client addresses of Unix sockets aren't (host, port) tuples
+        logger.debug(format, *args)
+
+    def _respond(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_json(self, status, value):
+        self._respond(status, json.dumps(value, sort_keys=True))
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self._respond_json(200, self.annotation_server.metrics_dict())
+        elif path == "/health":
+            self._respond_json(200, {"status": "ok"})
+        else:
+            self._respond_json(404, {"error": "Unknown path %s" % path})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        max_body_size = self.annotation_server.max_body_size
+        if length < 0 or (
+                max_body_size is not None and length > max_body_size):
+            # the body isn't read, so the connection can't be reused
+            self.close_connection = True
+            if length < 0:
+                self._respond_json(400, {"error": "Invalid Content-Length"})
+            else:
+                self._respond_json(413, {
+                    "error": "Request body of %d bytes is larger than the "
+                             "maximum of %d bytes" % (length, max_body_size)})
+            return
+        body = self.rfile.read(length)
+        if url.path != "/effects":
+            self._respond_json(404, {"error": "Unknown path %s" % url.path})
+            return
+        params = {
+            key: values[-1] for (key, values) in parse_qs(url.query).items()}
+        try:
+            response = self.annotation_server.effects_response(body, params)
+        except (_RequestError, ValueError, KeyError, TypeError) as e:
+            self._respond_json(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception("Failed to handle request")
+            self._respond_json(500, {"error": str(e)})
+        else:
+            self._respond(200, response, content_type=NDJSON_CONTENT_TYPE)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                               socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # attributes which BaseHTTPRequestHandler expects of HTTPServer
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+class AnnotationServer(object):
+    """
+    HTTP server which predicts the effects of variants with warm genomes,
+    transcript indices and worker processes.
+
+    Parameters
+    ----------
+    genomes : list of pyensembl.Genome, int or str
+        Genomes to warm up before serving, the first one is the default
+        genome of JSON and VCF variants which don't name theirs. Requests
+        for variants of other genomes are rejected, so that clients can't
+        make the server install or download genomes.
+
+    host : str, optional
+
+    port : int, optional
+        TCP port to listen on, 0 picks a free port.
+
+    socket_path : str, optional
+        Listen on a Unix socket at this path instead of a TCP port.
+
+    n_workers : int, optional
+        Number of worker processes which annotate batches, batches are
+        annotated in the server process if this is 1.
+
+    batch_size : int, optional
+        Maximum number of variants annotated in one batch, requests with
+        more variants are annotated in a batch of their own.
+
+    batch_wait : float, optional
+        Seconds to wait for other requests to join a batch.
+
+    use_index : bool, optional
+        Preload the transcript index of each genome (see
+        `varcode.preload`), so that neither the server nor its workers query
+        the genomes' databases.
+
+    cache : EffectCache, optional
+        Persistent cache of previously predicted effects.
+
+    max_body_size : int, optional
+        Maximum size in bytes of request bodies, larger requests are
+        answered with 413. None doesn't limit their size.
+    """
+    def __init__(
+            self,
+            genomes,
+            host="127.0.0.1",
+            port=DEFAULT_PORT,
+            socket_path=None,
+            n_workers=1,
+            batch_size=1000,
+            batch_wait=0.005,
+            use_index=True,
+            cache=None,
+            max_body_size=DEFAULT_MAX_BODY_SIZE):
+        self.genomes = [infer_genome(genome) for genome in genomes]
+        self.max_body_size = max_body_size
+        # effects are written with the registry keys of their genomes
+        custom_genomes = []
+        for genome in self.genomes:
+            if not isinstance(genome, EnsemblRelease):
+                key = genome_key(genome)
+                if key is None:
+                    key = register_genome(genome)
+                custom_genomes.append((key, genome))
+        self.indices = []
+        self.metrics = ServerMetrics()
+        start_time = time.time()
+        for genome in self.genomes:
+            if annotation_for_genome(genome) is not genome:
+                self.indices.append(annotation_for_genome(genome))
+            elif use_index:
+                self.indices.append(preload(genome))
+            else:
+                # load the database connection and sequences up front
+                genome.index()
+        logger.info(
+            "Warmed up %d genomes in %0.1f seconds",
+            len(self.genomes),
+            time.time() - start_time)
+
+        self.n_workers = n_workers
+        self.pool = None
+        if n_workers > 1:
+            self.pool = multiprocessing.Pool(
+                n_workers,
+                initializer=_initialize_worker,
+                initargs=(custom_genomes, self.indices))
+        self.batcher = _EffectBatcher(
+            self.metrics,
+            pool=self.pool,
+            n_workers=n_workers,
+            batch_size=batch_size,
+            batch_wait=batch_wait,
+            cache=cache)
+
+        handler = type(
+            "RequestHandler", (_RequestHandler,), {"annotation_server": self})
+        self.socket_path = socket_path
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.httpd = _ThreadingUnixHTTPServer(socket_path, handler)
+        else:
+            self.httpd = _ThreadingHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        Unix socket path or "http://host:port" URL of this server, which
+        `request_effects` accepts.
+        """
+        if self.socket_path is not None:
+            return self.socket_path
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def metrics_dict(self):
+        metrics = self.metrics.to_dict()
+        metrics["workers"] = self.n_workers
+        metrics["genomes"] = [str(genome) for genome in self.genomes]
+        metrics["transcript_indices"] = [str(index) for index in self.indices]
+        return metrics
+
+    def _check_genome(self, genome):
+        """
+        Raises a _RequestError unless the genome is one of those which were
+        warmed up, since the database and sequences of any other genome
+        would be installed or downloaded on first use.
+        """
+        if genome not in self.genomes:
+            raise _RequestError(
+                "Genome %s isn't served, expected one of: %s" % (
+                    genome,
+                    ", ".join(str(served) for served in self.genomes)))
+        return genome
+
+    def effects_response(self, body, params):
+        start_time = time.time()
+        n_variants = n_effects = 0
+        try:
+            genome_name = params.get("genome")
+            if genome_name:
+                default_genome = self._check_genome(
+                    _resolve_genome(genome_name))
+            elif self.genomes:
+                default_genome = self.genomes[0]
+            else:
+                default_genome = None
+            variants = parse_variants(body, default_genome)
+            # variants can name their own genomes, or get them from the
+            # header of a VCF
+            for genome in set(variant.ensembl for variant in variants):
+                self._check_genome(genome)
+            n_variants = len(variants)
+            transcript_filter = normalize_transcript_filter(
+                params.get("transcript_filter") or None)
+            effects_per_variant = self.batcher.submit(
+                variants, transcript_filter=transcript_filter)
+            if params.get("top", "").lower() in ("1", "true", "yes"):
+                effects = [
+                    top_priority_effect(effects)
+                    for effects in effects_per_variant
+                    if len(effects) > 0
+                ]
+            else:
+                effects = [
+                    effect
+                    for effects in effects_per_variant
+                    for effect in effects
+                ]
+            n_effects = len(effects)
+            f = io.StringIO()
+            write_effects_ndjson(effects, f)
+            response = f.getvalue()
+        except Exception:
+            self.metrics.add_request(
+                n_variants, n_effects, time.time() - start_time, error=True)
+            raise
+        self.metrics.add_request(
+            n_variants, n_effects, time.time() - start_time)
+        return response
+
+    def serve_forever(self):
+        logger.info("Serving varcode effects at %s", self.address)
+        self.httpd.serve_forever()
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+        """
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="varcode-server")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+        self.batcher.stop()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class _UnixHTTPConnection(http_client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        http_client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _connection(address, timeout=None):
+    if address.startswith("http://"):
+        url = urlsplit(address)
+        return http_client.HTTPConnection(
+            url.hostname, url.port or 80, timeout=timeout)
+    return _UnixHTTPConnection(address, timeout=timeout)
+
+
+def _request(address, method, path, body=None, timeout=None):
+    connection = _connection(address, timeout=timeout)
+    try:
+        headers = {}
+        if body is not None:
+            headers["Content-Type"] = NDJSON_CONTENT_TYPE
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read().decode("utf-8")
+        if response.status != 200:
+            raise ValueError(
+                "Annotation server responded with %d: %s" % (
+                    response.status, data))
+        return data
+    finally:
+        connection.close()
+
+
+def request_effects(
+        variants,
+        address,
+        transcript_filter=None,
+        top=False,
+        timeout=None):
+    """
+    Predict the effects of variants with a running annotation server.
+
+    Parameters
+    ----------
+    variants : VariantCollection or list of Variant
+        Variants of custom genomes have to be registered (with the same key)
+        in this process and the server.
+
+    address : str
+        "http://host:port" URL or Unix socket path of the server.
+
+    transcript_filter : str, optional
+        "canonical" or "coding".
+
+    top : bool, optional
+        Only return the highest priority effect of each variant.
+
+    Returns a list of MutationEffect objects.
+    """
+    f = io.StringIO()
+    write_variants_ndjson(variants, f)
+    params = {}
+    if transcript_filter:
+        params["transcript_filter"] = transcript_filter
+    if top:
+        params["top"] = "1"
+    path = "/effects"
+    if params:
+        path += "?" + urlencode(params)
+    data = _request(
+        address, "POST", path, body=f.getvalue().encode("utf-8"),
+        timeout=timeout)
+    return list(iter_effects_ndjson(io.StringIO(data)))
+
+
+def server_metrics(address, timeout=None):
+    """
+    Metrics of a running annotation server.
+    """
+    return json.loads(_request(address, "GET", "/metrics", timeout=timeout))
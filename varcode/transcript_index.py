@@ -0,0 +1,1236 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact index of the transcripts and genes of a genome, holding everything
+effect prediction needs (exon boundaries, start and stop codons, cDNA and
+protein sequences) in flat NumPy arrays.
+
+The index is built once per genome from its pyensembl database and FASTA
+files, or directly from a GTF file with `TranscriptIndex.from_gtf`, and
+saved as a single binary file which later gets memory-mapped read-only.
+Opening it doesn't parse anything besides a small JSON header,
+and processes which map the same file share its pages in the OS cache.
+An index can also be copied into shared memory with `preload`, so that
+the workers of a process pool share a single copy of it.
+
+cDNA sequences are packed with two bits per nucleotide, bases other than
+A/C/G/T are stored separately as exceptions.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import atexit
+from collections import namedtuple
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from memoized_property import memoized_property
+from pyensembl import Exon, Gene, Genome, Transcript
+from pyensembl.locus import normalize_chromosome
+from six import string_types
+
+from .annotation_source import AnnotationSource
+from .genome_registry import (
+    annotation_for_genome,
+    genome_descriptor,
+    genome_from_descriptor,
+    set_genome_annotation,
+)
+from .reference import infer_genome
+
+MAGIC = b"VARCODEX"
+
+FORMAT_VERSION = 1
+
+# start of every array in the file is aligned to this many bytes
+ALIGNMENT = 64
+
+DEFAULT_FILENAME = "varcode_transcript_index.bin"
+
+# bits of the transcript_flags array
+CONTAINS_START_CODON = 1
+START_CODON_COMPLETE = 2
+CONTAINS_STOP_CODON = 4
+STOP_CODON_COMPLETE = 8
+COMPLETE = 16
+HAS_SEQUENCE = 32
+HAS_PROTEIN_SEQUENCE = 64
+
+# nucleotide -> 2-bit code, 255 for bases which are stored as exceptions
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for (_code, _base) in enumerate(b"ACGT"):
+    _BASE_CODES[_base] = _code
+
+_CODE_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+def _pack_bases(sequence):
+    """
+    Pack a nucleotide string with two bits per base. Returns the packed
+    bytes and the positions and values of bases other than A/C/G/T.
+    """
+    bases = np.frombuffer(sequence, dtype=np.uint8)
+    codes = _BASE_CODES[bases]
+    exception_positions = np.flatnonzero(codes == 255)
+    exception_bases = bases[exception_positions]
+    padded = np.zeros((len(codes) + 3) // 4 * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    padded[exception_positions] = 0
+    quads = padded.reshape((-1, 4))
+    packed = (
+        (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) |
+        quads[:, 3]).astype(np.uint8)
+    return packed, exception_positions.astype(np.int64), exception_bases
+
+
+def _unpack_bases(packed, exception_positions, exception_bases, start, end):
+    """
+    Nucleotides [start, end) of a sequence packed with `_pack_bases`.
+    """
+    first_byte = start // 4
+    chunk = packed[first_byte:(end + 3) // 4]
+    codes = np.empty((len(chunk), 4), dtype=np.uint8)
+    codes[:, 0] = chunk >> 6
+    codes[:, 1] = (chunk >> 4) & 3
+    codes[:, 2] = (chunk >> 2) & 3
+    codes[:, 3] = chunk & 3
+    offset = start - 4 * first_byte
+    bases = _CODE_BASES[codes.reshape(-1)[offset:offset + end - start]]
+    lo, hi = np.searchsorted(exception_positions, [start, end])
+    if lo < hi:
+        bases[exception_positions[lo:hi] - start] = exception_bases[lo:hi]
+    return bases.tobytes().decode("ascii")
+
+
+def _string_array(values):
+    """
+    Fixed width byte string array, with None stored as an empty string.
+    """
+    encoded = [
+        b"" if value is None else value.encode("utf-8")
+        for value in values
+    ]
+    width = max([len(value) for value in encoded] + [1])
+    return np.array(encoded, dtype="S%d" % width)
+
+
+def _decode(value):
+    return value.decode("utf-8") or None
+
+
+def _find(sorted_values, value):
+    """
+    Index of a string in a sorted fixed width byte string array, or None.
+    """
+    key = value.encode("utf-8")
+    if len(key) > sorted_values.itemsize:
+        return None
+    i = int(np.searchsorted(sorted_values, key))
+    if i < len(sorted_values) and sorted_values[i] == key:
+        return i
+    return None
+
+
+def _codes(values):
+    """
+    List of the distinct non-null values and the index of each value in it,
+    -1 for None.
+    """
+    distinct = sorted(set(value for value in values if value is not None))
+    value_to_code = {value: i for (i, value) in enumerate(distinct)}
+    codes = np.array(
+        [-1 if value is None else value_to_code[value] for value in values],
+        dtype=np.int32)
+    return distinct, codes
+
+
+def _int_array(values, dtype=np.int64):
+    return np.array(values, dtype=dtype)
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _locus_arrays(prefix, contig_codes, starts, ends, n_contigs):
+    """
+    Arrays for finding the features (transcripts or genes) overlapping an
+    interval: the features ordered by contig and start position, where
+    the features of each contig begin in that order, and the running
+    maximum of their end positions.
+    """
+    order = np.lexsort((starts, contig_codes))
+    contig_offsets = np.searchsorted(
+        contig_codes[order], np.arange(n_contigs + 1)).astype(np.int64)
+    max_end = ends[order]
+    for code in range(n_contigs):
+        segment = slice(contig_offsets[code], contig_offsets[code + 1])
+        max_end[segment] = np.maximum.accumulate(max_end[segment])
+    return {
+        prefix + "_locus_order": order.astype(np.int64),
+        prefix + "_locus_start": starts[order],
+        prefix + "_locus_max_end": max_end,
+        prefix + "_contig_offsets": contig_offsets,
+    }
+
+
+def _exons_by_transcript_id(genome, transcript_ids):
+    """
+    Dictionary from each transcript ID to the (exon ID, start, end) of its
+    exons in order, loaded with a single query when the database has exon
+    IDs.
+    """
+    if not genome.db.column_exists("exon", "exon_id"):
+        return {
+            transcript_id: [
+                (exon.id, exon.start, exon.end)
+                for exon in genome.transcript_by_id(transcript_id).exons
+            ]
+            for transcript_id in transcript_ids
+        }
+    wanted = set(transcript_ids)
+    numbered_exons = {transcript_id: [] for transcript_id in transcript_ids}
+    for (transcript_id, exon_number, exon_id, start, end) in \
+            genome.db.run_sql_query(
+                "SELECT transcript_id, exon_number, exon_id, start, end "
+                "FROM exon"):
+        if transcript_id in wanted:
+            numbered_exons[transcript_id].append(
+                (int(exon_number), exon_id, start, end))
+    return {
+        transcript_id: [exon[1:] for exon in sorted(exons)]
+        for (transcript_id, exons) in numbered_exons.items()
+    }
+
+
+# fields of a transcript or gene which get stored in an index, records are
+# collected from a pyensembl genome or a GTF file before building the arrays
+TranscriptRecord = namedtuple("TranscriptRecord", [
+    "transcript_id",
+    "transcript_name",
+    "gene_id",
+    "contig",
+    "start",
+    "end",
+    "strand",
+    "biotype",
+    "support_level",
+    # list of (exon ID, start, end) in transcript order
+    "exons",
+    # combination of CONTAINS_START_CODON, START_CODON_COMPLETE, ... bits
+    "flags",
+    # three positions of each codon, or -1s if it isn't complete
+    "start_codon",
+    "stop_codon",
+    # spliced offsets of the first and last nucleotide of the coding
+    # sequence, -1 for incomplete transcripts
+    "cds_spliced_start",
+    "cds_spliced_end",
+    "sequence",
+    "protein_id",
+    "protein_sequence",
+])
+
+GeneRecord = namedtuple("GeneRecord", [
+    "gene_id",
+    "gene_name",
+    "contig",
+    "start",
+    "end",
+    "strand",
+    "biotype",
+    "canonical_transcript_id",
+])
+
+MISSING_CODON = [-1, -1, -1]
+
+
+def _transcript_record(transcript, exons):
+    """
+    Record of a pyensembl Transcript, whose exons were already loaded.
+    """
+    sequence = transcript.sequence
+    protein_sequence = transcript.protein_sequence
+    flags = 0
+    for (flag, value) in [
+            (CONTAINS_START_CODON, transcript.contains_start_codon),
+            (START_CODON_COMPLETE, transcript.start_codon_complete),
+            (CONTAINS_STOP_CODON, transcript.contains_stop_codon),
+            (STOP_CODON_COMPLETE, transcript.stop_codon_complete),
+            (COMPLETE, transcript.complete),
+            (HAS_SEQUENCE, sequence is not None),
+            (HAS_PROTEIN_SEQUENCE, protein_sequence is not None)]:
+        if value:
+            flags |= flag
+    if flags & COMPLETE:
+        cds_spliced_start = transcript.first_start_codon_spliced_offset
+        cds_spliced_end = transcript.last_stop_codon_spliced_offset
+    else:
+        cds_spliced_start = cds_spliced_end = -1
+    return TranscriptRecord(
+        transcript_id=transcript.id,
+        transcript_name=transcript.name,
+        gene_id=transcript.gene_id,
+        contig=transcript.contig,
+        start=transcript.start,
+        end=transcript.end,
+        strand=transcript.strand,
+        biotype=transcript.biotype,
+        support_level=transcript.support_level,
+        exons=exons,
+        flags=flags,
+        start_codon=(
+            transcript.start_codon_positions
+            if flags & START_CODON_COMPLETE and flags & CONTAINS_START_CODON
+            else MISSING_CODON),
+        stop_codon=(
+            transcript.stop_codon_positions
+            if flags & STOP_CODON_COMPLETE and flags & CONTAINS_STOP_CODON
+            else MISSING_CODON),
+        cds_spliced_start=cds_spliced_start,
+        cds_spliced_end=cds_spliced_end,
+        sequence=sequence,
+        protein_id=transcript.protein_id,
+        protein_sequence=protein_sequence)
+
+
+def _arrays_from_records(transcripts, genes):
+    """
+    Index arrays for transcript and gene records sorted by ID, along with
+    the names of contigs and biotypes which the arrays refer to by index.
+    """
+    transcript_ids = [t.transcript_id for t in transcripts]
+    gene_ids = [g.gene_id for g in genes]
+    contig_names, transcript_contigs = _codes(
+        [t.contig for t in transcripts] + [g.contig for g in genes])
+    gene_contigs = transcript_contigs[len(transcripts):]
+    transcript_contigs = transcript_contigs[:len(transcripts)]
+    biotypes, transcript_biotypes = _codes(
+        [t.biotype for t in transcripts] + [g.biotype for g in genes])
+    gene_biotypes = transcript_biotypes[len(transcripts):]
+    transcript_biotypes = transcript_biotypes[:len(transcripts)]
+
+    gene_rows = {gene_id: i for (i, gene_id) in enumerate(gene_ids)}
+    transcript_rows = {
+        transcript_id: i for (i, transcript_id) in enumerate(transcript_ids)}
+
+    sequences = [t.sequence or "" for t in transcripts]
+    protein_sequences = [t.protein_sequence or "" for t in transcripts]
+    packed, exception_positions, exception_bases = _pack_bases(
+        "".join(sequences).encode("ascii"))
+
+    arrays = {
+        "transcript_id": _string_array(transcript_ids),
+        "transcript_name": _string_array(
+            [t.transcript_name for t in transcripts]),
+        "transcript_gene": _int_array(
+            [gene_rows[t.gene_id] for t in transcripts]),
+        "transcript_contig": transcript_contigs,
+        "transcript_start": _int_array([t.start for t in transcripts]),
+        "transcript_end": _int_array([t.end for t in transcripts]),
+        "transcript_strand": _string_array([t.strand for t in transcripts]),
+        "transcript_biotype": transcript_biotypes,
+        "transcript_support_level": _int_array(
+            [
+                -1 if t.support_level is None else t.support_level
+                for t in transcripts
+            ],
+            dtype=np.int16),
+        "transcript_flags": _int_array(
+            [t.flags for t in transcripts], dtype=np.uint8),
+        "start_codon": _int_array(
+            [t.start_codon for t in transcripts]).reshape((-1, 3)),
+        "stop_codon": _int_array(
+            [t.stop_codon for t in transcripts]).reshape((-1, 3)),
+        "cds_spliced_start": _int_array(
+            [t.cds_spliced_start for t in transcripts]),
+        "cds_spliced_end": _int_array(
+            [t.cds_spliced_end for t in transcripts]),
+        "exon_offsets": _offsets([len(t.exons) for t in transcripts]),
+        "exon_id": _string_array(
+            [exon_id for t in transcripts for (exon_id, _, _) in t.exons]),
+        "exon_start": _int_array(
+            [start for t in transcripts for (_, start, _) in t.exons]),
+        "exon_end": _int_array(
+            [end for t in transcripts for (_, _, end) in t.exons]),
+        "cdna_offsets": _offsets([len(s) for s in sequences]),
+        "cdna_packed": packed,
+        "cdna_exception_positions": exception_positions,
+        "cdna_exception_bases": exception_bases,
+        "protein_id": _string_array([t.protein_id for t in transcripts]),
+        "protein_offsets": _offsets([len(s) for s in protein_sequences]),
+        "protein_sequences": np.frombuffer(
+            "".join(protein_sequences).encode("ascii"),
+            dtype=np.uint8),
+        "gene_id": _string_array(gene_ids),
+        "gene_name": _string_array([g.gene_name for g in genes]),
+        "gene_contig": gene_contigs,
+        "gene_start": _int_array([g.start for g in genes]),
+        "gene_end": _int_array([g.end for g in genes]),
+        "gene_strand": _string_array([g.strand for g in genes]),
+        "gene_biotype": gene_biotypes,
+        "gene_canonical_transcript": _int_array([
+            transcript_rows.get(g.canonical_transcript_id, -1)
+            for g in genes
+        ]),
+    }
+    arrays.update(_locus_arrays(
+        "transcript",
+        transcript_contigs,
+        arrays["transcript_start"],
+        arrays["transcript_end"],
+        len(contig_names)))
+    arrays.update(_locus_arrays(
+        "gene",
+        gene_contigs,
+        arrays["gene_start"],
+        arrays["gene_end"],
+        len(contig_names)))
+    return arrays, contig_names, biotypes
+
+
+class IndexedTranscript(Transcript):
+    """
+    Transcript whose exons, codons and sequences are read from a
+    TranscriptIndex instead of the pyensembl database and FASTA files.
+    Compares equal to the Transcript of the same genome with the same ID.
+    When pickled or serialized it's looked up again in the annotation
+    registered for its genome, and turns into a regular Transcript if there
+    is none.
+    """
+    def __init__(self, index, row):
+        arrays = index.arrays
+        Transcript.__init__(
+            self,
+            transcript_id=_decode(arrays["transcript_id"][row]),
+            transcript_name=_decode(arrays["transcript_name"][row]),
+            contig=index.contigs()[arrays["transcript_contig"][row]],
+            start=int(arrays["transcript_start"][row]),
+            end=int(arrays["transcript_end"][row]),
+            strand=_decode(arrays["transcript_strand"][row]),
+            biotype=index._biotype(arrays["transcript_biotype"][row]),
+            gene_id=_decode(
+                arrays["gene_id"][arrays["transcript_gene"][row]]),
+            genome=index.genome,
+            support_level=(
+                None if arrays["transcript_support_level"][row] < 0
+                else int(arrays["transcript_support_level"][row])))
+        self._index = index
+        self._row = row
+        self._flags = int(arrays["transcript_flags"][row])
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Transcript) and
+            self.id == other.id and
+            self.genome == other.genome)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    @classmethod
+    def from_dict(cls, state_dict):
+        genome = state_dict["genome"]
+        if isinstance(genome, Genome):
+            annotation = annotation_for_genome(genome)
+            if annotation is not genome:
+                return annotation.transcript_by_id(state_dict["transcript_id"])
+        return Transcript.from_dict(state_dict)
+
+    @property
+    def gene(self):
+        return self._index.gene_by_id(self.gene_id)
+
+    @property
+    def gene_name(self):
+        return self._index.gene_name_of_gene_id(self.gene_id)
+
+    @memoized_property
+    def exons(self):
+        arrays = self._index.arrays
+        start, end = arrays["exon_offsets"][self._row:self._row + 2]
+        gene_name = self.gene_name
+        return [
+            Exon(
+                exon_id=_decode(exon_id),
+                contig=self.contig,
+                start=int(exon_start),
+                end=int(exon_end),
+                strand=self.strand,
+                gene_name=gene_name,
+                gene_id=self.gene_id)
+            for (exon_id, exon_start, exon_end) in zip(
+                arrays["exon_id"][start:end],
+                arrays["exon_start"][start:end],
+                arrays["exon_end"][start:end])
+        ]
+
+    @memoized_property
+    def exon_intervals(self):
+        return [(exon.start, exon.end) for exon in self.exons]
+
+    @property
+    def contains_start_codon(self):
+        return bool(self._flags & CONTAINS_START_CODON)
+
+    @property
+    def contains_stop_codon(self):
+        return bool(self._flags & CONTAINS_STOP_CODON)
+
+    @property
+    def start_codon_complete(self):
+        return bool(self._flags & START_CODON_COMPLETE)
+
+    @property
+    def stop_codon_complete(self):
+        return bool(self._flags & STOP_CODON_COMPLETE)
+
+    def _codon_positions(self, feature):
+        if feature == "start_codon":
+            contains, complete = CONTAINS_START_CODON, START_CODON_COMPLETE
+        else:
+            contains, complete = CONTAINS_STOP_CODON, STOP_CODON_COMPLETE
+        if not self._flags & contains:
+            raise ValueError(
+                "Transcript %s does not contain feature %s" % (
+                    self.id, feature))
+        if not self._flags & complete:
+            raise ValueError(
+                "Expected 3 positions for %s of %s" % (feature, self.id))
+        return [
+            int(position)
+            for position in self._index.arrays[feature][self._row]
+        ]
+
+    @property
+    def complete(self):
+        return bool(self._flags & COMPLETE)
+
+    @memoized_property
+    def first_start_codon_spliced_offset(self):
+        offset = self._index.arrays["cds_spliced_start"][self._row]
+        if offset < 0:
+            return Transcript.first_start_codon_spliced_offset.fget(self)
+        return int(offset)
+
+    @memoized_property
+    def last_stop_codon_spliced_offset(self):
+        offset = self._index.arrays["cds_spliced_end"][self._row]
+        if offset < 0:
+            return Transcript.last_stop_codon_spliced_offset.fget(self)
+        return int(offset)
+
+    @memoized_property
+    def sequence(self):
+        if not self._flags & HAS_SEQUENCE:
+            return None
+        return self._index.transcript_sequence(self._row)
+
+    @property
+    def protein_id(self):
+        return _decode(self._index.arrays["protein_id"][self._row])
+
+    @memoized_property
+    def protein_sequence(self):
+        if not self._flags & HAS_PROTEIN_SEQUENCE:
+            return None
+        return self._index.protein_sequence(self._row)
+
+
+class TranscriptIndex(AnnotationSource):
+    """
+    Transcripts and genes of a genome stored in flat arrays, which are either
+    built in memory with `TranscriptIndex.from_genome` or
+    `TranscriptIndex.from_gtf`, or memory-mapped from a file with
+    `TranscriptIndex.load`.
+
+    Has the same lookup methods as pyensembl.Genome which varcode uses
+    (e.g. `transcripts_at_locus`, `transcript_by_id`), and once registered
+    with `use_transcript_index` replaces those queries for variants of its
+    genome. IDs and contigs which aren't in an index built from a genome are
+    looked up in the genome, an index built from a GTF file raises a
+    ValueError for them instead.
+    """
+    def __init__(self, genome, header, arrays, buffer=None):
+        self.genome = genome
+        self.header = header
+        self.arrays = arrays
+        # memory map (or other buffer) which the arrays are views of
+        self._buffer = buffer
+        self._contigs = header["contigs"]
+        self._contig_codes = {
+            contig: code for (code, contig) in enumerate(self._contigs)}
+        if header["contig_filter"] is None:
+            self._contig_filter = None
+        else:
+            self._contig_filter = set(header["contig_filter"])
+        self._biotypes = header["biotypes"]
+        # indices built from a GTF don't have a database to fall back on
+        self._fallback_to_genome = header.get("fallback_to_genome", True)
+        self._transcripts = {}
+        self._genes = {}
+        # file or shared memory block which the arrays were loaded from
+        self.path = None
+        self._shared_memory = None
+
+    def __len__(self):
+        return len(self.arrays["transcript_id"])
+
+    def __str__(self):
+        return "TranscriptIndex(genome=%s, n_transcripts=%d, n_genes=%d)" % (
+            self.genome, len(self), len(self.arrays["gene_id"]))
+
+    def __repr__(self):
+        return str(self)
+
+    def _biotype(self, code):
+        return None if code < 0 else self._biotypes[code]
+
+    def contigs(self):
+        return self._contigs
+
+    @classmethod
+    def from_genome(cls, genome, contigs=None):
+        """
+        Build an index of a genome from its pyensembl database and sequence
+        files. This looks up every transcript individually, so it takes a
+        while for a whole genome, but only has to be done once.
+
+        Parameters
+        ----------
+        genome : pyensembl.Genome, int or str
+
+        contigs : list of str, optional
+            Only index the transcripts and genes on these contigs, all others
+            are looked up in the genome.
+        """
+        genome = infer_genome(genome)
+        if contigs is None:
+            contig_filter = None
+            transcript_ids = genome.transcript_ids()
+        else:
+            contig_filter = sorted(set(
+                normalize_chromosome(contig) for contig in contigs))
+            transcript_ids = [
+                transcript_id
+                for contig in contig_filter
+                for transcript_id in genome.transcript_ids(contig=contig)
+            ]
+        transcript_ids = sorted(set(transcript_ids))
+        transcripts = [genome.transcript_by_id(t) for t in transcript_ids]
+        gene_ids = sorted(set(t.gene_id for t in transcripts))
+        genes = [genome.gene_by_id(gene_id) for gene_id in gene_ids]
+        exons = _exons_by_transcript_id(genome, transcript_ids)
+
+        # import here since the effects package imports this module
+        from .effects.transcript_filter import canonical_transcript_id
+
+        arrays, contig_names, biotypes = _arrays_from_records(
+            [_transcript_record(t, exons[t.id]) for t in transcripts],
+            [
+                GeneRecord(
+                    gene_id=g.id,
+                    gene_name=g.name,
+                    contig=g.contig,
+                    start=g.start,
+                    end=g.end,
+                    strand=g.strand,
+                    biotype=g.biotype,
+                    canonical_transcript_id=canonical_transcript_id(
+                        genome, g.id))
+                for g in genes
+            ])
+        header = {
+            "format_version": FORMAT_VERSION,
+            "genome": genome_descriptor(genome),
+            "contigs": contig_names,
+            "contig_filter": contig_filter,
+            "biotypes": biotypes,
+        }
+        return cls(genome, header, arrays)
+
+    @classmethod
+    def from_gtf(
+            cls,
+            gtf_path,
+            transcript_fasta_paths=(),
+            protein_fasta_paths=(),
+            genome=None,
+            reference_name=None,
+            annotation_name=None,
+            annotation_version=None,
+            contigs=None):
+        """
+        Build an index directly from a local GTF file and its cDNA and
+        protein FASTA files, without creating a pyensembl database. Every
+        lookup is answered by the index, IDs and loci which aren't in it
+        raise a ValueError or have no transcripts.
+
+        Parameters
+        ----------
+        gtf_path : str
+            GTF file, optionally gzipped.
+
+        transcript_fasta_paths : str or list of str
+
+        protein_fasta_paths : str or list of str
+
+        genome : pyensembl.Genome, int or str, optional
+            Genome of the variants which should be annotated with this
+            GTF. Defaults to a new pyensembl.Genome of the given files, whose
+            database is never built.
+
+        reference_name : str, optional
+            Reference assembly (e.g. "GRCh38"), required unless a genome
+            is given.
+
+        annotation_name : str, optional
+            Defaults to the name of the GTF file.
+
+        annotation_version : str or int, optional
+
+        contigs : list of str, optional
+            Only index the transcripts and genes on these contigs.
+        """
+        from .gtf import gtf_records
+
+        if isinstance(transcript_fasta_paths, string_types):
+            transcript_fasta_paths = [transcript_fasta_paths]
+        if isinstance(protein_fasta_paths, string_types):
+            protein_fasta_paths = [protein_fasta_paths]
+        if genome is None:
+            if reference_name is None:
+                raise ValueError(
+                    "Either a genome or a reference name is required to "
+                    "build an index from a GTF file")
+            if annotation_name is None:
+                annotation_name = os.path.basename(gtf_path).split(".")[0]
+            genome = Genome(
+                reference_name=reference_name,
+                annotation_name=annotation_name,
+                annotation_version=annotation_version,
+                gtf_path_or_url=gtf_path,
+                transcript_fasta_paths_or_urls=list(transcript_fasta_paths),
+                protein_fasta_paths_or_urls=list(protein_fasta_paths))
+            gtf_genome = genome.to_dict()
+        else:
+            genome = infer_genome(genome)
+            gtf_genome = None
+        if contigs is None:
+            contig_filter = None
+        else:
+            contig_filter = sorted(set(
+                normalize_chromosome(contig) for contig in contigs))
+        transcripts, genes = gtf_records(
+            gtf_path,
+            transcript_fasta_paths=transcript_fasta_paths,
+            protein_fasta_paths=protein_fasta_paths,
+            contigs=contig_filter)
+        arrays, contig_names, biotypes = _arrays_from_records(
+            transcripts, genes)
+        header = {
+            "format_version": FORMAT_VERSION,
+            "genome": genome_descriptor(genome),
+            "contigs": contig_names,
+            "contig_filter": contig_filter,
+            "biotypes": biotypes,
+            "fallback_to_genome": False,
+            # lets `load` recreate the genome of the GTF file
+            "gtf_genome": gtf_genome,
+        }
+        return cls(genome, header, arrays)
+
+    def _not_indexed(self, kind, value):
+        raise ValueError("%s '%s' isn't in the transcript index of %s" % (
+            kind, value, self.genome.annotation_name))
+
+    def _layout(self):
+        """
+        Encoded header and total size of this index when written to a file
+        or buffer.
+        """
+        layout = {}
+        offset = 0
+        for name in sorted(self.arrays):
+            array = self.arrays[name]
+            layout[name] = [array.dtype.str, list(array.shape), offset]
+            offset = _aligned(offset + array.nbytes)
+        header = dict(self.header, arrays=layout)
+        header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+        return header_bytes, _aligned(len(MAGIC) + 8 + len(header_bytes)) + offset
+
+    def _write(self, buffer, header_bytes):
+        """
+        Write this index into a writable buffer of the size given by
+        `_layout`.
+        """
+        target = np.frombuffer(buffer, dtype=np.uint8)
+        prefix = MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes
+        target[:len(prefix)] = np.frombuffer(prefix, dtype=np.uint8)
+        data_start = _aligned(len(prefix))
+        offset = data_start
+        for name in sorted(self.arrays):
+            array = np.ascontiguousarray(self.arrays[name])
+            target[offset:offset + array.nbytes] = array.view(
+                np.uint8).reshape(-1)
+            offset = _aligned(offset + array.nbytes)
+
+    def save(self, path):
+        """
+        Write this index to a file, which is first written to a temporary
+        path and then renamed so that other processes never map a partially
+        written index.
+        """
+        header_bytes, size = self._layout()
+        tmp_path = "%s.tmp.%d" % (path, os.getpid())
+        with open(tmp_path, "w+b") as f:
+            f.truncate(size)
+            buffer = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_WRITE)
+            try:
+                self._write(buffer, header_bytes)
+                buffer.flush()
+            finally:
+                buffer.close()
+        # os.rename can't replace existing files on Windows
+        getattr(os, "replace", os.rename)(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path, genome=None):
+        """
+        Memory-map an index file read-only.
+
+        Parameters
+        ----------
+        path : str
+
+        genome : pyensembl.Genome, optional
+            Genome the index was built from, only needed for custom genomes
+            which haven't been registered with `varcode.register_genome`.
+        """
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header, arrays = _parse_index(buffer)
+        if genome is None and header.get("gtf_genome") is not None:
+            genome = Genome.from_dict(header["gtf_genome"])
+        elif genome is None:
+            genome = genome_from_descriptor(header["genome"])
+        else:
+            genome = infer_genome(genome)
+        index = cls(genome, header, arrays, buffer=buffer)
+        index.path = path
+        return index
+
+    def to_shared_memory(self):
+        """
+        Copy of this index in a `multiprocessing.shared_memory` block (Python
+        3.8 and later). When the copy is pickled, e.g. to pass it to the
+        workers of a process pool, workers attach to the same block
+        instead of copying the arrays. The block is removed when the
+        process which created it exits.
+        """
+        from multiprocessing import shared_memory
+        header_bytes, size = self._layout()
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self._write(block.buf, header_bytes)
+        _created_shared_memory.append(block)
+        return _index_from_shared_memory(block, self.genome)
+
+    def __reduce__(self):
+        if self._shared_memory is not None:
+            return (
+                _attach_shared_memory_index,
+                (self._shared_memory.name, self.genome))
+        elif self.path is not None:
+            return (TranscriptIndex.load, (self.path, self.genome))
+        return (TranscriptIndex, (self.genome, self.header, self.arrays))
+
+    def transcript_sequence(self, row):
+        start, end = self.arrays["cdna_offsets"][row:row + 2]
+        return _unpack_bases(
+            self.arrays["cdna_packed"],
+            self.arrays["cdna_exception_positions"],
+            self.arrays["cdna_exception_bases"],
+            int(start),
+            int(end))
+
+    def protein_sequence(self, row):
+        start, end = self.arrays["protein_offsets"][row:row + 2]
+        return self.arrays["protein_sequences"][start:end].tobytes().decode(
+            "ascii")
+
+    def transcript_ids(self):
+        return [_decode(value) for value in self.arrays["transcript_id"]]
+
+    def gene_ids(self):
+        return [_decode(value) for value in self.arrays["gene_id"]]
+
+    def transcript_by_id(self, transcript_id):
+        row = _find(self.arrays["transcript_id"], transcript_id)
+        if row is None:
+            if not self._fallback_to_genome:
+                self._not_indexed("Transcript", transcript_id)
+            return self.genome.transcript_by_id(transcript_id)
+        if row not in self._transcripts:
+            self._transcripts[row] = IndexedTranscript(self, row)
+        return self._transcripts[row]
+
+    def gene_by_id(self, gene_id):
+        row = _find(self.arrays["gene_id"], gene_id)
+        if row is None:
+            if not self._fallback_to_genome:
+                self._not_indexed("Gene", gene_id)
+            return self.genome.gene_by_id(gene_id)
+        if row not in self._genes:
+            arrays = self.arrays
+            self._genes[row] = Gene(
+                gene_id=gene_id,
+                gene_name=_decode(arrays["gene_name"][row]),
+                contig=self._contigs[arrays["gene_contig"][row]],
+                start=int(arrays["gene_start"][row]),
+                end=int(arrays["gene_end"][row]),
+                strand=_decode(arrays["gene_strand"][row]),
+                biotype=self._biotype(arrays["gene_biotype"][row]),
+                genome=self.genome)
+        return self._genes[row]
+
+    def gene_name_of_gene_id(self, gene_id):
+        row = _find(self.arrays["gene_id"], gene_id)
+        if row is None:
+            if not self._fallback_to_genome:
+                self._not_indexed("Gene", gene_id)
+            return self.genome.gene_name_of_gene_id(gene_id)
+        return _decode(self.arrays["gene_name"][row])
+
+    def canonical_transcript_id(self, gene_id):
+        """
+        ID of the canonical transcript of a gene, see
+        `varcode.effects.transcript_filter.canonical_transcript_id`.
+        """
+        row = _find(self.arrays["gene_id"], gene_id)
+        if row is None:
+            if not self._fallback_to_genome:
+                self._not_indexed("Gene", gene_id)
+            # import here since the effects package imports this module
+            from .effects.transcript_filter import canonical_transcript_id
+            return canonical_transcript_id(self.genome, gene_id)
+        transcript_row = self.arrays["gene_canonical_transcript"][row]
+        if transcript_row < 0:
+            return None
+        return _decode(self.arrays["transcript_id"][transcript_row])
+
+    def exon_by_id(self, exon_id):
+        exon_ids = self.arrays["exon_id"]
+        encoded = exon_id.encode("ascii")
+        rows = []
+        if len(encoded) <= exon_ids.dtype.itemsize:
+            # exons aren't sorted by ID, but are rarely looked up
+            rows = np.flatnonzero(exon_ids == encoded)
+        if len(rows) == 0:
+            if not self._fallback_to_genome:
+                self._not_indexed("Exon", exon_id)
+            return self.genome.exon_by_id(exon_id)
+        transcript_row = np.searchsorted(
+            self.arrays["exon_offsets"], rows[0], side="right") - 1
+        transcript = self.transcript_by_id(
+            _decode(self.arrays["transcript_id"][transcript_row]))
+        return transcript.exons[rows[0] - self.arrays["exon_offsets"][
+            transcript_row]]
+
+    def _rows_at_locus(self, prefix, contig, position, end, strand):
+        """
+        Sorted rows of the transcripts or genes overlapping an interval, or
+        None if the contig wasn't indexed.
+        """
+        contig = normalize_chromosome(contig)
+        if end is None:
+            end = position
+        code = self._contig_codes.get(contig)
+        if code is None:
+            if (self._fallback_to_genome and
+                    self._contig_filter is not None and
+                    contig not in self._contig_filter):
+                return None
+            return np.array([], dtype=np.int64)
+        arrays = self.arrays
+        contig_start, contig_end = \
+            arrays[prefix + "_contig_offsets"][code:code + 2]
+        # features before `first` end before the interval, features
+        # from `last` onward start after it
+        first = contig_start + np.searchsorted(
+            arrays[prefix + "_locus_max_end"][contig_start:contig_end],
+            position,
+            side="left")
+        last = contig_start + np.searchsorted(
+            arrays[prefix + "_locus_start"][contig_start:contig_end],
+            end,
+            side="right")
+        rows = arrays[prefix + "_locus_order"][first:last]
+        rows = rows[arrays[prefix + "_end"][rows] >= position]
+        if strand:
+            rows = rows[
+                arrays[prefix + "_strand"][rows] == strand.encode("ascii")]
+        # rows are ordered by ID
+        return np.sort(rows)
+
+    def transcript_ids_at_locus(self, contig, position, end=None, strand=None):
+        rows = self._rows_at_locus("transcript", contig, position, end, strand)
+        if rows is None:
+            return self.genome.transcript_ids_at_locus(
+                contig, position, end=end, strand=strand)
+        return [_decode(value) for value in self.arrays["transcript_id"][rows]]
+
+    def gene_ids_at_locus(self, contig, position, end=None, strand=None):
+        rows = self._rows_at_locus("gene", contig, position, end, strand)
+        if rows is None:
+            return self.genome.gene_ids_at_locus(
+                contig, position, end=end, strand=strand)
+        return [_decode(value) for value in self.arrays["gene_id"][rows]]
+
+    def gene_names_at_locus(self, contig, position, end=None, strand=None):
+        rows = self._rows_at_locus("gene", contig, position, end, strand)
+        if rows is None:
+            return self.genome.gene_names_at_locus(
+                contig, position, end=end, strand=strand)
+        return sorted(set(
+            _decode(value)
+            for value in self.arrays["gene_name"][rows]
+            if value))
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _parse_index(buffer):
+    """
+    Header and arrays of an index file, the arrays are read-only views of
+    the given buffer.
+    """
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a varcode transcript index")
+    (header_length,) = struct.unpack(
+        "<Q", bytes(buffer[len(MAGIC):len(MAGIC) + 8]))
+    header_end = len(MAGIC) + 8 + header_length
+    header = json.loads(
+        bytes(buffer[len(MAGIC) + 8:header_end]).decode("utf-8"))
+    if header["format_version"] > FORMAT_VERSION:
+        raise ValueError(
+            "Transcript index format version %d isn't supported by this "
+            "version of varcode" % header["format_version"])
+    data_start = _aligned(header_end)
+    arrays = {}
+    for (name, (dtype, shape, offset)) in header.pop("arrays").items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=count,
+            offset=data_start + offset).reshape(shape)
+        # shared memory buffers are writable
+        arrays[name].flags.writeable = False
+    return header, arrays
+
+
+# shared memory blocks created by this process, unlinked when it exits
+_created_shared_memory = []
+
+
+@atexit.register
+def _unlink_shared_memory():
+    while _created_shared_memory:
+        block = _created_shared_memory.pop()
+        try:
+            block.unlink()
+        except OSError:
+            pass
+
+
+def _index_from_shared_memory(block, genome):
+    header, arrays = _parse_index(block.buf)
+    index = TranscriptIndex(genome, header, arrays, buffer=block)
+    index._shared_memory = block
+    return index
+
+
+def _attach_shared_memory_index(name, genome):
+    """
+    Index in an existing shared memory block, used to unpickle indices
+    created with `TranscriptIndex.to_shared_memory`.
+    """
+    from multiprocessing import shared_memory
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 attaching registers the block with the resource
+        # tracker, which is shared with the process that created it when
+        # this is one of its multiprocessing workers
+        block = shared_memory.SharedMemory(name=name)
+    return _index_from_shared_memory(block, genome)
+
+
+def default_transcript_index_path(genome):
+    """
+    Path of the index file in the pyensembl cache directory of a genome.
+    """
+    genome = infer_genome(genome)
+    return os.path.join(
+        genome.download_cache.cache_directory_path, DEFAULT_FILENAME)
+
+
+def build_transcript_index(genome, path=None, contigs=None):
+    """
+    Build the transcript index of a genome and save it to a file.
+
+    Parameters
+    ----------
+    genome : pyensembl.Genome, int or str
+
+    path : str, optional
+        Defaults to a file in the genome's pyensembl cache directory, where
+        `load_transcript_index` finds it.
+
+    contigs : list of str, optional
+        Only index the transcripts and genes on these contigs.
+
+    Returns the path of the index.
+    """
+    genome = infer_genome(genome)
+    if path is None:
+        path = default_transcript_index_path(genome)
+    return TranscriptIndex.from_genome(genome, contigs=contigs).save(path)
+
+
+def load_transcript_index(path_or_genome, genome=None):
+    """
+    Memory-map a transcript index file.
+
+    Parameters
+    ----------
+    path_or_genome : str, int or pyensembl.Genome
+        Path of an index file, or a genome whose index was built in its
+        default location.
+
+    genome : pyensembl.Genome, optional
+        Custom genome the index was built from, if it hasn't been registered
+        with `varcode.register_genome`.
+    """
+    if isinstance(path_or_genome, string_types) and \
+            os.path.exists(path_or_genome):
+        return TranscriptIndex.load(path_or_genome, genome=genome)
+    genome = infer_genome(path_or_genome)
+    return TranscriptIndex.load(
+        default_transcript_index_path(genome), genome=genome)
+
+
+def use_transcript_index(index_or_path, genome=None):
+    """
+    Make variants of the index's genome (and effect prediction for them) look
+    up transcripts and genes in the index instead of the genome's database.
+
+    Parameters
+    ----------
+    index_or_path : TranscriptIndex, str, int or pyensembl.Genome
+        An index, or anything `load_transcript_index` accepts.
+
+    genome : pyensembl.Genome, optional
+        Passed to `load_transcript_index`.
+
+    Returns the index.
+    """
+    if isinstance(index_or_path, TranscriptIndex):
+        index = index_or_path
+    else:
+        index = load_transcript_index(index_or_path, genome=genome)
+    set_genome_annotation(index.genome, index)
+    return index
+
+
+def stop_using_transcript_index(genome):
+    """
+    Query the database of a genome again after `use_transcript_index`.
+    """
+    set_genome_annotation(infer_genome(genome), None)
+
+
+def use_gtf_annotation(
+        gtf_path,
+        transcript_fasta_paths=(),
+        protein_fasta_paths=(),
+        genome=None,
+        reference_name=None,
+        annotation_name=None,
+        annotation_version=None,
+        contigs=None):
+    """
+    Build an index from a local GTF file and its cDNA and protein FASTA
+    files (see `TranscriptIndex.from_gtf`) and use it for the variants of
+    its genome.
+
+    Returns the index, whose `genome` attribute is the genome to create
+    variants with.
+    """
+    return use_transcript_index(TranscriptIndex.from_gtf(
+        gtf_path,
+        transcript_fasta_paths=transcript_fasta_paths,
+        protein_fasta_paths=protein_fasta_paths,
+        genome=genome,
+        reference_name=reference_name,
+        annotation_name=annotation_name,
+        annotation_version=annotation_version,
+        contigs=contigs))
+
+
+def preload(genome, contigs=None):
+    """
+    Load the transcripts and genes which effect prediction uses into memory
+    that worker processes share, and use them for variants of the genome.
+    Call this before starting a process pool so that its workers don't each
+    build their own pyensembl caches and copies of transcript sequences.
+
+    If the genome's index was built with `build_transcript_index` (or the
+    varcode-index command) its file is memory-mapped, otherwise the index is
+    built and copied into a shared memory block. Without
+    `multiprocessing.shared_memory` (before Python 3.8) it's kept in the
+    memory of this process, which forked workers share until it's written.
+
+    Parameters
+    ----------
+    genome : pyensembl.Genome, int or str
+
+    contigs : list of str, optional
+        Only load the transcripts on these contigs when building the index.
+
+    Returns the TranscriptIndex. Workers started with the "spawn" method
+    should pass it to `use_transcript_index`, pickling an index in shared
+    memory or a file only sends its name.
+    """
+    genome = infer_genome(genome)
+    path = default_transcript_index_path(genome)
+    if os.path.exists(path):
+        index = TranscriptIndex.load(path, genome=genome)
+    else:
+        index = TranscriptIndex.from_genome(genome, contigs=contigs)
+        try:
+            index = index.to_shared_memory()
+        except ImportError:
+            pass
+    return use_transcript_index(index)
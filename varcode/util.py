@@ -13,6 +13,8 @@
 # limitations under the License.
 
 from __future__ import print_function, division, absolute_import
+from collections import deque
+import multiprocessing
 import random
 
 from Bio.Seq import reverse_complement
@@ -90,3 +92,29 @@ def random_variants(
     raise ValueError(
         ("Unable to generate %d random variants, "
          "there may be a problem with PyEnsembl") % count)
+
+
+def map_chunks_in_order(function, chunks, n_jobs=1, **kwargs):
+    """
+    Generate `function(chunk, **kwargs)` for each chunk, in the order of the
+    chunks. With more than one job the chunks are processed by a pool of
+    worker processes, which are sent at most two chunks each at a time so
+    that chunks aren't read faster than they're processed.
+    """
+    if n_jobs <= 1:
+        for chunk in chunks:
+            yield function(chunk, **kwargs)
+        return
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(function, (chunk,), kwargs))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -22,7 +22,6 @@ from pyensembl import (
 )
 from pyensembl.locus import normalize_chromosome
 from serializable import Serializable
-from typechecks import require_instance
 
 from .nucleotides import (
     normalize_nucleotide_string,
@@ -30,10 +29,12 @@ from .nucleotides import (
     is_purine
 )
 from .string_helpers import trim_shared_flanking_strings
-from .effects import (
-    predict_variant_effects,
-    predict_variant_effect_on_transcript
+from .genome_registry import (
+    annotation_for_genome,
+    genome_from_key,
+    genome_key,
 )
+from .effects.transcript_filter import normalize_transcript_filter
 
 class Variant(Serializable):
     __slots__ = (
@@ -51,6 +52,7 @@ class Variant(Serializable):
         "original_start",
         "_transcripts",
         "_genes",
+        "_effects",
     )
 
     def __init__(
@@ -95,6 +97,10 @@ class Variant(Serializable):
         # lists of overlapping pyensembl Gene and Transcript objects
         self._genes = self._transcripts = None
 
+        # dictionary mapping each value of raise_on_error to the
+        # EffectCollection predicted for this variant
+        self._effects = None
+
         # user might supply Ensembl release as an integer, reference name,
         # or pyensembl.Genome object
         if isinstance(ensembl, Genome):
@@ -102,7 +108,11 @@ class Variant(Serializable):
         elif isinstance(ensembl, int):
             self.ensembl = cached_release(ensembl)
         elif isinstance(ensembl, str):
-            self.ensembl = genome_for_reference_name(ensembl)
+            # either a key from the genome registry or a reference name
+            genome = genome_from_key(ensembl)
+            if genome is None:
+                genome = genome_for_reference_name(ensembl)
+            self.ensembl = genome
         else:
             raise TypeError(
                 ("Expected ensembl to be an int, string, or pyensembl.Genome "
@@ -193,10 +203,13 @@ class Variant(Serializable):
         """
         Variants are ordered by locus.
         """
-        require_instance(other, Variant, name="variant")
+        if not isinstance(other, Variant):
+            raise TypeError(
+                "Expected variant to be a Variant but got %s : %s" % (
+                    other, type(other)))
         if self.contig == other.contig:
             return self.start < other.start
-        return self.contig < other.contig
+        return chromosome_sort_rank(self.contig) < chromosome_sort_rank(other.contig)
 
     def __eq__(self, other):
         if self is other:
@@ -209,20 +222,57 @@ class Variant(Serializable):
             self.alt == other.alt and
             self.ensembl == other.ensembl)
 
+    def _genome_key_or_genome(self):
+        """
+        Registry key of this variant's genome, falling back on the Genome
+        object itself for custom genomes which haven't been registered.
+        """
+        key = genome_key(self.ensembl)
+        return self.ensembl if key is None else key
+
     def to_dict(self):
         """
         We want the original values (un-normalized) field values while
-        serializing since normalization will happen in __init__.
+        serializing since normalization will happen in __init__. The genome
+        is referred to by its key in the genome registry when it has one.
         """
         return dict(
             contig=self.original_contig,
             start=self.original_start,
             ref=self.original_ref,
             alt=self.original_alt,
-            ensembl=self.ensembl,
+            ensembl=self._genome_key_or_genome(),
             allow_extended_nucleotides=self.allow_extended_nucleotides,
             normalize_contig_name=self.normalize_contig_name)
 
+    def __reduce__(self):
+        """
+        Pickle the already normalized fields along with the genome's registry
+        key, so that unpickling doesn't have to trim or validate the
+        nucleotides again. The original fields are only included when
+        they differ from the normalized ones.
+        """
+        if (self.original_contig == self.contig and
+                self.original_start == self.start and
+                self.original_ref == self.ref and
+                self.original_alt == self.alt):
+            original_fields = None
+        else:
+            original_fields = (
+                self.original_contig,
+                self.original_start,
+                self.original_ref,
+                self.original_alt)
+        return (_restore_variant, (
+            self.contig,
+            self.start,
+            self.ref,
+            self.alt,
+            self._genome_key_or_genome(),
+            self.allow_extended_nucleotides,
+            self.normalize_contig_name,
+            original_fields))
+
     @property
     def trimmed_ref(self):
         """
@@ -291,10 +341,18 @@ class Variant(Serializable):
                 self.ref,
                 self.alt)
 
+    @property
+    def _annotation(self):
+        """
+        Source of transcripts and genes, either the genome or an index of it
+        registered with `varcode.use_transcript_index`.
+        """
+        return annotation_for_genome(self.ensembl)
+
     @property
     def transcripts(self):
         if self._transcripts is None:
-            self._transcripts = self.ensembl.transcripts_at_locus(
+            self._transcripts = self._annotation.transcripts_at_locus(
                 self.contig, self.start, self.end)
         return self._transcripts
 
@@ -323,7 +381,7 @@ class Variant(Serializable):
         Return Gene object for all genes which overlap this variant.
         """
         if self._genes is None:
-            self._genes = self.ensembl.genes_at_locus(
+            self._genes = self._annotation.genes_at_locus(
                 self.contig, self.start, self.end)
         return self._genes
 
@@ -334,7 +392,7 @@ class Variant(Serializable):
         this method is significantly cheaper than calling `Variant.genes()`,
         which has to issue many more queries to construct each Gene object.
         """
-        return self.ensembl.gene_ids_at_locus(
+        return self._annotation.gene_ids_at_locus(
             self.contig, self.start, self.end)
 
     @property
@@ -344,7 +402,7 @@ class Variant(Serializable):
         this method is significantly cheaper than calling `Variant.genes()`,
         which has to issue many more queries to construct each Gene object.
         """
-        return self.ensembl.gene_names_at_locus(
+        return self._annotation.gene_names_at_locus(
             self.contig, self.start, self.end)
 
     @property
@@ -357,11 +415,83 @@ class Variant(Serializable):
             if gene.is_protein_coding
         ]
 
-    def effects(self, raise_on_error=True):
-        return predict_variant_effects(
-            variant=self, raise_on_error=raise_on_error)
+    def effects(
+            self,
+            raise_on_error=True,
+            cache=None,
+            memoize=True,
+            transcript_filter=None):
+        """
+        Parameters
+        ----------
+        raise_on_error : bool, optional
+            If exception is raised while determining effect of variant on a
+            transcript, should it be raised? This default is True, meaning
+            errors result in raised exceptions, otherwise they are only logged.
+
+        cache : EffectCache, optional
+            Persistent cache of previously predicted effects.
+
+        memoize : bool, optional
+            Keep the predicted effects on this Variant so that calling this
+            method again doesn't recompute them. Pass False to avoid holding
+            on to effects when memory is a concern.
+
+        transcript_filter : str or collection of str, optional
+            Only annotate the canonical transcript of each gene ("canonical"),
+            complete protein coding transcripts ("coding"), or the transcripts
+            whose IDs are in the given collection.
+        """
+        # effect prediction imports pandas and Biopython, so it's only
+        # loaded once effects are needed
+        from .effects.effect_prediction import predict_variant_effects
+        key = (raise_on_error, normalize_transcript_filter(transcript_filter))
+        if self._effects is not None and key in self._effects:
+            return self._effects[key]
+        effects = predict_variant_effects(
+            variant=self,
+            raise_on_error=raise_on_error,
+            cache=cache,
+            transcript_filter=transcript_filter)
+        if memoize:
+            if self._effects is None:
+                self._effects = {}
+            self._effects[key] = effects
+        return effects
+
+    def top_effect(self, raise_on_error=True, transcript_filter=None):
+        """
+        Highest priority effect of this variant, identical to
+        `effects().top_priority_effect()` but skips the coding effect
+        prediction for transcripts which can't have the top effect.
+
+        Parameters
+        ----------
+        raise_on_error : bool, optional
+            If exception is raised while determining effect of variant on a
+            transcript, should it be raised?
+
+        transcript_filter : str or collection of str, optional
+            Only consider the canonical transcript of each gene ("canonical"),
+            complete protein coding transcripts ("coding"), or the transcripts
+            whose IDs are in the given collection.
+
+        Returns None if the filter excluded every transcript this variant
+        overlaps.
+        """
+        from .effects.effect_prediction import predict_variant_top_effect
+        key = (raise_on_error, normalize_transcript_filter(transcript_filter))
+        if self._effects is not None and key in self._effects:
+            effects = self._effects[key]
+            return effects.top_priority_effect() if len(effects) else None
+        return predict_variant_top_effect(
+            variant=self,
+            raise_on_error=raise_on_error,
+            transcript_filter=transcript_filter)
 
     def effect_on_transcript(self, transcript):
+        from .effects.effect_prediction import (
+            predict_variant_effect_on_transcript)
         return predict_variant_effect_on_transcript(self, transcript)
 
     @property
@@ -410,9 +540,85 @@ class Variant(Serializable):
         return self.is_snv and is_purine(self.ref) != is_purine(self.alt)
 
 
+def _restore_variant(
+        contig,
+        start,
+        ref,
+        alt,
+        genome,
+        allow_extended_nucleotides,
+        normalize_contig_name,
+        original_fields):
+    """
+    Reconstruct a Variant pickled by `Variant.__reduce__` without running
+    its constructor.
+    """
+    variant = Variant.__new__(Variant)
+    variant._genes = variant._transcripts = variant._effects = None
+    if isinstance(genome, str):
+        key = genome
+        genome = genome_from_key(key)
+        if genome is None:
+            raise ValueError(
+                "Unknown genome '%s', custom genomes must be registered with "
+                "varcode.register_genome before loading variants" % key)
+    variant.ensembl = genome
+    variant.allow_extended_nucleotides = allow_extended_nucleotides
+    variant.normalize_contig_name = normalize_contig_name
+    variant.contig = contig
+    variant.start = start
+    variant.ref = ref
+    variant.alt = alt
+    # insertions are stored as the position before the inserted nucleotides
+    variant.end = start if len(ref) == 0 else start + len(ref) - 1
+    if original_fields is None:
+        original_fields = (contig, start, ref, alt)
+    (variant.original_contig,
+        variant.original_start,
+        variant.original_ref,
+        variant.original_alt) = original_fields
+    return variant
+
+# Natural ordering of chromosome names: numbered chromosomes first in
+# numerical order, then the sex and mitochondrial chromosomes, then any
+# other contig (e.g. unplaced scaffolds) ordered lexicographically.
+_sex_and_mitochondrial_chromosome_ranks = {"X": 0, "Y": 1, "M": 2, "MT": 2}
+
+# cache of rank tuples for every contig name we've seen, prefilled with the
+# common human chromosomes
+_chromosome_rank_cache = {}
+
+def chromosome_sort_rank(contig):
+    """
+    Returns a tuple which orders chromosome names naturally
+    (1, 2, ..., 10, ..., X, Y, MT) rather than lexicographically.
+    """
+    try:
+        return _chromosome_rank_cache[contig]
+    except KeyError:
+        pass
+    contig_str = str(contig)
+    # contig names aren't always normalized, e.g. 'chr1' vs. '1'
+    if contig_str[:3].lower() == "chr":
+        name = contig_str[3:].upper()
+    else:
+        name = contig_str.upper()
+    if name.isdigit():
+        rank = (0, int(name), contig_str)
+    elif name in _sex_and_mitochondrial_chromosome_ranks:
+        rank = (1, _sex_and_mitochondrial_chromosome_ranks[name], contig_str)
+    else:
+        rank = (2, 0, contig_str)
+    _chromosome_rank_cache[contig] = rank
+    return rank
+
+for _contig in [str(i) for i in range(1, 23)] + ["X", "Y", "MT"]:
+    chromosome_sort_rank(_contig)
+del _contig
+
 def variant_ascending_position_sort_key(variant):
     """
     Sort key function used to sort variants in ascending order by
     chromosomal position.
     """
-    return (variant.contig, variant.start)
+    return (chromosome_sort_rank(variant.contig), variant.start)
@@ -15,13 +15,127 @@
 from __future__ import print_function, division, absolute_import
 
 from collections import OrderedDict
+import heapq
 
 import pandas as pd
 from sercol import Collection
 
 from .effects import EffectCollection
+from .effects.effect_cache import ChainedEffectCaches
+from .effects.thread_pool import predict_effects_in_threads
+from .effects.transcript_filter import normalize_transcript_filter
 from .common import memoize
+from .genome_registry import annotation_for_genome
 from .variant import variant_ascending_position_sort_key
+from .variant_metadata import VariantMetadataStore
+
+
+def _sort_unless_already_sorted(variants, sort_key):
+    """
+    Returns the given list of variants ordered by `sort_key`, computing
+    each key only once and skipping the sort entirely if the variants
+    are already in order.
+    """
+    keys = [sort_key(variant) for variant in variants]
+    if all(keys[i] <= keys[i + 1] for i in range(len(keys) - 1)):
+        return variants
+    order = sorted(range(len(variants)), key=keys.__getitem__)
+    return [variants[i] for i in order]
+
+
+def _drop_duplicate_variants(variants, sort_key):
+    """
+    Remove repeated variants, keeping the first occurrence of each.
+
+    When the variants are ordered by chromosomal position any duplicates must
+    be adjacent to each other, so a single pass which only compares variants
+    that share a position suffices. Otherwise fall back on hashing.
+    """
+    if sort_key is not variant_ascending_position_sort_key:
+        return list(OrderedDict.fromkeys(variants))
+    result = []
+    current_position = None
+    same_position_variants = []
+    for variant in variants:
+        position = (variant.contig, variant.start)
+        if position != current_position:
+            current_position = position
+            same_position_variants = []
+        elif variant in same_position_variants:
+            continue
+        same_position_variants.append(variant)
+        result.append(variant)
+    return result
+
+
+def _variants_in_position_order(variant_collection):
+    """
+    Elements of a VariantCollection ordered by chromosomal position, only
+    sorting them if the collection wasn't already sorted that way.
+    """
+    if variant_collection.sort_key is variant_ascending_position_sort_key:
+        return variant_collection.elements
+    return sorted(
+        variant_collection.elements,
+        key=variant_ascending_position_sort_key)
+
+
+def _decorate_with_position(collection_index, variants):
+    for variant_index, variant in enumerate(variants):
+        yield (
+            variant_ascending_position_sort_key(variant),
+            collection_index,
+            variant_index,
+            variant)
+
+
+def merge_sorted_variant_collections(variant_collections):
+    """
+    K-way merge of several VariantCollections by chromosomal position,
+    which avoids building a set of all the variants in each collection.
+
+    Generates a pair for each distinct variant, in ascending position order,
+    whose second element is a list of booleans indicating which of the given
+    collections contain that variant. When a variant occurs in multiple
+    collections the object from the earliest collection is used.
+    """
+    n_collections = len(variant_collections)
+    merged = heapq.merge(*[
+        _decorate_with_position(i, _variants_in_position_order(vc))
+        for (i, vc) in enumerate(variant_collections)
+    ])
+    current_position = None
+    # variants sharing a position are rare, so collect them into
+    # a small dictionary before deduplicating
+    position_group = OrderedDict()
+    for (position, collection_index, _, variant) in merged:
+        if position != current_position:
+            for item in position_group.items():
+                yield item
+            position_group = OrderedDict()
+            current_position = position
+        if variant not in position_group:
+            position_group[variant] = [False] * n_collections
+        position_group[variant][collection_index] = True
+    for item in position_group.items():
+        yield item
+
+
+def _presence_matrix_column_names(variant_collections):
+    """
+    Label each collection by its source, falling back on its position in the
+    argument list for collections without a unique source.
+    """
+    names = []
+    for i, vc in enumerate(variant_collections):
+        if len(vc.sources) == 1:
+            name = list(vc.sources)[0]
+        else:
+            name = i
+        if name in names:
+            name = i
+        names.append(name)
+    return names
 
 
 class VariantCollection(Collection):
@@ -31,7 +145,8 @@ class VariantCollection(Collection):
             distinct=True,
             sort_key=variant_ascending_position_sort_key,
             sources=None,
-            source_to_metadata_dict={}):
+            source_to_metadata_dict={},
+            presorted=False):
         """
         Construct a VariantCollection from a list of Variant records.
 
@@ -52,9 +167,14 @@ class VariantCollection(Collection):
         source_to_metadata_dict : dict
             Dictionary mapping each source name (e.g. VCF path) to a dictionary
             from metadata attributes to values.
+
+        presorted : bool
+            Caller guarantees that the variants are already ordered by
+            `sort_key`, so don't check or sort them. Input which is already
+            sorted (e.g. from a coordinate-sorted VCF) is also detected
+            without this flag, at the cost of one linear pass.
         """
         self.source_to_metadata_dict = source_to_metadata_dict
-        self.variants = variants
         if sources is None:
             sources = set(source_to_metadata_dict.keys())
         if any(source not in sources for source in source_to_metadata_dict.keys()):
@@ -62,12 +182,29 @@ class VariantCollection(Collection):
                 "Mismatch between sources=%s and keys of source_to_metadata_dict=%s" % (
                     sources,
                     set(source_to_metadata_dict.keys())))
+        variants = list(variants)
+        if sort_key is not None and not presorted:
+            variants = _sort_unless_already_sorted(variants, sort_key)
+        if distinct:
+            variants = _drop_duplicate_variants(variants, sort_key)
+        self.variants = variants
+        # Sorting and deduplication were already done above, so only let the
+        # base class store the elements and then record the options
+        # we were actually given.
         Collection.__init__(
             self,
             elements=variants,
-            distinct=distinct,
-            sort_key=sort_key,
+            distinct=False,
+            sort_key=None,
             sources=sources)
+        self.distinct = distinct
+        self.sort_key = sort_key
+        # EffectCollections predicted for this collection, keyed by the
+        # value of raise_on_error
+        self._effects_cache = {}
+        # caches of the collections this one was derived from by filtering
+        # or grouping, whose effects can be subsetted instead of recomputed
+        self._ancestor_effects_caches = []
 
     @property
     def metadata(self):
@@ -80,6 +217,19 @@ class VariantCollection(Collection):
         """
         return self.source_to_metadata_dict[self.source]
 
+    @property
+    def stored_effects(self):
+        """
+        List of the StoredEffects of the VCFs which were loaded with
+        `load_vcf(path, stored_effects=...)`, empty if there are none.
+        """
+        stores = []
+        for metadata in self.source_to_metadata_dict.values():
+            store = getattr(metadata, "stored_effects", None)
+            if store is not None and not any(store is s for s in stores):
+                stores.append(store)
+        return stores
+
     def to_dict(self):
         """
         Since Collection.to_dict() returns a state dictionary with an
@@ -98,14 +248,25 @@ class VariantCollection(Collection):
         same state (including metadata) but possibly different entries.
 
         Warning: metadata is a dictionary keyed by variants. This method
-        leaves that dictionary as-is, which may result in extraneous entries
-        or missing entries.
+        leaves that dictionary as-is (the new collection shares it rather
+        than copying it), which may result in extraneous entries or
+        missing entries.
         """
         kwargs = self.to_dict()
         kwargs["variants"] = new_elements
-        return self.from_dict(kwargs)
+        result = self.from_dict(kwargs)
+        result._ancestor_effects_caches = (
+            [self._effects_cache] + self._ancestor_effects_caches)
+        return result
 
-    def effects(self, raise_on_error=True):
+    def effects(
+            self,
+            raise_on_error=True,
+            cache=None,
+            memoize=True,
+            transcript_filter=None,
+            executor=None,
+            n_threads=None):
         """
         Parameters
         ----------
@@ -114,11 +275,101 @@ class VariantCollection(Collection):
             transcript, should it be raised? This default is True, meaning
             errors result in raised exceptions, otherwise they are only logged.
 
+        cache : EffectCache, optional
+            Persistent cache of previously predicted effects, see
+            `varcode.effects.EffectCache`. Use `cache.hit_rate` to check how
+            many variants were found in it. Effects stored in the VCFs the
+            variants were loaded from (see `stored_effects`) are looked up
+            before the cache.
+
+        memoize : bool, optional
+            Keep the resulting EffectCollection (and the effects of each
+            Variant) so that calling this method again, or on a collection
+            derived from this one by filtering or grouping, doesn't recompute
+            them. Pass False to avoid holding on to effects when memory is
+            a concern.
+
+        transcript_filter : str or collection of str, optional
+            Only annotate the canonical transcript of each gene ("canonical"),
+            complete protein coding transcripts ("coding"), or the transcripts
+            whose IDs are in the given collection. Excluded transcripts are
+            never loaded from the annotation database.
+
+        executor : str, optional
+            "thread" predicts the effects of different variants in a pool of
+            threads, each with its own connection to the annotation database.
+            By default variants are annotated one after the other.
+
+        n_threads : int, optional
+            Size of the thread pool, see
+            `varcode.effects.thread_pool.predict_effects_in_threads`.
+        """
+        if executor not in (None, "serial", "thread"):
+            raise ValueError(
+                "Expected executor to be 'serial' or 'thread', got %s" % (
+                    executor,))
+        key = (raise_on_error, normalize_transcript_filter(transcript_filter))
+        if key in self._effects_cache:
+            return self._effects_cache[key]
+        for ancestor_effects_cache in self._ancestor_effects_caches:
+            if key in ancestor_effects_cache:
+                variants = set(self)
+                result = ancestor_effects_cache[key].filter(
+                    lambda effect: effect.variant in variants)
+                break
+        else:
+            caches = self.stored_effects
+            if cache is not None:
+                caches.append(cache)
+            if len(caches) > 1:
+                cache = ChainedEffectCaches(caches)
+            elif len(caches) == 1:
+                cache = caches[0]
+            effects_kwargs = dict(
+                raise_on_error=raise_on_error,
+                cache=cache,
+                memoize=memoize,
+                transcript_filter=transcript_filter)
+            if executor == "thread":
+                effects_per_variant = predict_effects_in_threads(
+                    list(self), n_threads=n_threads, **effects_kwargs)
+            else:
+                effects_per_variant = [
+                    variant.effects(**effects_kwargs) for variant in self]
+            result = EffectCollection([
+                effect
+                for effects in effects_per_variant
+                for effect in effects
+            ])
+        if memoize:
+            self._effects_cache[key] = result
+        return result
+
+    def top_effects(self, raise_on_error=True, transcript_filter=None):
+        """
+        EffectCollection with the highest priority effect of each variant,
+        see `Variant.top_effect`.
+
+        Parameters
+        ----------
+        raise_on_error : bool, optional
+            If exception is raised while determining effect of variant on a
+            transcript, should it be raised?
+
+        transcript_filter : str or collection of str, optional
+            Only consider the canonical transcript of each gene ("canonical"),
+            complete protein coding transcripts ("coding"), or the transcripts
+            whose IDs are in the given collection. Variants whose
+            overlapping transcripts are all excluded have no top effect.
         """
         return EffectCollection([
             effect
-            for variant in self
-            for effect in variant.effects(raise_on_error=raise_on_error)
+            for effect in (
+                variant.top_effect(
+                    raise_on_error=raise_on_error,
+                    transcript_filter=transcript_filter)
+                for variant in self)
+            if effect is not None
         ])
 
     @memoize
@@ -161,7 +412,8 @@ class VariantCollection(Collection):
             # in case we are combining variants with different Ensembl releases
             # use them all to gather gene names
             gene_names = {
-                variant.ensembl.gene_name_of_gene_id(gene_id)
+                annotation_for_genome(
+                    variant.ensembl).gene_name_of_gene_id(gene_id)
                 for variant in variant_group
             }
             gene_name_str = ", ".join(sorted(gene_names))
@@ -241,21 +493,50 @@ class VariantCollection(Collection):
              source name -> (variant -> (attribute -> value))
 
         Returns dictionary with union of all variants and sources.
+
+        Sources which only occur in one of the given dictionaries share that
+        collection's per-variant metadata dictionary instead of copying it,
+        only sources which occur in multiple collections get merged: into a
+        single VariantMetadataStore if they're all stores, otherwise into a
+        dictionary of dictionaries.
         """
         # three levels of nested dictionaries!
         #   {source name: {variant: {attribute: value}}}
-        combined_dictionary = {}
+        source_to_variant_dicts = OrderedDict()
         for source_to_metadata_dict in dictionaries:
             for source_name, variant_to_metadata_dict in source_to_metadata_dict.items():
-                combined_dictionary.setdefault(source_name, {})
-                combined_source_dict = combined_dictionary[source_name]
+                source_to_variant_dicts.setdefault(source_name, []).append(
+                    variant_to_metadata_dict)
+
+        combined_dictionary = {}
+        for source_name, variant_dicts in source_to_variant_dicts.items():
+            distinct_variant_dicts = []
+            for variant_dict in variant_dicts:
+                if not any(variant_dict is d for d in distinct_variant_dicts):
+                    distinct_variant_dicts.append(variant_dict)
+            if len(distinct_variant_dicts) == 1:
+                combined_dictionary[source_name] = distinct_variant_dicts[0]
+                continue
+            if all(isinstance(d, VariantMetadataStore)
+                   for d in distinct_variant_dicts):
+                combined_dictionary[source_name] = VariantMetadataStore.merge(
+                    distinct_variant_dicts)
+                continue
+            combined_source_dict = {}
+            for variant_to_metadata_dict in distinct_variant_dicts:
                 for variant, metadata_dict in variant_to_metadata_dict.items():
                     combined_source_dict.setdefault(variant, {})
                     combined_source_dict[variant].update(metadata_dict)
+            combined_dictionary[source_name] = combined_source_dict
         return combined_dictionary
 
     @classmethod
-    def _combine_variant_collections(cls, combine_fn, variant_collections, kwargs):
+    def _combine_variant_collections(
+            cls,
+            keep_fn,
+            variant_collections,
+            kwargs,
+            metadata_collections=None):
         """
         Create a single VariantCollection from multiple different collections.
 
@@ -265,20 +546,40 @@ class VariantCollection(Collection):
         cls : class
             Should be VariantCollection
 
-        combine_fn : function
-            Function which takes any number of sets of variants and returns
-            some combination of them (typically union or intersection).
+        keep_fn : function
+            Function which takes a list of booleans (whether a variant is
+            contained in each of the given collections) and returns True
+            if the variant should be kept in the combined collection
+            (e.g. `any` for a union or `all` for an intersection).
 
         variant_collections : tuple of VariantCollection
 
         kwargs : dict
             Optional dictionary of keyword arguments to pass to the initializer
-            for VariantCollection.
+            for VariantCollection. If it contains `presence_matrix=True` then
+            a DataFrame of which input collection contains each variant is
+            also returned.
+
+        metadata_collections : tuple of VariantCollection, optional
+            Collections whose sources and metadata are carried over into the
+            result, defaults to all of `variant_collections`.
         """
-        kwargs["variants"] = combine_fn(*[set(vc) for vc in variant_collections])
+        return_presence_matrix = kwargs.pop("presence_matrix", False)
+        if metadata_collections is None:
+            metadata_collections = variant_collections
+
+        variants = []
+        presence_rows = []
+        for variant, presence in merge_sorted_variant_collections(
+                variant_collections):
+            if keep_fn(presence):
+                variants.append(variant)
+                presence_rows.append(presence)
+
+        kwargs["variants"] = variants
         kwargs["source_to_metadata_dict"] = cls._merge_metadata_dictionaries(
-            [vc.source_to_metadata_dict for vc in variant_collections])
-        kwargs["sources"] = set.union(*([vc.sources for vc in variant_collections]))
+            [vc.source_to_metadata_dict for vc in metadata_collections])
+        kwargs["sources"] = set.union(*([vc.sources for vc in metadata_collections]))
         for key, value in variant_collections[0].to_dict().items():
             # If some optional parameter isn't explicitly specified as an
             # argument to union() or intersection() then use the same value
@@ -290,26 +591,97 @@ class VariantCollection(Collection):
             # to their default values.
             if key not in kwargs:
                 kwargs[key] = value
-        return cls(**kwargs)
+        combined = cls(**kwargs)
+        if not return_presence_matrix:
+            return combined
+        presence_df = pd.DataFrame(
+            presence_rows,
+            index=variants,
+            columns=_presence_matrix_column_names(variant_collections),
+            dtype=bool)
+        # the constructor may have re-sorted or dropped variants
+        return combined, presence_df.loc[combined.elements]
 
     def union(self, *others, **kwargs):
         """
         Returns the union of variants in a several VariantCollection objects.
+
+        If `presence_matrix=True` is passed then also returns a DataFrame with
+        one boolean column per input collection, indicating which of them
+        contains each variant.
         """
         return self._combine_variant_collections(
-            combine_fn=set.union,
+            keep_fn=any,
             variant_collections=(self,) + others,
             kwargs=kwargs)
 
     def intersection(self, *others, **kwargs):
         """
         Returns the intersection of variants in several VariantCollection objects.
+
+        If `presence_matrix=True` is passed then also returns a DataFrame with
+        one boolean column per input collection, indicating which of them
+        contains each variant.
         """
         return self._combine_variant_collections(
-            combine_fn=set.intersection,
+            keep_fn=all,
             variant_collections=(self,) + others,
             kwargs=kwargs)
 
+    def difference(self, *others, **kwargs):
+        """
+        Returns the variants in this VariantCollection which don't occur in
+        any of the other collections. The result only keeps the sources and
+        metadata of this collection.
+
+        If `presence_matrix=True` is passed then also returns a DataFrame with
+        one boolean column per input collection, indicating which of them
+        contains each variant.
+        """
+        return self._combine_variant_collections(
+            keep_fn=lambda presence: presence[0] and not any(presence[1:]),
+            variant_collections=(self,) + others,
+            kwargs=kwargs,
+            metadata_collections=(self,))
+
+    def to_parquet(self, path, row_group_size=None):
+        """
+        Save this collection and the metadata of its sources as a Parquet
+        file, see `varcode.parquet.write_variants_parquet`. Requires pyarrow.
+        """
+        from .parquet import write_variants_parquet
+        write_variants_parquet(self, path, row_group_size=row_group_size)
+
+    @classmethod
+    def from_parquet(cls, path, contigs=None, genome=None, memory_map=True):
+        """
+        Load a collection saved by `to_parquet`, optionally only reading the
+        variants on some contigs. See `varcode.parquet.read_variants_parquet`.
+        """
+        from .parquet import read_variants_parquet
+        return read_variants_parquet(
+            path,
+            contigs=contigs,
+            genome=genome,
+            memory_map=memory_map)
+
+    def to_ndjson(self, path_or_file):
+        """
+        Write this collection and the metadata of its sources as newline
+        delimited JSON, one variant per line. See
+        `varcode.ndjson.write_variants_ndjson`.
+        """
+        from .ndjson import write_variants_ndjson
+        write_variants_ndjson(self, path_or_file)
+
+    @classmethod
+    def from_ndjson(cls, path_or_file):
+        """
+        Load a collection written by `to_ndjson`.
+        """
+        from .ndjson import read_variants_ndjson
+        return read_variants_ndjson(path_or_file)
+
     def to_dataframe(self):
         """Build a DataFrame from this variant collection"""
         def row_from_variant(variant):
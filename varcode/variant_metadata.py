@@ -0,0 +1,446 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Columnar storage for the per-variant metadata (ID, QUAL, FILTER, INFO and
+sample columns) of a VCF, used as the value of a single source in
+`VariantCollection.source_to_metadata_dict`.
+"""
+
+from __future__ import print_function, division, absolute_import
+from array import array
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
+
+from serializable import Serializable
+
+VCF_METADATA_FIELDS = (
+    "id",
+    "qual",
+    "filter",
+    "info",
+    "sample_info",
+    "alt_allele_index",
+)
+
+
+class VariantMetadataView(MutableMapping):
+    """
+    Dictionary view of the metadata of one variant, with the keys 'id',
+    'qual', 'filter', 'info', 'sample_info' and 'alt_allele_index', and any
+    other keys which were added to it.
+
+    Assigning a field only changes it for this variant, even though the
+    alternate alleles of a VCF record share its fields. The parsed INFO and
+    sample dictionaries are shared by the alleles of a record and can be
+    modified in place, but FILTER lists are copies, so changing a variant's
+    FILTER takes an assignment.
+    """
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, field):
+        store = self.store
+        row = self.row
+        if field == "alt_allele_index":
+            return store._alt_allele_indices[row]
+        record = store._record_indices[row]
+        if field == "id":
+            return store._ids[record]
+        elif field == "qual":
+            qual = store._quals[record]
+            # missing QUAL values are stored as NaN
+            return None if qual != qual else qual
+        elif field == "filter":
+            value = store._filter_values[store._filter_codes[record]]
+            return None if value is None else list(value)
+        elif field == "info":
+            return store._info(record)
+        elif field == "sample_info":
+            return store._sample_info(record)
+        extra_fields = store._extra_fields.get(row)
+        if extra_fields is None:
+            raise KeyError(field)
+        return extra_fields[field]
+
+    def __setitem__(self, field, value):
+        self.store._set_field(self.row, field, value)
+
+    def __delitem__(self, field):
+        if field in VCF_METADATA_FIELDS:
+            raise TypeError(
+                "Can't delete the '%s' field of VCF metadata" % field)
+        extra_fields = self.store._extra_fields.get(self.row)
+        if extra_fields is None:
+            raise KeyError(field)
+        del extra_fields[field]
+        if not extra_fields:
+            del self.store._extra_fields[self.row]
+
+    def __iter__(self):
+        for field in VCF_METADATA_FIELDS:
+            yield field
+        for field in self.store._extra_fields.get(self.row, ()):
+            yield field
+
+    def __len__(self):
+        return len(VCF_METADATA_FIELDS) + len(
+            self.store._extra_fields.get(self.row, ()))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class VariantMetadataStore(Serializable, Mapping):
+    """
+    Mapping from Variant objects to their VCF metadata which keeps each field
+    in its own column instead of allocating a dictionary per variant.
+
+    Fields of a VCF record (ID, QUAL, FILTER, INFO, samples) are stored once
+    per record and shared by all of its alternate alleles. FILTER values are
+    encoded as integer codes and QUAL as a float array. INFO and per-sample
+    columns can be kept as unparsed strings along with a parser, in which case
+    each record is only parsed the first time its metadata is accessed.
+
+    Looking up a variant returns a `VariantMetadataView`, so existing code
+    such as `collection.metadata[variant]['qual']` keeps working. Collections
+    derived from each other (e.g. by filtering) share the same store.
+    """
+
+    def __init__(
+            self,
+            variants=[],
+            record_indices=[],
+            alt_allele_indices=[],
+            ids=[],
+            quals=[],
+            filters=[],
+            info=[],
+            sample_info=[],
+            extra_fields=[],
+            info_parser=None,
+            sample_info_parser=None):
+        """
+        Parameters
+        ----------
+        variants : list of Variant
+            One entry per alternate allele.
+
+        record_indices : list of int
+            Index of the VCF record each variant came from.
+
+        alt_allele_indices : list of int
+            Which of its record's alternate alleles each variant represents.
+
+        ids, quals, filters : list
+            Parsed ID, QUAL and FILTER fields of each VCF record.
+
+        info, sample_info : list
+            Parsed INFO and per-sample fields of each VCF record.
+
+        extra_fields : list of (int, dict) pairs
+            Fields other than the VCF fields which were added to the metadata
+            of the variant at each index.
+
+        info_parser : callable, optional
+            Function used to parse INFO strings added with `add_record`.
+
+        sample_info_parser : callable, optional
+            Function which takes a list of per-sample strings and a FORMAT
+            string, used to parse sample columns added with `add_record`.
+        """
+        self.info_parser = info_parser
+        self.sample_info_parser = sample_info_parser
+        # StoredEffects of the variants when they were loaded with the effects
+        # stored in an annotated VCF, which aren't serialized
+        self.stored_effects = None
+
+        self._variants = []
+        self._variant_to_row = {}
+        self._record_indices = array("l")
+        self._alt_allele_indices = array("l")
+        # row -> fields added to the metadata of a variant
+        self._extra_fields = {}
+
+        self._ids = []
+        # number of variants of each record, whose fields are copied when
+        # they're assigned for one of several variants
+        self._record_variant_counts = array("l")
+        self._quals = array("d")
+        self._filter_values = []
+        self._filter_value_to_code = {}
+        self._filter_codes = array("l")
+        self._info_column = []
+        self._info_parsed = bytearray()
+        self._sample_info_column = []
+        self._sample_info_parsed = bytearray()
+
+        for (id_, qual, filter_, record_info, record_sample_info) in zip(
+                ids, quals, filters, info, sample_info):
+            self._append_record(
+                id_, qual, filter_,
+                record_info, True,
+                record_sample_info, True)
+
+        for (variant, record_index, alt_allele_index) in zip(
+                variants, record_indices, alt_allele_indices):
+            self.add_variant(variant, record_index, alt_allele_index)
+
+        for (row, fields) in extra_fields:
+            self._extra_fields[row] = dict(fields)
+
+    def _filter_code(self, filter_):
+        filter_value = None if filter_ is None else tuple(filter_)
+        code = self._filter_value_to_code.get(filter_value)
+        if code is None:
+            code = len(self._filter_values)
+            self._filter_values.append(filter_value)
+            self._filter_value_to_code[filter_value] = code
+        return code
+
+    def _append_record(
+            self,
+            id_,
+            qual,
+            filter_,
+            info,
+            info_parsed,
+            sample_info,
+            sample_info_parsed):
+        record_index = len(self._ids)
+        self._ids.append(id_)
+        self._record_variant_counts.append(0)
+        self._quals.append(float("nan") if qual is None else qual)
+        self._filter_codes.append(self._filter_code(filter_))
+        self._info_column.append(info)
+        self._info_parsed.append(info_parsed)
+        self._sample_info_column.append(sample_info)
+        self._sample_info_parsed.append(sample_info_parsed)
+        return record_index
+
+    def add_record(
+            self,
+            id_,
+            qual,
+            filter_,
+            info_string=None,
+            sample_info_strings=None,
+            format_string=None):
+        """
+        Add the shared fields of a VCF record, with its INFO and sample columns
+        left unparsed until they're first accessed. Returns the index of
+        the record to use with `add_variant`.
+        """
+        if sample_info_strings is None:
+            sample_info = None
+        else:
+            sample_info = (sample_info_strings, format_string)
+        return self._append_record(
+            id_, qual, filter_,
+            info_string, info_string is None or self.info_parser is None,
+            sample_info, sample_info is None or self.sample_info_parser is None)
+
+    def add_variant(self, variant, record_index, alt_allele_index):
+        """
+        Associate a variant with one of the records in this store. If the
+        variant was already added then its previous metadata is replaced.
+        """
+        row = self._variant_to_row.get(variant)
+        if row is None:
+            self._variant_to_row[variant] = len(self._variants)
+            self._variants.append(variant)
+            self._record_indices.append(record_index)
+            self._alt_allele_indices.append(alt_allele_index)
+        else:
+            self._record_variant_counts[self._record_indices[row]] -= 1
+            self._variants[row] = variant
+            self._record_indices[row] = record_index
+            self._alt_allele_indices[row] = alt_allele_index
+            self._extra_fields.pop(row, None)
+        self._record_variant_counts[record_index] += 1
+
+    def _own_record(self, row):
+        """
+        Index of a record which only the variant of the given row uses, made
+        by copying its record if other variants share it.
+        """
+        record_index = self._record_indices[row]
+        if self._record_variant_counts[record_index] == 1:
+            return record_index
+        qual = self._quals[record_index]
+        filter_value = self._filter_values[self._filter_codes[record_index]]
+        # the copy shares the parsed INFO and sample fields
+        copy_index = self._append_record(
+            self._ids[record_index],
+            None if qual != qual else qual,
+            filter_value,
+            self._info(record_index), True,
+            self._sample_info(record_index), True)
+        self._record_variant_counts[record_index] -= 1
+        self._record_variant_counts[copy_index] += 1
+        self._record_indices[row] = copy_index
+        return copy_index
+
+    def _set_field(self, row, field, value):
+        if field == "alt_allele_index":
+            self._alt_allele_indices[row] = value
+            return
+        elif field not in VCF_METADATA_FIELDS:
+            self._extra_fields.setdefault(row, {})[field] = value
+            return
+        record_index = self._own_record(row)
+        if field == "id":
+            self._ids[record_index] = value
+        elif field == "qual":
+            self._quals[record_index] = (
+                float("nan") if value is None else value)
+        elif field == "filter":
+            self._filter_codes[record_index] = self._filter_code(value)
+        elif field == "info":
+            self._info_column[record_index] = value
+            self._info_parsed[record_index] = True
+        else:
+            self._sample_info_column[record_index] = value
+            self._sample_info_parsed[record_index] = True
+
+    @classmethod
+    def merge(cls, stores):
+        """
+        Store with the metadata of all variants in the given stores, where
+        stores later in the list take precedence for variants which several
+        of them contain. The stored effects of the stores are kept if they
+        all have the same (or only one of them has any).
+        """
+        merged = cls(
+            info_parser=stores[0].info_parser,
+            sample_info_parser=stores[0].sample_info_parser)
+        for store in stores:
+            # records of stores with other parsers get parsed first
+            same_info_parser = store.info_parser is merged.info_parser
+            same_sample_info_parser = (
+                store.sample_info_parser is merged.sample_info_parser)
+            record_offset = len(merged._ids)
+            for record_index in range(len(store._ids)):
+                qual = store._quals[record_index]
+                if same_info_parser:
+                    info = store._info_column[record_index]
+                    info_parsed = store._info_parsed[record_index]
+                else:
+                    info = store._info(record_index)
+                    info_parsed = True
+                if same_sample_info_parser:
+                    sample_info = store._sample_info_column[record_index]
+                    sample_info_parsed = store._sample_info_parsed[record_index]
+                else:
+                    sample_info = store._sample_info(record_index)
+                    sample_info_parsed = True
+                merged._append_record(
+                    store._ids[record_index],
+                    None if qual != qual else qual,
+                    store._filter_values[store._filter_codes[record_index]],
+                    info, info_parsed,
+                    sample_info, sample_info_parsed)
+            for (row, variant) in enumerate(store._variants):
+                merged.add_variant(
+                    variant,
+                    record_offset + store._record_indices[row],
+                    store._alt_allele_indices[row])
+                if row in store._extra_fields:
+                    merged._extra_fields[merged._variant_to_row[variant]] = \
+                        dict(store._extra_fields[row])
+        stored_effects = [
+            store.stored_effects
+            for store in stores
+            if store.stored_effects is not None
+        ]
+        if stored_effects and all(
+                s is stored_effects[0] for s in stored_effects):
+            merged.stored_effects = stored_effects[0]
+        return merged
+
+    def _info(self, record_index):
+        if not self._info_parsed[record_index]:
+            self._info_column[record_index] = self.info_parser(
+                self._info_column[record_index])
+            self._info_parsed[record_index] = True
+        return self._info_column[record_index]
+
+    def _sample_info(self, record_index):
+        if not self._sample_info_parsed[record_index]:
+            (sample_info_strings, format_string) = \
+                self._sample_info_column[record_index]
+            self._sample_info_column[record_index] = self.sample_info_parser(
+                list(sample_info_strings), format_string)
+            self._sample_info_parsed[record_index] = True
+        return self._sample_info_column[record_index]
+
+    def __getitem__(self, variant):
+        return VariantMetadataView(self, self._variant_to_row[variant])
+
+    def __contains__(self, variant):
+        return variant in self._variant_to_row
+
+    def __iter__(self):
+        return iter(self._variant_to_row)
+
+    def __len__(self):
+        return len(self._variant_to_row)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Mapping):
+            return False
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    __hash__ = None
+
+    def __str__(self):
+        return "<%s with %d variants>" % (self.__class__.__name__, len(self))
+
+    def __repr__(self):
+        return str(self)
+
+    def to_dict(self):
+        """
+        Parses any remaining INFO and sample columns, since the parsers
+        typically can't be serialized.
+        """
+        n_records = len(self._ids)
+        return dict(
+            variants=list(self._variants),
+            record_indices=list(self._record_indices),
+            alt_allele_indices=list(self._alt_allele_indices),
+            ids=list(self._ids),
+            quals=[None if q != q else q for q in self._quals],
+            filters=[
+                None if value is None else list(value)
+                for value in (
+                    self._filter_values[code] for code in self._filter_codes)
+            ],
+            info=[self._info(i) for i in range(n_records)],
+            sample_info=[self._sample_info(i) for i in range(n_records)],
+            extra_fields=[
+                (row, dict(fields))
+                for (row, fields) in sorted(self._extra_fields.items())
+            ])
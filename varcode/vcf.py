@@ -29,6 +29,7 @@ import vcf as pyvcf
 from .reference import infer_genome
 from .variant import Variant
 from .variant_collection import VariantCollection
+from .variant_metadata import VariantMetadataStore
 
 
 logger = logging.getLogger(__name__)
@@ -42,7 +43,9 @@ def load_vcf(
         allow_extended_nucleotides=False,
         include_info=True,
         chunk_size=10 ** 5,
-        max_variants=None):
+        max_variants=None,
+        stored_effects=None,
+        check_stored_effects=None):
     """
     Load reference name and Variant objects from the given VCF filename.
 
@@ -86,6 +89,19 @@ def load_vcf(
 
     max_variants : int, optional
         If specified, return only the first max_variants variants.
+
+    stored_effects : {True, str, AnnotationLayout}, optional
+        Keep the effects stored in an INFO field of the VCF, which are then
+        used by `VariantCollection.effects` instead of predicting the
+        effects of each variant again. True for the field written by
+        `annotate_vcf`, otherwise the key of an INFO field or its layout.
+        Stored effects are only decoded once they're needed, and in the
+        order of the INFO field rather than the order of prediction.
+
+    check_stored_effects : int, optional
+        Predict the effects of this many randomly chosen variants, and raise
+        a ValueError if they differ from the stored effects (see
+        `varcode.check_stored_effects`).
     """
 
     require_string(path, "Path or URL to VCF")
@@ -117,12 +133,68 @@ def load_vcf(
                 allow_extended_nucleotides=allow_extended_nucleotides,
                 include_info=include_info,
                 chunk_size=chunk_size,
-                max_variants=max_variants)
+                max_variants=max_variants,
+                stored_effects=stored_effects,
+                check_stored_effects=check_stored_effects)
         finally:
             logger.info("Removing temporary file: %s", filename)
             os.unlink(filename)
 
-    # Loading a local file.
+    return _load_local_vcf(
+        path,
+        genome=genome,
+        reference_vcf_key=reference_vcf_key,
+        only_passing=only_passing,
+        allow_extended_nucleotides=allow_extended_nucleotides,
+        include_info=include_info,
+        chunk_size=chunk_size,
+        max_variants=max_variants,
+        stored_effects=stored_effects,
+        check_stored_effects=check_stored_effects)
+
+def _load_local_vcf(
+        path,
+        genome,
+        reference_vcf_key,
+        only_passing,
+        allow_extended_nucleotides,
+        include_info,
+        chunk_size,
+        max_variants,
+        stored_effects=None,
+        check_stored_effects=None):
+    """
+    Implementation of `load_vcf` for local files.
+    """
+    (df_iterator, builder) = _open_local_vcf(
+        path,
+        genome=genome,
+        reference_vcf_key=reference_vcf_key,
+        only_passing=only_passing,
+        allow_extended_nucleotides=allow_extended_nucleotides,
+        include_info=include_info,
+        chunk_size=chunk_size,
+        max_variants=max_variants,
+        stored_effects=stored_effects)
+    for chunk in df_iterator:
+        if not builder.add_dataframe(chunk):
+            break
+    return _finish_local_vcf(builder, check_stored_effects)
+
+def _open_local_vcf(
+        path,
+        genome,
+        reference_vcf_key,
+        only_passing,
+        allow_extended_nucleotides,
+        include_info,
+        chunk_size,
+        max_variants,
+        stored_effects=None):
+    """
+    Parse the header of a local VCF, returns the iterator of dataframe
+    chunks of its records and the _VariantCollectionBuilder to add them to.
+    """
     # The file will be opened twice: first to parse the header with pyvcf, then
     # by pandas to read the data.
 
@@ -135,37 +207,131 @@ def load_vcf(
         handle.vcf_reader,
         reference_vcf_key)
 
+    if stored_effects is not None:
+        from .vcf_annotation import stored_effects_for_vcf
+        stored_effects = stored_effects_for_vcf(
+            handle.vcf_reader.infos, stored_effects)
+
     df_iterator = read_vcf_into_dataframe(
         path,
-        include_info=include_info,
+        include_info=include_info or stored_effects is not None,
         sample_names=handle.vcf_reader.samples if include_info else None,
         chunk_size=chunk_size)
 
-    if include_info:
-        def sample_info_parser(unparsed_sample_info_strings, format_string):
-            """
-            Given a format string like "GT:AD:ADP:DP:FS"
-            and a list of sample info strings where each entry is like
-            "0/1:3,22:T=3,G=22:25:33", return a dict that maps:
-            sample name -> field name -> value. Uses pyvcf to parse the fields.
-            """
-            return pyvcf_calls_to_sample_info_list(
-                handle.vcf_reader._parse_samples(
-                    unparsed_sample_info_strings, format_string, None))
-    else:
-        sample_info_parser = None
-
-    return dataframes_to_variant_collection(
-        df_iterator,
-        source_path=path,
-        info_parser=handle.vcf_reader._parse_info if include_info else None,
+    builder = _VariantCollectionBuilder(
+        path,
         only_passing=only_passing,
         max_variants=max_variants,
-        sample_names=handle.vcf_reader.samples if include_info else None,
-        sample_info_parser=sample_info_parser,
+        stored_effects=stored_effects,
         variant_kwargs={
             'ensembl': genome,
-            'allow_extended_nucleotides': allow_extended_nucleotides})
+            'allow_extended_nucleotides': allow_extended_nucleotides},
+        **_metadata_parsers(handle.vcf_reader, include_info))
+    return (df_iterator, builder)
+
+def _finish_local_vcf(builder, check_stored_effects=None):
+    """
+    VariantCollection of a builder from `_open_local_vcf`, after comparing
+    a sample of its stored effects to predicted ones if requested.
+    """
+    variants = builder.variant_collection()
+    stored_effects = builder.stored_effects
+    if stored_effects is not None and check_stored_effects:
+        from .vcf_annotation import check_stored_effects as check
+        mismatches = check(variants, sample_size=check_stored_effects)
+        if mismatches:
+            (variant, stored, predicted) = mismatches[0]
+            raise ValueError(
+                "Stored effects of %d sampled variants in %s differ from "
+                "their predicted effects, e.g. %s has %s stored but %s "
+                "predicted" % (
+                    len(mismatches),
+                    builder.source_path,
+                    variant,
+                    stored,
+                    predicted))
+    return variants
+
+def _metadata_parsers(vcf_reader, include_info):
+    """
+    Keyword arguments of `dataframes_to_variant_collection` which parse the
+    INFO and per-sample columns with pyvcf, if they're included.
+    """
+    if not include_info:
+        return {}
+
+    def sample_info_parser(unparsed_sample_info_strings, format_string):
+        """
+        Given a format string like "GT:AD:ADP:DP:FS"
+        and a list of sample info strings where each entry is like
+        "0/1:3,22:T=3,G=22:25:33", return a dict that maps:
+        sample name -> field name -> value. Uses pyvcf to parse the fields.
+        """
+        return pyvcf_calls_to_sample_info_list(
+            vcf_reader._parse_samples(
+                unparsed_sample_info_strings, format_string, None))
+
+    return dict(
+        info_parser=vcf_reader._parse_info,
+        sample_names=vcf_reader.samples,
+        sample_info_parser=sample_info_parser)
+
+def iter_vcf_chunks(
+        path,
+        genome=None,
+        reference_vcf_key="reference",
+        only_passing=True,
+        allow_extended_nucleotides=False,
+        include_info=False,
+        chunk_size=10 ** 4):
+    """
+    Generate a VariantCollection for each chunk of records in a local VCF
+    file, so that files of any size can be processed in constant memory.
+
+    Parameters
+    ----------
+    path : str
+        Path to VCF (*.vcf) or compressed VCF (*.vcf.gz).
+
+    genome, reference_vcf_key, only_passing, allow_extended_nucleotides
+        See `load_vcf`.
+
+    include_info : boolean, default False
+        Whether to keep the INFO and per-sample columns as metadata of each
+        collection.
+
+    chunk_size : int, optional
+        Number of records in each chunk. Records which are filtered out or
+        have no alternate alleles don't yield variants, so chunks can be
+        smaller (chunks without any variants are skipped).
+    """
+    require_string(path, "Path to VCF")
+    parsed_path = parse_url_or_path(path)
+    if parsed_path.scheme and parsed_path.scheme.lower() != "file":
+        raise ValueError(
+            "Only local VCF files can be read in chunks, got %s" % path)
+    handle = PyVCFReaderFromPathOrURL(path)
+    handle.close()
+    genome = infer_genome_from_vcf(
+        genome,
+        handle.vcf_reader,
+        reference_vcf_key)
+    metadata_parsers = _metadata_parsers(handle.vcf_reader, include_info)
+    for df in read_vcf_into_dataframe(
+            path,
+            include_info=include_info,
+            sample_names=handle.vcf_reader.samples if include_info else None,
+            chunk_size=chunk_size):
+        variants = dataframes_to_variant_collection(
+            [df],
+            source_path=path,
+            only_passing=only_passing,
+            variant_kwargs={
+                'ensembl': genome,
+                'allow_extended_nucleotides': allow_extended_nucleotides},
+            **metadata_parsers)
+        if len(variants) > 0:
+            yield variants
 
 def load_vcf_fast(*args, **kwargs):
     """
@@ -193,6 +359,7 @@ def dataframes_to_variant_collection(
         max_variants=None,
         sample_names=None,
         sample_info_parser=None,
+        stored_effects=None,
         variant_kwargs={},
         variant_collection_kwargs={}):
     """
@@ -207,8 +374,8 @@ def dataframes_to_variant_collection(
     dataframes
         Iterable of dataframes (e.g. a generator). Expected columns are:
             ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER"]
-        and 'INFO' if `info_parser` is not Null. Columns must be in this
-        order.
+        and 'INFO' if `info_parser` or `stored_effects` is not Null. Columns
+        must be in this order.
 
     source_path : str
         Path of VCF file from which DataFrame chunks were generated.
@@ -231,83 +398,146 @@ def dataframes_to_variant_collection(
     sample_info_parser : string list * string -> dict, optional
         Callable to parse per-sample info columns.
 
+    stored_effects : varcode.vcf_annotation.StoredEffects, optional
+        Keeps the effects stored in the INFO column of each variant.
+
     variant_kwargs : dict, optional
         Additional keyword paramters to pass to Variant.__init__
 
     variant_collection_kwargs : dict, optional
         Additional keyword parameters to pass to VariantCollection.__init__.
     """
+    builder = _VariantCollectionBuilder(
+        source_path,
+        info_parser=info_parser,
+        only_passing=only_passing,
+        max_variants=max_variants,
+        sample_names=sample_names,
+        sample_info_parser=sample_info_parser,
+        stored_effects=stored_effects,
+        variant_kwargs=variant_kwargs,
+        variant_collection_kwargs=variant_collection_kwargs)
+    for chunk in dataframes:
+        if not builder.add_dataframe(chunk):
+            break
+    return builder.variant_collection()
 
-    expected_columns = (
-        ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER"] +
-        (["INFO"] if info_parser else []))
-
-    if info_parser and sample_names:
-        if sample_info_parser is None:
-            raise TypeError(
-                "Must specify sample_info_parser if specifying sample_names")
-        expected_columns.append("FORMAT")
-        expected_columns.extend(sample_names)
-
-    variants = []
-    metadata = {}
-    try:
-        for chunk in dataframes:
-            assert chunk.columns.tolist() == expected_columns,\
-                "dataframe columns (%s) do not match expected columns (%s)" % (
-                    chunk.columns, expected_columns)
-
-            for tpl in chunk.itertuples():
-                (i, chrom, pos, id_, ref, alts, qual, flter) = tpl[:8]
-                if flter == ".":
-                    flter = None
-                elif flter == "PASS":
-                    flter = []
-                elif only_passing:
-                    continue
-                else:
-                    flter = flter.split(';')
-                if id_ == ".":
-                    id_ = None
-                qual = float(qual) if qual != "." else None
-                alt_num = 0
-                info = sample_info = None
-                for alt in alts.split(","):
-                    if alt != ".":
-                        if info_parser is not None and info is None:
-                            info = info_parser(tpl[8])  # INFO column
-                            if sample_names:
-                                # Sample name -> field -> value dict.
-                                sample_info = sample_info_parser(
-                                    list(tpl[10:]),  # sample info columns
-                                    tpl[9],    # FORMAT column
-                                )
-
-                        variant = Variant(
-                            chrom,
-                            int(pos),  # want a Python int not numpy.int64
-                            ref,
-                            alt,
-                            **variant_kwargs)
-                        variants.append(variant)
-                        metadata[variant] = {
-                            'id': id_,
-                            'qual': qual,
-                            'filter': flter,
-                            'info': info,
-                            'sample_info': sample_info,
-                            'alt_allele_index': alt_num,
-                        }
-                        if max_variants and len(variants) > max_variants:
-                            raise StopIteration
-                    alt_num += 1
-    except StopIteration:
-        pass
-
-    return VariantCollection(
-        variants=variants,
-        source_to_metadata_dict={source_path: metadata},
-        **variant_collection_kwargs)
+
+class _VariantCollectionBuilder(object):
+    """
+    Builds the VariantCollection of `dataframes_to_variant_collection` one
+    dataframe at a time, so that the caller decides when (and in which
+    thread) each chunk is parsed.
+    """
+    def __init__(
+            self,
+            source_path,
+            info_parser=None,
+            only_passing=True,
+            max_variants=None,
+            sample_names=None,
+            sample_info_parser=None,
+            stored_effects=None,
+            variant_kwargs={},
+            variant_collection_kwargs={}):
+        self.expected_columns = (
+            ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER"] +
+            (["INFO"] if info_parser or stored_effects is not None else []))
+
+        if info_parser and sample_names:
+            if sample_info_parser is None:
+                raise TypeError(
+                    "Must specify sample_info_parser if specifying "
+                    "sample_names")
+            self.expected_columns.append("FORMAT")
+            self.expected_columns.extend(sample_names)
+
+        self.source_path = source_path
+        self.info_parser = info_parser
+        self.only_passing = only_passing
+        self.max_variants = max_variants
+        self.sample_names = sample_names
+        self.stored_effects = stored_effects
+        self.variant_kwargs = variant_kwargs
+        self.variant_collection_kwargs = variant_collection_kwargs
+        self.variants = []
+        self.metadata = VariantMetadataStore(
+            info_parser=info_parser,
+            sample_info_parser=sample_info_parser)
+
+    def add_dataframe(self, chunk):
+        """
+        Add the variants of a dataframe, returns False once `max_variants`
+        is reached and no further dataframes are needed.
+        """
+        assert chunk.columns.tolist() == self.expected_columns,\
+            "dataframe columns (%s) do not match expected columns (%s)" % (
+                chunk.columns, self.expected_columns)
+
+        variants = self.variants
+        metadata = self.metadata
+        stored_effects = self.stored_effects
+        max_variants = self.max_variants
+        for tpl in chunk.itertuples():
+            (i, chrom, pos, id_, ref, alts, qual, flter) = tpl[:8]
+            if flter == ".":
+                flter = None
+            elif flter == "PASS":
+                flter = []
+            elif self.only_passing:
+                continue
+            else:
+                flter = flter.split(';')
+            if id_ == ".":
+                id_ = None
+            qual = float(qual) if qual != "." else None
+            alt_num = 0
+            record_index = None
+            for alt in alts.split(","):
+                if alt != ".":
+                    if record_index is None:
+                        # INFO and sample columns are kept as strings
+                        # until their metadata is first accessed
+                        info_string = None
+                        sample_info_strings = format_string = None
+                        if self.info_parser is not None:
+                            info_string = tpl[8]  # INFO column
+                            if self.sample_names:
+                                # sample info columns
+                                sample_info_strings = tpl[10:]
+                                format_string = tpl[9]  # FORMAT column
+                        record_index = metadata.add_record(
+                            id_,
+                            qual,
+                            flter,
+                            info_string=info_string,
+                            sample_info_strings=sample_info_strings,
+                            format_string=format_string)
+
+                    variant = Variant(
+                        chrom,
+                        int(pos),  # want a Python int not numpy.int64
+                        ref,
+                        alt,
+                        **self.variant_kwargs)
+                    variants.append(variant)
+                    metadata.add_variant(variant, record_index, alt_num)
+                    if stored_effects is not None:
+                        stored_effects.add(
+                            variant,
+                            tpl[8],  # INFO column
+                            allele=alt if "," in alts else None)
+                    if max_variants and len(variants) > max_variants:
+                        return False
+                alt_num += 1
+        return True
+
+    def variant_collection(self):
+        self.metadata.stored_effects = self.stored_effects
+        return VariantCollection(
+            variants=self.variants,
+            source_to_metadata_dict={self.source_path: self.metadata},
+            **self.variant_collection_kwargs)
 
 
 def read_vcf_into_dataframe(
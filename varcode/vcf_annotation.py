@@ -0,0 +1,772 @@
+# Copyright (c) 2016. Mount Sinai School of Medicine
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Write VCF files with the effects of their variants added to the INFO column,
+in the style of the ANN field of SnpEff and the CSQ field of VEP: one
+comma separated entry per effect, whose '|' separated fields are listed in
+the description of the field's header line.
+
+Records are read, annotated and written one chunk at a time, so memory use
+doesn't grow with the size of the file.
+
+Annotated VCFs can be loaded with `load_vcf(path, stored_effects=True)`, in
+which case the effects of each variant are decoded from its INFO field the
+first time they're needed instead of being predicted again (see
+`StoredEffects` and `check_stored_effects`).
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import gzip
+import io
+import json
+import logging
+import random
+import re
+import sys
+import threading
+
+from six.moves.urllib.parse import unquote
+
+from .effects import predict_variant_effects
+from .effects.effect_cache import decode_effect, encode_effect
+from .effects.effect_classes import Failure
+from .effects.effect_ordering import effect_sort_key
+from .effects.transcript_filter import normalize_transcript_filter
+from .reference import infer_genome
+from .util import map_chunks_in_order
+from .variant import Variant
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INFO_FIELD = "VARCODE"
+
+# fields of each effect in the INFO field, separated by '|'
+EFFECT_FIELDS = (
+    "Allele",
+    "Effect",
+    "Gene_Name",
+    "Gene_ID",
+    "Transcript_ID",
+    "Transcript_Name",
+    "Transcript_Biotype",
+    "Description",
+    # JSON of `varcode.effects.effect_cache.encode_effect`, from which the
+    # effect can be reconstructed without predicting it
+    "Encoded",
+)
+
+# characters which can't appear in INFO values, or in the fields of an
+# effect, and their percent encoding (as in VCF 4.3)
+_ESCAPED_CHARACTERS = {
+    "%": "%25",
+    ":": "%3A",
+    ";": "%3B",
+    "=": "%3D",
+    ",": "%2C",
+    "|": "%7C",
+    " ": "%20",
+    "\t": "%09",
+    "\n": "%0A",
+    "\r": "%0D",
+}
+
+_ESCAPED_CHARACTERS_PATTERN = re.compile(
+    "|".join(re.escape(c) for c in _ESCAPED_CHARACTERS))
+
+
+def _escape(value):
+    if value is None:
+        return ""
+    return _ESCAPED_CHARACTERS_PATTERN.sub(
+        lambda match: _ESCAPED_CHARACTERS[match.group(0)], str(value))
+
+
+def _transcript_selection(transcript_filter):
+    """
+    Name of a transcript filter in the INFO header line: "all", the mode of
+    the filter, or "listed" for a collection of transcript IDs.
+    """
+    transcript_filter = normalize_transcript_filter(transcript_filter)
+    if transcript_filter is None:
+        return "all"
+    elif isinstance(transcript_filter, frozenset):
+        return "listed"
+    return transcript_filter
+
+
+def info_header_line(
+        info_field=DEFAULT_INFO_FIELD,
+        top_effect_only=False,
+        transcript_filter=None):
+    """
+    Header line describing the INFO field written by `annotate_vcf`, which
+    records whether all effects of each allele were added (see
+    `parse_effect_selection`).
+    """
+    from . import __version__
+    return (
+        '##INFO=<ID=%s,Number=.,Type=String,Description="Effects predicted '
+        'by varcode %s, sorted by priority for each allele. Effects: %s. '
+        'Transcripts: %s. Format: %s">' % (
+            info_field,
+            __version__,
+            "top" if top_effect_only else "all",
+            _transcript_selection(transcript_filter),
+            "|".join(EFFECT_FIELDS)))
+
+
+def parse_effect_selection(description):
+    """
+    Which effects of each allele an annotation INFO field contains, parsed
+    from the description in its header line: whether only the top effect
+    was added, and the transcript filter they were predicted with ("all",
+    "canonical", "coding" or "listed"). Fields whose description doesn't
+    say are assumed to contain all effects.
+    """
+    effects = re.search(r"Effects: (\w+)", description)
+    transcripts = re.search(r"Transcripts: (\w+)", description)
+    return (
+        effects is not None and effects.group(1) == "top",
+        "all" if transcripts is None else transcripts.group(1))
+
+
+def encode_effect_annotation(allele, effect):
+    """
+    Entry of an effect in the INFO field, with the fields of EFFECT_FIELDS.
+    """
+    transcript = getattr(effect, "transcript", None)
+    return "|".join(_escape(value) for value in [
+        allele,
+        effect.__class__.__name__,
+        effect.gene_name,
+        effect.gene_id,
+        effect.transcript_id,
+        effect.transcript_name,
+        None if transcript is None else transcript.biotype,
+        effect.short_description,
+        json.dumps(encode_effect(effect), separators=(",", ":")),
+    ])
+
+
+def _set_info_value(info, key, value):
+    """
+    INFO column with the value of a key replaced, added or (when the value
+    is None) removed.
+    """
+    entries = [
+        entry for entry in ([] if info == "." else info.split(";"))
+        if entry.split("=", 1)[0] != key
+    ]
+    if value is not None:
+        entries.append("%s=%s" % (key, value))
+    return ";".join(entries) if entries else "."
+
+
+def _is_annotated_allele(alt):
+    # missing, spanning deletion, symbolic and breakend alleles don't have
+    # sequences to predict effects from
+    return not (
+        alt in (".", "*") or
+        alt.startswith("<") or
+        "[" in alt or
+        "]" in alt)
+
+
+def _annotate_record(
+        line,
+        genome,
+        info_field,
+        transcript_filter,
+        top_effect_only,
+        only_passing,
+        raise_on_error,
+        allow_extended_nucleotides):
+    """
+    A line of a VCF with the effects of its alternate alleles in the INFO
+    column.
+    """
+    fields = line.rstrip("\r\n").split("\t")
+    if len(fields) < 8:
+        raise ValueError(
+            "Expected at least 8 columns in VCF record, got %d: %s" % (
+                len(fields), line))
+    (contig, position, _, ref, alts, _, filter_, info) = fields[:8]
+    if only_passing and filter_ not in (".", "PASS"):
+        return "\t".join(fields) + "\n"
+    annotations = []
+    for alt in alts.split(","):
+        if not _is_annotated_allele(alt):
+            continue
+        try:
+            variant = Variant(
+                contig,
+                int(position),
+                ref,
+                alt,
+                ensembl=genome,
+                allow_extended_nucleotides=allow_extended_nucleotides)
+        except ValueError as e:
+            if raise_on_error:
+                raise
+            logger.warning(
+                "Skipping allele %s of %s:%s: %s", alt, contig, position, e)
+            continue
+        if top_effect_only:
+            top_effect = variant.top_effect(
+                raise_on_error=raise_on_error,
+                transcript_filter=transcript_filter)
+            effects = [] if top_effect is None else [top_effect]
+        else:
+            effects = sorted(
+                predict_variant_effects(
+                    variant,
+                    raise_on_error=raise_on_error,
+                    transcript_filter=transcript_filter),
+                key=effect_sort_key,
+                reverse=True)
+        annotations.extend(
+            encode_effect_annotation(alt, effect) for effect in effects)
+    # annotations from an earlier run are replaced, or removed if the
+    # record no longer has any
+    fields[7] = _set_info_value(
+        info,
+        info_field,
+        ",".join(annotations) if annotations else None)
+    return "\t".join(fields) + "\n"
+
+
+def _annotate_records(lines, **kwargs):
+    return [_annotate_record(line, **kwargs) for line in lines]
+
+
+def _open_input(path):
+    """
+    Text file of a VCF, which is decompressed if it's gzipped (or bgzipped).
+    """
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    if compressed:
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return io.open(path, "r", encoding="utf-8")
+
+
+class _BgzfTextWriter(object):
+    """
+    Writes text to a bgzipped file, since Bio.bgzf.BgzfWriter can't be
+    wrapped in an io.TextIOWrapper.
+    """
+    def __init__(self, path):
+        from Bio import bgzf
+        self.writer = bgzf.BgzfWriter(path, "wb")
+
+    def write(self, text):
+        self.writer.write(text.encode("utf-8"))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+def _open_output(path):
+    """
+    Returns a file to write a VCF to, compressed with bgzip when the path
+    ends with .gz or .bgz, and whether it should be closed.
+    """
+    if path == "-":
+        return sys.stdout, False
+    if path.endswith(".gz") or path.endswith(".bgz"):
+        return _BgzfTextWriter(path), True
+    return io.open(path, "w", encoding="utf-8"), True
+
+
+def _read_header(
+        f,
+        genome,
+        reference_vcf_key,
+        info_field,
+        top_effect_only,
+        transcript_filter):
+    """
+    Read the header of a VCF, returning its lines with the INFO header line
+    of the annotations added (or replaced), and the genome of its variants.
+    """
+    meta_lines = []
+    reference_prefix = "##%s=" % reference_vcf_key
+    existing_info_prefix = "##INFO=<ID=%s," % info_field
+    reference_path = None
+    for line in f:
+        if line.startswith("##"):
+            if line.startswith(reference_prefix):
+                reference_path = line[len(reference_prefix):].strip()
+            if not line.startswith(existing_info_prefix):
+                meta_lines.append(line)
+        elif line.startswith("#"):
+            meta_lines.append(info_header_line(
+                info_field,
+                top_effect_only=top_effect_only,
+                transcript_filter=transcript_filter) + "\n")
+            meta_lines.append(line)
+            break
+        else:
+            raise ValueError("VCF is missing its #CHROM header line")
+    else:
+        raise ValueError("VCF is missing its #CHROM header line")
+    if genome:
+        genome = infer_genome(genome)
+    elif reference_path:
+        genome = infer_genome(reference_path)
+    else:
+        raise ValueError(
+            "Unable to infer reference genome of VCF, pass a genome")
+    return meta_lines, genome
+
+
+def _chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def annotate_vcf(
+        input_path,
+        output_path,
+        genome=None,
+        reference_vcf_key="reference",
+        info_field=DEFAULT_INFO_FIELD,
+        transcript_filter=None,
+        top_effect_only=False,
+        only_passing=False,
+        raise_on_error=False,
+        allow_extended_nucleotides=False,
+        n_jobs=1,
+        chunk_size=1000):
+    """
+    Copy a VCF, adding an INFO field with the predicted effects of each
+    record's alternate alleles. Each effect is encoded as the '|' separated
+    fields of EFFECT_FIELDS (percent encoded where needed), and the effects
+    of each allele are sorted by priority, highest first.
+
+    Parameters
+    ----------
+    input_path : str
+        Path to VCF, which can be gzipped or bgzipped.
+
+    output_path : str
+        Output path, or "-" for stdout. Paths ending in .gz or .bgz are
+        compressed with bgzip, so that they can be indexed with tabix.
+
+    genome : {pyensembl.Genome, reference name, Ensembl version int}, optional
+        Genome of the variants, otherwise inferred from the header line
+        named by `reference_vcf_key`.
+
+    info_field : str, optional
+        Key of the INFO field, which replaces an existing field with the
+        same key.
+
+    transcript_filter : str or collection of str, optional
+        See `VariantCollection.effects`.
+
+    top_effect_only : bool, optional
+        Only add the highest priority effect of each allele.
+
+    only_passing : bool, optional
+        Don't annotate records which failed filters (they're still copied).
+
+    raise_on_error : bool, optional
+        Raise when an effect can't be predicted or an allele isn't valid,
+        instead of adding a Failure effect or skipping the allele.
+
+    allow_extended_nucleotides : bool, optional
+
+    n_jobs : int, optional
+        Number of worker processes which annotate chunks of records, which
+        are written in their original order.
+
+    chunk_size : int, optional
+        Number of records annotated at once.
+
+    Returns the number of records written.
+    """
+    f = _open_input(input_path)
+    try:
+        header_lines, genome = _read_header(
+            f,
+            genome,
+            reference_vcf_key,
+            info_field,
+            top_effect_only=top_effect_only,
+            transcript_filter=transcript_filter)
+        out, close = _open_output(output_path)
+        try:
+            out.writelines(header_lines)
+            n_records = 0
+            for lines in map_chunks_in_order(
+                    _annotate_records,
+                    _chunks((line for line in f if line.strip()), chunk_size),
+                    n_jobs=n_jobs,
+                    genome=genome,
+                    info_field=info_field,
+                    transcript_filter=transcript_filter,
+                    top_effect_only=top_effect_only,
+                    only_passing=only_passing,
+                    raise_on_error=raise_on_error,
+                    allow_extended_nucleotides=allow_extended_nucleotides):
+                out.writelines(lines)
+                n_records += len(lines)
+        finally:
+            if close:
+                out.close()
+            else:
+                out.flush()
+    finally:
+        f.close()
+    return n_records
+
+
+def parse_annotation_fields(description):
+    """
+    Names of the '|' separated fields of an annotation INFO field, parsed
+    from the description in its header line: "... Format: A|B|C" as
+    written by varcode and VEP, or "... 'A | B | C'" as written by SnpEff.
+    Returns None if the description doesn't list them.
+    """
+    match = re.search(r"Format:\s*([^\s'\"]+)", description)
+    if match is None:
+        match = re.search(r"'([^']*\|[^']*)'", description)
+    if match is None:
+        return None
+    return [field.strip() for field in match.group(1).split("|")]
+
+
+def _info_value(info, key):
+    """
+    Unparsed value of a key in an INFO column, or None if it's missing.
+    """
+    prefix = key + "="
+    for entry in info.split(";"):
+        if entry.startswith(prefix):
+            return entry[len(prefix):]
+    return None
+
+
+class AnnotationLayout(object):
+    """
+    Where the effects of each allele are stored in an annotation INFO field.
+    The defaults describe the field written by `annotate_vcf`, others (such
+    as SnpEff's ANN or VEP's CSQ) need an INFO key and, unless their fields
+    are listed in the header line, the names of their fields.
+
+    Only layouts with a field of encoded effects (as written by varcode) let
+    effects be reconstructed without predicting them. The entries of other
+    layouts can still be read with `StoredEffects.annotations`.
+    """
+    def __init__(
+            self,
+            info_field=DEFAULT_INFO_FIELD,
+            fields=None,
+            allele_field="Allele",
+            encoded_field="Encoded"):
+        """
+        Parameters
+        ----------
+        info_field : str
+            Key of the INFO field, e.g. "ANN" or "CSQ".
+
+        fields : list of str, optional
+            Names of the '|' separated fields of each entry, by default
+            parsed from the description of the field's header line.
+
+        allele_field : str, optional
+            Field with the alternate allele of each entry, which is only
+            used for records with more than one alternate allele.
+
+        encoded_field : str, optional
+            Field with the JSON encoded effect of each entry.
+        """
+        self.info_field = info_field
+        self.fields = fields
+        self.allele_field = allele_field
+        self.encoded_field = encoded_field
+
+    def __str__(self):
+        return "AnnotationLayout(info_field='%s', fields=%s)" % (
+            self.info_field, self.fields)
+
+    def __repr__(self):
+        return str(self)
+
+
+class StoredEffects(object):
+    """
+    Effects stored in an annotation INFO field of a VCF for the variants
+    loaded from it. The field's value is kept as a string for each variant,
+    and only parsed and decoded once the variant's effects are needed.
+
+    Has the `get` and `put` methods of `EffectCache` and is used like one by
+    `VariantCollection.effects`, so that variants whose stored effects can't
+    be reconstructed (e.g. their transcripts aren't in the current
+    annotation release, or an effect failed when they were annotated) are
+    predicted as usual. Fields which only contain some of the effects of
+    each variant (only the top effect, or the effects on some transcripts)
+    are never used in place of all of them.
+    """
+    def __init__(
+            self,
+            layout,
+            fields,
+            top_effect_only=False,
+            transcript_selection="all"):
+        self.layout = layout
+        self.fields = list(fields)
+        self.top_effect_only = top_effect_only
+        self.transcript_selection = transcript_selection
+        self._allele_index = self._field_index(layout.allele_field)
+        self._encoded_index = self._field_index(layout.encoded_field)
+        # variant -> (alternate allele if the record had several, value)
+        self._values = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _field_index(self, name):
+        return self.fields.index(name) if name in self.fields else None
+
+    def __str__(self):
+        return (
+            "StoredEffects(info_field='%s', variants=%d, hits=%d, "
+            "misses=%d)" % (
+                self.layout.info_field, len(self), self.hits, self.misses))
+
+    def __repr__(self):
+        return str(self)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, variant):
+        return variant in self._values
+
+    @property
+    def complete(self):
+        """
+        Whether all effects of each variant were stored.
+        """
+        return not self.top_effect_only and self.transcript_selection == "all"
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of lookups whose effects were decoded from the VCF.
+        """
+        n_lookups = self.hits + self.misses
+        if n_lookups == 0:
+            return 0.0
+        return self.hits / n_lookups
+
+    def add(self, variant, info, allele=None):
+        """
+        Keep the value of the annotation field in a variant's INFO column,
+        if it has one. The allele is only needed for records with more than
+        one alternate allele, whose entries are told apart by it.
+        """
+        value = None if info in (None, ".") else _info_value(
+            info, self.layout.info_field)
+        if value:
+            self._values[variant] = (allele, value)
+
+    def annotations(self, variant):
+        """
+        Stored entries for a variant's allele, as dictionaries from field
+        names to (percent decoded) values.
+        """
+        if variant not in self._values:
+            return []
+        (allele, value) = self._values[variant]
+        entries = []
+        for entry in value.split(","):
+            values = [unquote(field) for field in entry.split("|")]
+            if (allele is not None and
+                    self._allele_index is not None and
+                    self._allele_index < len(values) and
+                    values[self._allele_index] != allele):
+                continue
+            entries.append(dict(zip(self.fields, values)))
+        return entries
+
+    def decode(self, variant):
+        """
+        Effects of a variant reconstructed from its stored annotations, or
+        None if it has none or they can't be used.
+        """
+        if self._encoded_index is None or variant not in self._values:
+            return None
+        entries = self.annotations(variant)
+        if len(entries) == 0:
+            return None
+        try:
+            effects = [
+                decode_effect(
+                    json.loads(entry[self.layout.encoded_field]), variant)
+                for entry in entries
+            ]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.debug(
+                "Can't decode stored effects of %s: %s", variant, e)
+            return None
+        if any(isinstance(effect, Failure) for effect in effects):
+            # failures depend on whether errors were being raised
+            return None
+        return effects
+
+    def get(self, variant):
+        """
+        Returns the list of stored effects of the variant, or None if they
+        have to be predicted.
+        """
+        effects = self.decode(variant) if self.complete else None
+        with self._lock:
+            if effects is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return effects
+
+    def put(self, variant, effects):
+        """
+        Predicted effects aren't added to the VCF they were loaded from.
+        """
+        pass
+
+
+def stored_effects_for_vcf(infos, stored_effects):
+    """
+    StoredEffects for loading a VCF with the given INFO header lines (as
+    parsed by pyvcf) from the `stored_effects` argument of `load_vcf`: True
+    for the field written by `annotate_vcf`, the key of an INFO field or an
+    AnnotationLayout.
+    """
+    if isinstance(stored_effects, AnnotationLayout):
+        layout = stored_effects
+    elif stored_effects is True:
+        layout = AnnotationLayout()
+    else:
+        layout = AnnotationLayout(info_field=stored_effects)
+    fields = layout.fields
+    if fields is None:
+        if layout.info_field not in infos:
+            raise ValueError(
+                "VCF doesn't have a header line for the INFO field %s" % (
+                    layout.info_field,))
+        fields = parse_annotation_fields(infos[layout.info_field].desc or "")
+        if fields is None:
+            raise ValueError(
+                "Can't find the fields of %s in its header line, give them "
+                "with AnnotationLayout(fields=...)" % layout.info_field)
+    top_effect_only, transcript_selection = False, "all"
+    if layout.info_field in infos:
+        top_effect_only, transcript_selection = parse_effect_selection(
+            infos[layout.info_field].desc or "")
+    stored_effects = StoredEffects(
+        layout,
+        fields,
+        top_effect_only=top_effect_only,
+        transcript_selection=transcript_selection)
+    if not stored_effects.complete:
+        logger.warning(
+            "INFO field %s only has %s effects on %s transcripts, which "
+            "won't be used in place of predicting all effects",
+            layout.info_field,
+            "top" if top_effect_only else "all",
+            transcript_selection)
+    return stored_effects
+
+
+def _effect_keys(effects):
+    return sorted(
+        json.dumps(encode_effect(effect), sort_keys=True)
+        for effect in effects)
+
+
+def _predict_stored_selection(variant, store):
+    """
+    Effects of a variant predicted the same way as those in a StoredEffects.
+    """
+    if store.transcript_selection == "listed":
+        raise ValueError(
+            "Can't check effects stored for a list of transcripts, which "
+            "isn't recorded in the VCF")
+    transcript_filter = (
+        None if store.transcript_selection == "all"
+        else store.transcript_selection)
+    if store.top_effect_only:
+        top_effect = variant.top_effect(
+            raise_on_error=False, transcript_filter=transcript_filter)
+        return [] if top_effect is None else [top_effect]
+    return list(predict_variant_effects(
+        variant, raise_on_error=False, transcript_filter=transcript_filter))
+
+
+def check_stored_effects(variants, sample_size=100, random_seed=None):
+    """
+    Predict the effects of a random sample of variants which were loaded
+    with stored effects (see `load_vcf`), and compare them to the stored
+    ones, e.g. to check that a VCF was annotated with the same release of
+    the annotation as the variants' genome. Effects are predicted for the
+    same selection as the stored ones (e.g. only the top effect).
+
+    Parameters
+    ----------
+    variants : VariantCollection
+
+    sample_size : int, optional
+        Number of variants to predict the effects of.
+
+    random_seed : int, optional
+
+    Returns a list with a (variant, stored effects, predicted effects)
+    triplet for each sampled variant whose stored effects differ from the
+    predicted ones, or couldn't be decoded (in which case they're None).
+    """
+    stores = variants.stored_effects
+    if len(stores) == 0:
+        raise ValueError(
+            "%s wasn't loaded with stored effects" % (variants,))
+    candidates = []
+    for variant in variants:
+        for store in stores:
+            if variant in store:
+                candidates.append((variant, store))
+                break
+    sample = random.Random(random_seed).sample(
+        candidates, min(sample_size, len(candidates)))
+    mismatches = []
+    for (variant, store) in sample:
+        stored = store.decode(variant)
+        predicted = _predict_stored_selection(variant, store)
+        if stored is None or _effect_keys(stored) != _effect_keys(predicted):
+            mismatches.append((variant, stored, predicted))
+    return mismatches